@@ -0,0 +1,363 @@
+"""ai_connections.py
+Gestor de conexiones HTTP persistentes por proveedor de IA.
+
+Mantiene sesiones `requests`, clientes `httpx` y clientes OpenAI de larga vida
+indexados por proveedor, URL base y API key, de modo que cada llamada reutiliza
+conexiones TCP+TLS ya abiertas en lugar de negociar un handshake nuevo.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+AI_HTTP_POOL_SIZE = int(os.getenv("AI_HTTP_POOL_SIZE", "10"))
+AI_HTTP_IDLE_TIMEOUT_SECONDS = float(os.getenv("AI_HTTP_IDLE_TIMEOUT_SECONDS", "90"))
+
+
+def _fingerprint_api_key(api_key):
+    """Evita guardar la API key en claro dentro de las llaves del pool."""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class ProviderConnectionManager:
+    """Pool de conexiones reutilizables para los proveedores de IA."""
+
+    def __init__(self, pool_size=AI_HTTP_POOL_SIZE, idle_timeout=AI_HTTP_IDLE_TIMEOUT_SECONDS):
+        self.pool_size = max(1, int(pool_size))
+        self.idle_timeout = max(1.0, float(idle_timeout))
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._http_clients = {}
+        self._async_clients = {}
+        self._openai_clients = {}
+        self._async_openai_clients = {}
+        self._counters = {}
+
+    # --- Contadores -------------------------------------------------------
+
+    def _counter(self, provider):
+        counter = self._counters.get(provider)
+        if counter is None:
+            counter = {"requests": 0, "handshakes": 0, "tls_handshakes": 0}
+            self._counters[provider] = counter
+        return counter
+
+    def _count(self, provider, field, amount=1):
+        with self._lock:
+            self._counter(provider)[field] += amount
+
+    def _build_sync_trace(self, provider):
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                self._count(provider, "handshakes")
+            elif event_name == "connection.start_tls.complete":
+                self._count(provider, "tls_handshakes")
+
+        return trace
+
+    def _build_async_trace(self, provider):
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                self._count(provider, "handshakes")
+            elif event_name == "connection.start_tls.complete":
+                self._count(provider, "tls_handshakes")
+
+        return trace
+
+    def _build_httpx_limits(self):
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.idle_timeout,
+        )
+
+    # --- requests ---------------------------------------------------------
+
+    def _harvest_session_counters(self, provider, session):
+        """Acumula los contadores de urllib3 antes de descartar una sesión."""
+        stats = self._describe_session(session)
+        counter = self._counter(provider)
+        counter["requests"] += stats["requests"]
+        counter["handshakes"] += stats["handshakes"]
+
+    def get_session(self, provider, base_url, api_key):
+        """Retorna una requests.Session con pool keep-alive para el proveedor."""
+        key = (provider, base_url, _fingerprint_api_key(api_key))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry and now - entry["last_used"] > self.idle_timeout:
+                # urllib3 no expira conexiones ociosas; el servidor probablemente
+                # ya las cerró, así que se recicla la sesión completa.
+                self._harvest_session_counters(provider, entry["session"])
+                entry["session"].close()
+                entry = None
+
+            if entry is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                entry = {"session": session, "last_used": now}
+                self._sessions[key] = entry
+                logger.info("Pool HTTP creado para %s (%s)", provider, base_url)
+
+            entry["last_used"] = now
+            return entry["session"]
+
+    @staticmethod
+    def _describe_session(session):
+        stats = {"requests": 0, "handshakes": 0, "idle_connections": 0}
+        # El mismo adapter está montado para http y https; se cuenta una vez.
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is None:
+                continue
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                stats["requests"] += getattr(pool, "num_requests", 0)
+                stats["handshakes"] += getattr(pool, "num_connections", 0)
+                idle_queue = getattr(pool, "pool", None)
+                if idle_queue is not None:
+                    stats["idle_connections"] += sum(
+                        1 for conn in list(idle_queue.queue) if conn is not None
+                    )
+        return stats
+
+    # --- httpx / OpenAI ---------------------------------------------------
+
+    def _get_http_client(self, provider, base_url, api_key):
+        key = (provider, base_url, _fingerprint_api_key(api_key))
+        with self._lock:
+            client = self._http_clients.get(key)
+            if client is None or client.is_closed:
+                trace = self._build_sync_trace(provider)
+
+                def install_trace(request):
+                    request.extensions["trace"] = trace
+                    self._count(provider, "requests")
+
+                client = httpx.Client(
+                    limits=self._build_httpx_limits(),
+                    event_hooks={"request": [install_trace]},
+                )
+                self._http_clients[key] = client
+            return client
+
+    def get_async_client(self, provider, base_url, api_key):
+        """Retorna un httpx.AsyncClient persistente ligado al event loop actual."""
+        loop = asyncio.get_running_loop()
+        key = (provider, base_url, _fingerprint_api_key(api_key), id(loop))
+        with self._lock:
+            entry = self._async_clients.get(key)
+            if entry and (entry["loop"] is not loop or entry["client"].is_closed):
+                entry = None
+
+            if entry is None:
+                self._drop_clients_for_closed_loops()
+                trace = self._build_async_trace(provider)
+
+                async def install_trace(request):
+                    request.extensions["trace"] = trace
+                    self._count(provider, "requests")
+
+                client = httpx.AsyncClient(
+                    limits=self._build_httpx_limits(),
+                    event_hooks={"request": [install_trace]},
+                )
+                entry = {"client": client, "loop": loop}
+                self._async_clients[key] = entry
+                logger.info("Pool HTTP asíncrono creado para %s (%s)", provider, base_url)
+
+            return entry["client"]
+
+    def _drop_clients_for_closed_loops(self):
+        for registry in (self._async_clients, self._async_openai_clients):
+            for key, entry in list(registry.items()):
+                if entry["loop"].is_closed():
+                    registry.pop(key, None)
+
+    def get_openai_client(self, provider, base_url, api_key):
+        """Retorna un cliente OpenAI reutilizable que comparte el pool httpx del proveedor."""
+        from openai import OpenAI
+
+        key = (provider, base_url, _fingerprint_api_key(api_key))
+        http_client = self._get_http_client(provider, base_url, api_key)
+        with self._lock:
+            client = self._openai_clients.get(key)
+            if client is None:
+                client = OpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+                self._openai_clients[key] = client
+            return client
+
+    def get_async_openai_client(self, provider, base_url, api_key):
+        """Retorna un AsyncOpenAI reutilizable ligado al event loop actual."""
+        from openai import AsyncOpenAI
+
+        loop = asyncio.get_running_loop()
+        key = (provider, base_url, _fingerprint_api_key(api_key), id(loop))
+        http_client = self.get_async_client(provider, base_url, api_key)
+        with self._lock:
+            entry = self._async_openai_clients.get(key)
+            if entry is None or entry["loop"] is not loop:
+                entry = {
+                    "client": AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client),
+                    "loop": loop,
+                }
+                self._async_openai_clients[key] = entry
+            return entry["client"]
+
+    # --- Métricas y cierre ------------------------------------------------
+
+    @staticmethod
+    def _describe_httpx_client(client):
+        """Cuenta conexiones abiertas del pool httpcore, si la versión lo expone."""
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return 0, 0
+
+        active = 0
+        idle = 0
+        for connection in list(connections):
+            try:
+                if connection.is_closed():
+                    continue
+                if connection.is_idle():
+                    idle += 1
+                else:
+                    active += 1
+            except Exception:
+                continue
+        return active, idle
+
+    def get_stats(self):
+        """Resume conexiones abiertas, reutilización y handshakes por proveedor."""
+        with self._lock:
+            providers = {}
+
+            def provider_stats(provider):
+                stats = providers.get(provider)
+                if stats is None:
+                    counter = self._counter(provider)
+                    stats = {
+                        "requests": counter["requests"],
+                        "handshakes": counter["handshakes"],
+                        "tls_handshakes": counter["tls_handshakes"],
+                        "active_connections": 0,
+                        "idle_connections": 0,
+                    }
+                    providers[provider] = stats
+                return stats
+
+            for (provider, _base_url, _fingerprint), entry in self._sessions.items():
+                stats = provider_stats(provider)
+                session_stats = self._describe_session(entry["session"])
+                stats["requests"] += session_stats["requests"]
+                stats["handshakes"] += session_stats["handshakes"]
+                stats["idle_connections"] += session_stats["idle_connections"]
+
+            http_clients = [(key[0], client) for key, client in self._http_clients.items()]
+            http_clients.extend(
+                (key[0], entry["client"]) for key, entry in self._async_clients.items()
+            )
+            for provider, client in http_clients:
+                stats = provider_stats(provider)
+                active, idle = self._describe_httpx_client(client)
+                stats["active_connections"] += active
+                stats["idle_connections"] += idle
+
+            for provider in self._counters:
+                provider_stats(provider)
+
+        totals = {
+            "requests": 0,
+            "handshakes": 0,
+            "active_connections": 0,
+            "idle_connections": 0,
+        }
+        for stats in providers.values():
+            stats["reuse_ratio"] = _reuse_ratio(stats["requests"], stats["handshakes"])
+            for field in totals:
+                totals[field] += stats[field]
+
+        totals["reuse_ratio"] = _reuse_ratio(totals["requests"], totals["handshakes"])
+        return {
+            "pool_size": self.pool_size,
+            "idle_timeout_seconds": self.idle_timeout,
+            "providers": providers,
+            **totals,
+        }
+
+    def close(self):
+        """Cierra sesiones y clientes síncronos."""
+        with self._lock:
+            for (provider, _base_url, _fingerprint), entry in self._sessions.items():
+                self._harvest_session_counters(provider, entry["session"])
+                entry["session"].close()
+            self._sessions.clear()
+            for client in self._http_clients.values():
+                client.close()
+            self._http_clients.clear()
+            self._openai_clients.clear()
+
+    async def aclose(self):
+        """Cierra también los clientes asíncronos del event loop actual."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            async_entries = [
+                (key, entry) for key, entry in self._async_clients.items()
+                if entry["loop"] is loop
+            ]
+            for key, _entry in async_entries:
+                self._async_clients.pop(key, None)
+            for key, entry in list(self._async_openai_clients.items()):
+                if entry["loop"] is loop:
+                    self._async_openai_clients.pop(key, None)
+
+        for _key, entry in async_entries:
+            await entry["client"].aclose()
+        self.close()
+
+
+def _reuse_ratio(request_count, handshake_count):
+    if request_count <= 0:
+        return 0.0
+    return round(max(0.0, 1 - (handshake_count / request_count)), 3)
+
+
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+
+
+def get_connection_manager():
+    """Retorna el gestor de conexiones compartido del proceso."""
+    global _connection_manager
+    if _connection_manager is None:
+        with _connection_manager_lock:
+            if _connection_manager is None:
+                _connection_manager = ProviderConnectionManager()
+    return _connection_manager
+
+
+def get_connection_pool_stats():
+    return get_connection_manager().get_stats()
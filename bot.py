@@ -1,8 +1,9 @@
 import os
-import multiprocessing
+import asyncio
+import heapq
+import io
 import logging
 import json
-import queue
 import re
 import shutil
 import tempfile
@@ -17,32 +18,53 @@ from datetime import datetime, timedelta
 from dateutil import rrule
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters, CommandHandler, CallbackQueryHandler
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import (ApplicationBuilder, BaseUpdateProcessor, CallbackQueryHandler, CommandHandler,
+                          ContextTypes, MessageHandler, filters)
 
+from ai_connections import get_connection_manager, get_connection_pool_stats
 from brain import (
+    async_process_notes_query,
+    async_process_user_input,
+    VIDEO_HISTORY_MESSAGES,
+    async_process_video_summary,
+    build_history_digest,
+    get_ai_configuration,
     get_all_ai_configurations,
     get_default_ai_settings,
     get_last_brain_failure,
     is_transient_brain_failure,
-    process_notes_query,
-    process_user_input,
-    process_video_summary,
     process_vision_input,
     request_ai_text,
 )
 from database import (AI_ANALYSIS_CAPABILITY, AI_CAPABILITY_ORDER,
                       AI_TEXT_CAPABILITY, AI_TRANSCRIPT_CAPABILITY,
-                      AI_VISION_CAPABILITY, UNCATEGORIZED_LABEL,
+                      AI_VISION_CAPABILITY, DUE_REMINDERS_QUERY, UNCATEGORIZED_LABEL,
                       activate_ai_model, add_reminder, create_note,
                       delete_reminder_by_text, ensure_default_ai_settings,
-                      get_ai_model_by_id, get_connection, get_notes_by_user,
-                      get_saved_ai_models, get_supported_ai_providers_for_capability,
+                      get_ai_model_by_id, get_connection, get_notes_by_ids,
+                      get_notes_by_user,
+                      get_pending_reminder_schedule, get_saved_ai_models, get_supported_ai_providers_for_capability,
                       get_today_reminders, get_user_reminders,
                       get_users_with_daily_summary, normalize_note_category,
-                      save_ai_model, set_daily_summary, update_reminder_by_id)
-from repo_analysis_worker import run_repository_analysis_worker
-from video_handler import MAX_AUDIO_SIZE_BYTES, extract_x_url, download_audio, transcribe_audio, cleanup_audio
-from repo_handler import extract_github_repo_url
+                      get_reminders_version, register_reminder_change_listener,
+                      save_ai_model, search_notes, set_daily_summary,
+                      update_reminder_by_id)
+from note_vectors import get_note_vector_index
+from media_executor import MediaJobError, get_media_executor
+from media_cache import (MEDIA_KIND_LANGUAGES, MEDIA_KIND_METADATA, MEDIA_KIND_SUMMARY,
+                         MEDIA_KIND_TRANSCRIPT, build_summary_variant, get_media_cache_stats,
+                         get_media_entry, store_media_entry)
+from repo_analysis_cache import build_analysis_cache_key, get_cached_repo_analysis, get_repo_cache_stats
+from repo_analysis_worker import build_repo_analysis_model_key, build_repo_history_digest
+from repo_worker_pool import get_repo_worker_pool
+from single_flight import SingleFlight
+from video_handler import (extract_x_url, extract_x_status_id, download_audio, get_audio_mime_type,
+                           transcribe_audio, cleanup_audio)
+from transcription_service import (MAX_AUDIO_SIZE_BYTES, MAX_LONG_AUDIO_SIZE_BYTES,
+                                   async_transcribe_audio_with_active_provider,
+                                   supports_in_memory_transcription)
+from repo_handler import extract_github_repo_url, normalize_github_repo_url, resolve_github_head_sha
 from youtube_handler import (
     fetch_available_languages as fetch_youtube_available_languages,
     fetch_transcript_by_lang as fetch_youtube_transcript_by_lang,
@@ -58,8 +80,16 @@ LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/clusivai-bot.log")
 LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", "1048576"))
 LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
 REMINDER_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
-CHECK_REMINDERS_INTERVAL_SECONDS = int(os.getenv("CHECK_REMINDERS_INTERVAL_SECONDS", "15"))
-CHECK_REMINDERS_FIRST_DELAY_SECONDS = int(os.getenv("CHECK_REMINDERS_FIRST_DELAY_SECONDS", "3"))
+REMINDER_EXTERNAL_SYNC_SECONDS = int(os.getenv("REMINDER_EXTERNAL_SYNC_SECONDS", "15"))
+REMINDER_RETRY_DELAY_SECONDS = int(os.getenv("REMINDER_RETRY_DELAY_SECONDS", "15"))
+NOTES_QUERY_TOP_K = int(os.getenv("NOTES_QUERY_TOP_K", "12"))
+STREAM_EDIT_INTERVAL_MS = int(os.getenv("STREAM_EDIT_INTERVAL_MS", "1500"))
+BOT_MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "32"))
+# Updates aceptados a la vez, contando los que esperan su turno detrás de otro del mismo usuario.
+BOT_MAX_PENDING_UPDATES = int(os.getenv("BOT_MAX_PENDING_UPDATES", str(BOT_MAX_CONCURRENT_UPDATES * 8)))
+STREAM_PREVIEW_MAX_CHARS = int(os.getenv("STREAM_PREVIEW_MAX_CHARS", "3800"))
+NOTES_RRF_K = int(os.getenv("NOTES_RRF_K", "60"))
+NOTE_VECTOR_BACKFILL_SECONDS = int(os.getenv("NOTE_VECTOR_BACKFILL_SECONDS", "900"))
 MAX_RECURRING_SEND_DELAY_SECONDS = int(os.getenv("MAX_RECURRING_SEND_DELAY_SECONDS", "180"))
 AI_PENDING_MODEL_KEY = 'ai_pending_model_entry'
 AI_CALLBACK_PREFIX = 'ai:'
@@ -87,6 +117,7 @@ LINK_REMINDER_FLOW_KEY = 'link_reminder_flow'
 LINK_ACTION_TTL_MINUTES = 60
 LINK_REMINDER_DATE_PAGE_SIZE = 14
 REMINDER_CALLBACK_PREFIX = 'rem:'
+MEDIA_CANCEL_CALLBACK_PREFIX = 'media_cancel:'
 PENDING_REMINDER_ITEMS_KEY = 'pending_reminder_items'
 REMINDER_FLOW_KEY = 'reminder_flow'
 REMINDER_ACTION_TTL_MINUTES = LINK_ACTION_TTL_MINUTES
@@ -586,27 +617,13 @@ def get_active_repo_analysis_by_user(application):
 
 
 def stop_repo_analysis_process(state):
-    process = state.get('process')
-    if not process:
-        return
+    """Cancela el trabajo en el pool (en cola o en curso) y despierta a su consumidor."""
+    if state.get('submitted'):
+        get_repo_worker_pool().cancel(state['analysis_id'])
 
-    if process.is_alive():
-        process.terminate()
-        process.join(timeout=1)
-        if process.is_alive():
-            process.kill()
-            process.join(timeout=1)
-
-    progress_queue = state.get('queue')
-    if progress_queue is not None:
-        try:
-            progress_queue.close()
-        except Exception:
-            pass
-        try:
-            progress_queue.join_thread()
-        except Exception:
-            pass
+    events = state.get('events')
+    if events is not None:
+        events.put_nowait(None)
 
 
 def remove_repo_analysis_state(application, analysis_id: str, *, stop_process: bool):
@@ -643,24 +660,23 @@ async def update_repo_status_message(bot, state, text, reply_markup=None):
         logging.warning("No se pudo actualizar el estado del análisis %s: %s", state['analysis_id'], exc)
 
 
-async def finish_repo_analysis(context: ContextTypes.DEFAULT_TYPE, analysis_id: str, result: dict):
-    application = context.application
+async def finish_repo_analysis(application, analysis_id: str, result: dict):
     state = remove_repo_analysis_state(application, analysis_id, stop_process=True)
     if not state:
         return
 
     status = result.get('status')
     if status == 'completed':
-        await update_repo_status_message(context.bot, state, "✅ Análisis del repositorio finalizado.")
+        await update_repo_status_message(application.bot, state, "✅ Análisis del repositorio finalizado.")
 
         response_text = result.get('response_text') or "⚠️ El análisis terminó sin contenido para mostrar."
         if len(response_text) > 4096:
             for chunk in split_message(response_text, 4096):
-                await context.bot.send_message(chat_id=state['chat_id'], text=chunk)
+                await application.bot.send_message(chat_id=state['chat_id'], text=chunk)
         else:
-            await context.bot.send_message(chat_id=state['chat_id'], text=response_text)
+            await application.bot.send_message(chat_id=state['chat_id'], text=response_text)
 
-        user_data = context.application.user_data[state['user_id']]
+        user_data = application.user_data[state['user_id']]
         user_data.setdefault('history', [])
 
         extra_text = state['user_text'].replace(state['url'], '').strip() if state.get('user_text') else ''
@@ -692,64 +708,57 @@ async def finish_repo_analysis(context: ContextTypes.DEFAULT_TYPE, analysis_id:
     error_message = result.get('error_message') or (
         "No pude analizar ese repositorio de GitHub en este momento. Intenta de nuevo más tarde."
     )
-    await update_repo_status_message(context.bot, state, f"❌ {error_message}")
+    await update_repo_status_message(application.bot, state, f"❌ {error_message}")
 
 
-async def poll_repo_analysis_updates(context: ContextTypes.DEFAULT_TYPE):
-    analyses = list(get_active_repo_analyses(context.application).items())
+REPO_ANALYSIS_WORKER_DIED_MESSAGE = "El análisis del repositorio terminó de forma inesperada. Intenta de nuevo."
 
-    for analysis_id, state in analyses:
-        progress_queue = state.get('queue')
-        if progress_queue is None:
-            continue
 
-        while True:
-            try:
-                event = progress_queue.get_nowait()
-            except queue.Empty:
-                break
-            except Exception as exc:
-                logging.error("Error leyendo cola del análisis %s: %s", analysis_id, exc, exc_info=True)
+async def consume_repo_analysis_events(application, analysis_id: str, events):
+    """Aplica los eventos del worker a medida que llegan; no hay trabajo periódico."""
+    while True:
+        event = await events.get()
+
+        # Solo se aplica el último estado de lo que ya está en cola: una edición por lote.
+        latest_status_text = None
+        while event is not None:
+            state = get_active_repo_analyses(application).get(analysis_id)
+            if not state:
+                return
+
+            event_type = event.get('type')
+            if event_type == 'progress':
+                latest_status_text = event.get('text', '⏳ Analizando el repositorio...')
+            elif event_type == 'stream':
+                latest_status_text = build_stream_preview(
+                    f"{event.get('title', '🧩 Redactando la explicación final...')}\n\n{event.get('text', '')}"
+                )
+            elif event_type == 'result':
+                await finish_repo_analysis(application, analysis_id, event)
+                return
+            elif event_type == 'eof':
                 await finish_repo_analysis(
-                    context,
+                    application,
                     analysis_id,
-                    {
-                        'status': 'failed',
-                        'error_message': (
-                            "No pude continuar el análisis del repositorio. Intenta de nuevo más tarde."
-                        ),
-                    },
+                    {'status': 'failed', 'error_message': REPO_ANALYSIS_WORKER_DIED_MESSAGE},
                 )
-                break
+                return
 
-            if event.get('type') == 'progress':
-                await update_repo_status_message(
-                    context.bot,
-                    state,
-                    event.get('text', '⏳ Analizando el repositorio...'),
-                    reply_markup=build_repo_cancel_markup(analysis_id),
-                )
-            elif event.get('type') == 'result':
-                await finish_repo_analysis(context, analysis_id, event)
+            try:
+                event = events.get_nowait()
+            except asyncio.QueueEmpty:
                 break
 
-        current_state = get_active_repo_analyses(context.application).get(analysis_id)
-        if not current_state:
-            continue
+        state = get_active_repo_analyses(application).get(analysis_id)
+        if event is None or not state:
+            return
 
-        process = current_state.get('process')
-        if process and not process.is_alive() and current_state.get('status') != 'running':
-            remove_repo_analysis_state(context.application, analysis_id, stop_process=True)
-        elif process and not process.is_alive():
-            await finish_repo_analysis(
-                context,
-                analysis_id,
-                {
-                    'status': 'failed',
-                    'error_message': (
-                        "El análisis del repositorio terminó de forma inesperada. Intenta de nuevo."
-                    ),
-                },
+        if latest_status_text:
+            await update_repo_status_message(
+                application.bot,
+                state,
+                latest_status_text,
+                reply_markup=build_repo_cancel_markup(analysis_id),
             )
 
 
@@ -930,6 +939,38 @@ def build_ai_status_text(notice=None):
             f"{get_ai_provider_label(config['provider'])} · {config['model_name']}{suffix}"
         )
 
+    pool_stats = get_connection_pool_stats()
+    if pool_stats["requests"]:
+        lines.extend([
+            "",
+            f"🔌 Conexiones: {pool_stats['active_connections']} activas, "
+            f"{pool_stats['idle_connections']} ociosas · "
+            f"reutilización {pool_stats['reuse_ratio']:.0%} · "
+            f"{pool_stats['handshakes']} handshakes / {pool_stats['requests']} requests",
+        ])
+
+    repo_cache_stats = get_repo_cache_stats()
+    analysis_cache = repo_cache_stats["analysis"]
+    chunk_cache = repo_cache_stats["chunk"]
+    if analysis_cache["hits"] + analysis_cache["misses"] + chunk_cache["hits"] + chunk_cache["misses"]:
+        lines.extend([
+            "",
+            f"🗂️ Caché de repos: análisis {analysis_cache['hit_rate']:.0%} aciertos "
+            f"({analysis_cache['entries']} guardados) · partes {chunk_cache['hit_rate']:.0%} aciertos · "
+            f"{repo_cache_stats['size_bytes'] / (1024 * 1024):.1f} MB",
+        ])
+
+    media_cache_stats = get_media_cache_stats()
+    transcript_cache = media_cache_stats["transcript"]
+    summary_cache = media_cache_stats["summary"]
+    if transcript_cache["hits"] + transcript_cache["misses"] + summary_cache["hits"] + summary_cache["misses"]:
+        lines.extend([
+            "",
+            f"🎞️ Caché de videos: transcripciones {transcript_cache['hit_rate']:.0%} aciertos "
+            f"({transcript_cache['entries']} guardadas) · resúmenes {summary_cache['hit_rate']:.0%} aciertos · "
+            f"{media_cache_stats['size_bytes'] / (1024 * 1024):.1f} MB",
+        ])
+
     if notice:
         lines.extend(["", notice])
 
@@ -1275,7 +1316,7 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
     cursor = conn.cursor()
     
     # Buscamos tareas pendientes cuya fecha ya pasó - INCLUIMOS image_file_id
-    cursor.execute('SELECT id, user_id, message, remind_at, recurrence, image_file_id FROM reminders WHERE remind_at <= ? AND status = "pending"', (now_str,))
+    cursor.execute(DUE_REMINDERS_QUERY, (now_str,))
     due_reminders = cursor.fetchall()
     
     for rem in due_reminders:
@@ -1356,12 +1397,12 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
                             new_date_str,
                         )
                     else:
-                        cursor.execute('UPDATE reminders SET status = "sent" WHERE id = ?', (rem_id,))
+                        cursor.execute("UPDATE reminders SET status = 'sent' WHERE id = ?", (rem_id,))
                 except Exception as ex:
                     logging.error(f"Error calculando recurrencia para {rem_id}: {ex}")
-                    cursor.execute('UPDATE reminders SET status = "sent" WHERE id = ?', (rem_id,))
+                    cursor.execute("UPDATE reminders SET status = 'sent' WHERE id = ?", (rem_id,))
             else:
-                cursor.execute('UPDATE reminders SET status = "sent" WHERE id = ?', (rem_id,))
+                cursor.execute("UPDATE reminders SET status = 'sent' WHERE id = ?", (rem_id,))
             
             if send_current_occurrence:
                 # Registrar el alerta en el historial del usuario para que la IA tenga contexto
@@ -1393,6 +1434,145 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
     conn.commit()
     conn.close()
 
+
+class ReminderScheduler:
+    """Programa un único job run_once para el próximo recordatorio pendiente.
+
+    Mantiene un min-heap (remind_at, id) sembrado desde la base de datos. Las
+    escrituras de este proceso llegan por los listeners de database.py; las de
+    server.py se detectan comparando el contador reminders_version (mantenido
+    por triggers) cada REMINDER_EXTERNAL_SYNC_SECONDS, con la lectura en un hilo.
+    """
+
+    JOB_NAME = "reminder_scheduler"
+
+    def __init__(self, application):
+        self.application = application
+        self._heap = []
+        self._scheduled = {}
+        self._job = None
+        self._armed_for = None
+        self._loop = None
+        self._reminders_version = None
+        self._local_changes = 0
+        self._retry_due_before = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._reminders_version = get_reminders_version()
+        register_reminder_change_listener(self.on_reminders_changed)
+        self.resync()
+        self.application.job_queue.run_repeating(
+            self._check_external_changes,
+            interval=REMINDER_EXTERNAL_SYNC_SECONDS,
+            first=REMINDER_EXTERNAL_SYNC_SECONDS,
+            name=f"{self.JOB_NAME}_sync",
+        )
+
+    def resync(self):
+        """Reconstruye el heap con todos los recordatorios pendientes."""
+        self._load_schedule(get_pending_reminder_schedule())
+
+    async def resync_in_thread(self):
+        """Como resync(), pero lee la base de datos fuera del event loop."""
+        while True:
+            local_changes = self._local_changes
+            schedule = await asyncio.to_thread(get_pending_reminder_schedule)
+            # Un cambio local aplicado mientras se leía podría faltar en la lectura.
+            if local_changes == self._local_changes:
+                break
+        self._load_schedule(schedule)
+
+    def _load_schedule(self, schedule):
+        self._scheduled = dict(schedule)
+        self._heap = [(remind_at, rem_id) for rem_id, remind_at in self._scheduled.items()]
+        heapq.heapify(self._heap)
+        self._rearm()
+
+    def on_reminders_changed(self, reminder_ids):
+        """Listener de database.py; puede invocarse desde cualquier hilo."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._apply_change(reminder_ids)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._apply_change, reminder_ids)
+
+    def _apply_change(self, reminder_ids):
+        self._local_changes += 1
+        if reminder_ids is None:
+            self.resync()
+            return
+
+        for rem_id in reminder_ids:
+            self._scheduled.pop(int(rem_id), None)
+        for rem_id, remind_at in get_pending_reminder_schedule(reminder_ids):
+            self._scheduled[rem_id] = remind_at
+            heapq.heappush(self._heap, (remind_at, rem_id))
+        self._rearm()
+
+    def _peek_next(self):
+        # Borrado perezoso: las entradas obsoletas se descartan al llegar a la cima.
+        while self._heap:
+            remind_at, rem_id = self._heap[0]
+            if self._scheduled.get(rem_id) == remind_at:
+                return remind_at
+            heapq.heappop(self._heap)
+        return None
+
+    def _rearm(self):
+        next_remind_at = self._peek_next()
+        if self._job is not None and next_remind_at == self._armed_for:
+            return
+
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+        self._armed_for = next_remind_at
+        if next_remind_at is None:
+            return
+
+        tz_bogota = pytz.timezone('America/Bogota')
+        try:
+            due_at = parse_bogota_datetime(next_remind_at, tz_bogota)
+        except ValueError:
+            logging.error(f"Fecha de recordatorio inválida en el scheduler: {next_remind_at}")
+            due_at = datetime.now(tz_bogota)
+
+        now = datetime.now(tz_bogota)
+        delay_seconds = max(0.0, (due_at - now).total_seconds())
+        if self._retry_due_before is not None and due_at <= self._retry_due_before:
+            # Quedó pendiente tras el último disparo (p. ej. falló el envío):
+            # se reintenta con pausa en vez de re-disparar en bucle.
+            delay_seconds = REMINDER_RETRY_DELAY_SECONDS
+        self._job = self.application.job_queue.run_once(self._fire, when=delay_seconds, name=self.JOB_NAME)
+        logging.info(f"Próximo recordatorio programado para {next_remind_at} (en {delay_seconds:.1f}s)")
+
+    async def _fire(self, context: ContextTypes.DEFAULT_TYPE):
+        self._job = None
+        self._armed_for = None
+        self._retry_due_before = datetime.now(pytz.timezone('America/Bogota'))
+        try:
+            await check_reminders(context)
+        finally:
+            # check_reminders actualiza estados y recurrencias directamente.
+            self._reminders_version = await asyncio.to_thread(get_reminders_version)
+            await self.resync_in_thread()
+
+    async def _check_external_changes(self, context: ContextTypes.DEFAULT_TYPE):
+        reminders_version = await asyncio.to_thread(get_reminders_version)
+        if reminders_version != self._reminders_version:
+            self._reminders_version = reminders_version
+            await self.resync_in_thread()
+
+# --- JOB: BACKFILL DEL ÍNDICE VECTORIAL DE NOTAS ---
+async def backfill_note_vectors(context: ContextTypes.DEFAULT_TYPE):
+    """Indexa notas existentes o editadas desde server.py; el trabajo corre en un hilo de fondo."""
+    get_note_vector_index().schedule_backfill()
+
 # --- JOB: RESUMEN DIARIO ---
 async def send_daily_summaries(context: ContextTypes.DEFAULT_TYPE):
     """Envía el listado de recordatorios de hoy a los usuarios con la función activa."""
@@ -1439,6 +1619,19 @@ async def download_telegram_file_to_base64(bot, file_id: str, mime_type: str | N
         return None
 
 
+async def download_telegram_file_to_memory(bot, file_id: str) -> io.BytesIO | None:
+    """Descarga un archivo de Telegram directo a un buffer en memoria (sin disco)."""
+    try:
+        file = await bot.get_file(file_id)
+        buffer = io.BytesIO()
+        await file.download_to_memory(buffer)
+        buffer.seek(0)
+        return buffer
+    except Exception as e:
+        logging.error(f"Error descargando archivo de Telegram {file_id}: {e}")
+        return None
+
+
 async def download_telegram_file_to_temp_path(
     bot,
     file_id: str,
@@ -1484,6 +1677,176 @@ async def download_image_to_base64(update: Update) -> str | None:
     return await download_telegram_file_to_base64(update.message.bot, photo.file_id, mime_type=mime_type)
 
 # --- PROCESAMIENTO DE VIDEOS DE X.COM ---
+# Un mismo video pedido a la vez por varios usuarios se descarga, transcribe y
+# resume una sola vez; cada usuario sigue el avance en su propio mensaje.
+media_single_flight = SingleFlight("media")
+
+ACTIVE_MEDIA_JOBS_KEY = 'active_media_jobs'
+
+
+def build_media_cancel_markup(job_id: str):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("❌ Cancelar", callback_data=f"{MEDIA_CANCEL_CALLBACK_PREFIX}{job_id}")]
+    ])
+
+
+def get_active_media_jobs(application):
+    return application.bot_data.setdefault(ACTIVE_MEDIA_JOBS_KEY, {})
+
+
+async def run_cancellable_media_job(context, user_id, job_id, coroutine, status_msg, cancelled_text,
+                                    renderer=None):
+    """Espera `coroutine` en una tarea que el botón "Cancelar" de `job_id` puede detener.
+
+    Cancelar la tarea suelta la espera en media_single_flight; si nadie más
+    espera ese video, el proceso de yt-dlp/FFmpeg/transcripción se termina.
+    Retorna (resultado, cancelado); si se canceló, deja `cancelled_text` en
+    el mensaje de estado.
+    """
+    task = asyncio.ensure_future(coroutine)
+    state = {'user_id': user_id, 'task': task, 'cancelled': False}
+    jobs = get_active_media_jobs(context.application)
+    jobs[job_id] = state
+    try:
+        return await task, False
+    except asyncio.CancelledError:
+        if not state['cancelled']:
+            raise
+    finally:
+        if jobs.get(job_id) is state:
+            del jobs[job_id]
+
+    if renderer is not None:
+        await renderer.close()
+    try:
+        await status_msg.edit_text(cancelled_text)
+    except Exception as exc:
+        logging.warning(f"No se pudo marcar como cancelado el trabajo {job_id}: {exc}")
+    return None, True
+
+
+async def media_cancel_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancela un análisis de video o una transcripción en curso."""
+    query = update.callback_query
+    await query.answer()
+    job_id = query.data[len(MEDIA_CANCEL_CALLBACK_PREFIX):]
+
+    state = get_active_media_jobs(context.application).get(job_id)
+    if not state:
+        await query_safe_edit_message(update, context, "⚠️ Ese trabajo ya no está activo.")
+        return
+
+    if state['user_id'] != update.effective_user.id:
+        await query_safe_edit_message(
+            update,
+            context,
+            "❌ No puedes cancelar el trabajo de otro usuario.",
+            reply_markup=build_media_cancel_markup(job_id),
+        )
+        return
+
+    state['cancelled'] = True
+    state['task'].cancel()
+    logging.info("Trabajo de medios %s cancelado por usuario %s", job_id, state['user_id'])
+
+
+def build_media_model_key(capability):
+    """Proveedor y modelo vigentes de una capacidad, para las variantes de la caché de videos."""
+    config = get_ai_configuration(capability)
+    return f"{config['provider']}:{config['model_name']}"
+
+
+def format_video_duration(video_info):
+    if not video_info or not video_info.get('duration'):
+        return ""
+    mins = int(video_info['duration']) // 60
+    secs = int(video_info['duration']) % 60
+    return f" ({mins}:{secs:02d})"
+
+
+async def load_x_video_transcript(url, status_id, flight):
+    """Metadatos y transcripción de un video de X: de la caché o con yt-dlp + transcripción.
+
+    Retorna (video_info, transcript, error).
+    """
+    transcript_variant = build_media_model_key(AI_TRANSCRIPT_CAPABILITY)
+    video_info = await asyncio.to_thread(get_media_entry, "x", status_id, MEDIA_KIND_METADATA)
+    transcript = await asyncio.to_thread(
+        get_media_entry, "x", status_id, MEDIA_KIND_TRANSCRIPT, transcript_variant
+    )
+    if video_info is not None and transcript is not None:
+        logging.info(f"Video de X.com {status_id} servido desde la caché (sin descarga ni transcripción)")
+        return video_info, transcript, None
+
+    # yt-dlp, FFmpeg y la transcripción corren en procesos del executor de medios:
+    # el event loop sigue atendiendo updates mientras tanto.
+    media_executor = get_media_executor()
+    temp_dir = tempfile.mkdtemp(prefix="clusivai_audio_")
+    audio_path = None
+    try:
+        # ── PASO 1: Descargar audio ──
+        await flight.on_progress("⏳ Descargando audio del video de X...")
+        try:
+            audio_path, info_or_error = await media_executor.run(
+                download_audio, url, temp_dir=temp_dir, on_progress=flight.on_progress
+            )
+        except MediaJobError as exc:
+            return None, None, str(exc)
+        if audio_path is None:
+            # info_or_error contiene el mensaje de error
+            return None, None, info_or_error
+
+        video_info = info_or_error  # En caso de éxito, es el dict con info del video
+        await asyncio.to_thread(store_media_entry, "x", status_id, MEDIA_KIND_METADATA, video_info)
+
+        # ── PASO 2: Transcribir audio ──
+        await flight.on_progress(f"🎙️ Transcribiendo audio{format_video_duration(video_info)}...")
+        try:
+            transcript, error = await media_executor.run(
+                transcribe_audio, audio_path, on_progress=flight.on_progress
+            )
+        except MediaJobError as exc:
+            return video_info, None, str(exc)
+        if transcript is None:
+            return video_info, None, error
+
+        await asyncio.to_thread(
+            store_media_entry, "x", status_id, MEDIA_KIND_TRANSCRIPT, transcript, transcript_variant
+        )
+        return video_info, transcript, None
+    finally:
+        # Siempre limpiar archivos temporales (también si el proceso se terminó a medias)
+        if audio_path:
+            cleanup_audio(audio_path)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+async def summarize_video_transcript(platform, video_id, summary_variant, transcript, user_instruction,
+                                     history, flight, video_source, duration_seconds=None):
+    """Resumen del video para una instrucción: de la caché o generado en streaming."""
+    summary = await asyncio.to_thread(
+        get_media_entry, platform, video_id, MEDIA_KIND_SUMMARY, summary_variant
+    )
+    if summary is not None:
+        return summary
+
+    await flight.on_progress("🧠 Analizando contenido del video...")
+    summary = await async_process_video_summary(
+        transcript,
+        user_instruction or None,
+        history,
+        video_source=video_source,
+        on_delta=flight.on_delta,
+        on_progress=flight.on_progress,
+        duration_seconds=duration_seconds,
+    )
+    if summary:
+        await asyncio.to_thread(
+            store_media_entry, platform, video_id, MEDIA_KIND_SUMMARY, summary, summary_variant
+        )
+    return summary
+
+
 async def process_x_video(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, user_text: str):
     """Pipeline completo: descarga audio → transcribe → analiza → responde.
     
@@ -1494,7 +1857,6 @@ async def process_x_video(update: Update, context: ContextTypes.DEFAULT_TYPE, ur
         user_text: Texto completo del mensaje del usuario
     """
     user_id = update.effective_user.id
-    audio_path = None
     
     logging.info(f"Procesando video de X.com para usuario {user_id}: {url}")
     
@@ -1505,45 +1867,77 @@ async def process_x_video(update: Update, context: ContextTypes.DEFAULT_TYPE, ur
     history = context.user_data.get('history', [])
     
     try:
-        # ── PASO 1: Descargar audio ──
-        status_msg = await update.effective_message.reply_text("⏳ Descargando audio del video de X...")
-        
-        audio_result, info_or_error = download_audio(url)
-        
-        if audio_result is None:
-            # info_or_error contiene el mensaje de error
-            await status_msg.edit_text(f"❌ {info_or_error}")
+        status_id = extract_x_status_id(url) or url
+        job_id = uuid.uuid4().hex[:12]
+        cancel_markup = build_media_cancel_markup(job_id)
+        status_msg = await update.effective_message.reply_text(
+            "⏳ Preparando el análisis del video de X...",
+            reply_markup=cancel_markup,
+        )
+        renderer = StreamingMessageRenderer(status_msg, reply_markup=cancel_markup)
+
+        loaded, cancelled = await run_cancellable_media_job(
+            context,
+            user_id,
+            job_id,
+            media_single_flight.run(
+                ("x_transcript", status_id),
+                lambda flight: load_x_video_transcript(url, status_id, flight),
+                renderer,
+            ),
+            status_msg,
+            "❌ Análisis del video cancelado.",
+            renderer=renderer,
+        )
+        if cancelled:
             return
-        
-        audio_path = audio_result
-        video_info = info_or_error  # En caso de éxito, es el dict con info del video
-        
-        # Mostrar info del video si está disponible
-        duration_str = ""
-        if video_info.get('duration'):
-            mins = int(video_info['duration']) // 60
-            secs = int(video_info['duration']) % 60
-            duration_str = f" ({mins}:{secs:02d})"
-        
-        # ── PASO 2: Transcribir audio ──
-        await status_msg.edit_text(f"🎙️ Transcribiendo audio{duration_str}...")
-        
-        transcript, error = transcribe_audio(audio_path)
-        
+        video_info, transcript, error = loaded
         if transcript is None:
+            await renderer.close()
             await status_msg.edit_text(f"❌ {error}")
             return
-        
+
+        duration_str = format_video_duration(video_info)
+
         # ── PASO 3: Analizar con LLM ──
-        await status_msg.edit_text("🧠 Analizando contenido del video...")
-        
         # Extraer instrucción del usuario (quitar la URL del texto)
         user_instruction = user_text.replace(url, '').strip()
         # Limpiar instrucciones vacías o solo con espacios/signos
         if user_instruction and len(user_instruction.strip('., ')) < 3:
             user_instruction = None
-        
-        summary = process_video_summary(transcript, user_instruction or None, history)
+
+        summary_variant = build_summary_variant(
+            user_instruction,
+            build_media_model_key(AI_ANALYSIS_CAPABILITY),
+            "X.com",
+            build_history_digest(history, VIDEO_HISTORY_MESSAGES),
+        )
+        summary, cancelled = await run_cancellable_media_job(
+            context,
+            user_id,
+            job_id,
+            media_single_flight.run(
+                ("x_summary", status_id, summary_variant),
+                lambda flight: summarize_video_transcript(
+                    "x",
+                    status_id,
+                    summary_variant,
+                    transcript,
+                    user_instruction,
+                    history,
+                    flight,
+                    "X.com",
+                    duration_seconds=video_info.get('duration'),
+                ),
+                renderer,
+            ),
+            status_msg,
+            "❌ Análisis del video cancelado.",
+            renderer=renderer,
+        )
+        if cancelled:
+            return
+        await renderer.close()
         
         # ── PASO 4: Enviar resultado ──
         await status_msg.delete()
@@ -1618,11 +2012,41 @@ async def process_x_video(update: Update, context: ContextTypes.DEFAULT_TYPE, ur
                 )
             except Exception:
                 pass
-    
-    finally:
-        # Siempre limpiar archivos temporales
-        if audio_path:
-            cleanup_audio(audio_path)
+
+
+async def load_youtube_video_transcript(url, video_id, flight):
+    """Idioma y transcripción de un video de YouTube: de la caché o de las APIs.
+
+    Retorna (selected_lang, transcript, error).
+    """
+    languages = await asyncio.to_thread(get_media_entry, "youtube", video_id, MEDIA_KIND_LANGUAGES)
+    if not languages:
+        languages, error = await asyncio.to_thread(fetch_youtube_available_languages, video_id)
+        if not languages:
+            return None, None, error
+        await asyncio.to_thread(store_media_entry, "youtube", video_id, MEDIA_KIND_LANGUAGES, languages)
+
+    selected_lang = select_youtube_transcript_language(languages)
+    if not selected_lang:
+        return None, None, "No pude determinar automaticamente el idioma de los subtitulos."
+
+    transcript = await asyncio.to_thread(
+        get_media_entry, "youtube", video_id, MEDIA_KIND_TRANSCRIPT, selected_lang
+    )
+    if transcript is not None:
+        return selected_lang, transcript, None
+
+    await flight.on_progress(f"📄 Obteniendo transcripcion del video de YouTube en {selected_lang}...")
+    transcript, error = await asyncio.to_thread(fetch_youtube_transcript_by_lang, url, selected_lang)
+    if transcript is None:
+        transcript, error = await asyncio.to_thread(get_youtube_transcript, url, languages=languages)
+    if transcript is None:
+        return selected_lang, None, error
+
+    await asyncio.to_thread(
+        store_media_entry, "youtube", video_id, MEDIA_KIND_TRANSCRIPT, transcript, selected_lang
+    )
+    return selected_lang, transcript, None
 
 
 async def process_youtube_video(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, user_text: str):
@@ -1642,39 +2066,70 @@ async def process_youtube_video(update: Update, context: ContextTypes.DEFAULT_TY
             await update.effective_message.reply_text("❌ No pude extraer el ID del video desde la URL proporcionada.")
             return
 
+        job_id = uuid.uuid4().hex[:12]
+        cancel_markup = build_media_cancel_markup(job_id)
         status_msg = await update.effective_message.reply_text(
-            "🔎 Consultando subtitulos disponibles en YouTube..."
+            "🔎 Consultando subtitulos disponibles en YouTube...",
+            reply_markup=cancel_markup,
         )
+        renderer = StreamingMessageRenderer(status_msg, reply_markup=cancel_markup)
 
-        languages, error = fetch_youtube_available_languages(video_id)
-        if not languages:
-            await status_msg.edit_text(f"❌ {error}")
-            return
-
-        selected_lang = select_youtube_transcript_language(languages)
-        if not selected_lang:
-            await status_msg.edit_text("❌ No pude determinar automaticamente el idioma de los subtitulos.")
-            return
-
-        await status_msg.edit_text(
-            f"📄 Obteniendo transcripcion del video de YouTube en {selected_lang}..."
+        loaded, cancelled = await run_cancellable_media_job(
+            context,
+            user_id,
+            job_id,
+            media_single_flight.run(
+                ("yt_transcript", video_id),
+                lambda flight: load_youtube_video_transcript(url, video_id, flight),
+                renderer,
+            ),
+            status_msg,
+            "❌ Análisis del video cancelado.",
+            renderer=renderer,
         )
-
-        transcript, error = fetch_youtube_transcript_by_lang(url, selected_lang)
-        if transcript is None:
-            transcript, error = get_youtube_transcript(url, languages=languages)
-
+        if cancelled:
+            return
+        selected_lang, transcript, error = loaded
         if transcript is None:
+            await renderer.close()
             await status_msg.edit_text(f"❌ {error}")
             return
 
-        await status_msg.edit_text("🧠 Analizando el contenido del video...")
-
         user_instruction = user_text.replace(url, '').strip() or None
         if user_instruction and len(user_instruction.strip('., ')) < 3:
             user_instruction = None
 
-        summary = process_video_summary(transcript, user_instruction, history, video_source="YouTube")
+        summary_variant = build_summary_variant(
+            user_instruction,
+            build_media_model_key(AI_ANALYSIS_CAPABILITY),
+            "YouTube",
+            build_history_digest(history, VIDEO_HISTORY_MESSAGES),
+        )
+        summary, cancelled = await run_cancellable_media_job(
+            context,
+            user_id,
+            job_id,
+            media_single_flight.run(
+                ("yt_summary", video_id, summary_variant),
+                lambda flight: summarize_video_transcript(
+                    "youtube",
+                    video_id,
+                    summary_variant,
+                    transcript,
+                    user_instruction,
+                    history,
+                    flight,
+                    "YouTube",
+                ),
+                renderer,
+            ),
+            status_msg,
+            "❌ Análisis del video cancelado.",
+            renderer=renderer,
+        )
+        if cancelled:
+            return
+        await renderer.close()
 
         await status_msg.delete()
 
@@ -1732,6 +2187,13 @@ async def process_youtube_video(update: Update, context: ContextTypes.DEFAULT_TY
                 pass
 
 
+def lookup_cached_repo_analysis(url: str, commit_sha: str, history):
+    cache_key = build_analysis_cache_key(
+        url, commit_sha, build_repo_analysis_model_key(), build_repo_history_digest(history)
+    )
+    return get_cached_repo_analysis(cache_key)
+
+
 async def process_github_repository(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, user_text: str):
     """Inicia un análisis de repositorio GitHub en background y lo deja cancelable."""
     user_id = update.effective_user.id
@@ -1756,8 +2218,6 @@ async def process_github_repository(update: Update, context: ContextTypes.DEFAUL
         active_by_user.pop(user_id, None)
 
     analysis_id = uuid.uuid4().hex[:12]
-    progress_queue = multiprocessing.Queue()
-    history = list(context.user_data.get('history', []))
     status_message = update.callback_query.message
     state = {
         'analysis_id': analysis_id,
@@ -1766,24 +2226,39 @@ async def process_github_repository(update: Update, context: ContextTypes.DEFAUL
         'status_message_id': status_message.message_id,
         'url': url,
         'user_text': user_text or '',
-        'queue': progress_queue,
         'status': 'running',
         'last_status_text': None,
         'last_status_has_markup': False,
     }
 
-    process = multiprocessing.Process(
-        target=run_repository_analysis_worker,
-        args=(url, history, progress_queue),
-        daemon=True,
-    )
-    state['process'] = process
+    history = list(context.user_data.get('history', []))
+    commit_sha = await resolve_github_head_sha(url)
+    if commit_sha:
+        cached_result = await asyncio.to_thread(lookup_cached_repo_analysis, url, commit_sha, history)
+        if cached_result:
+            logging.info("Análisis GitHub servido desde caché para %s@%s", url, commit_sha[:12])
+            get_active_repo_analyses(application)[analysis_id] = state
+            active_by_user[user_id] = analysis_id
+            await finish_repo_analysis(application, analysis_id, cached_result)
+            return
+
+    state['events'] = asyncio.Queue()
 
     get_active_repo_analyses(application)[analysis_id] = state
     active_by_user[user_id] = analysis_id
 
+    # Mismo repo, commit e historial reciente: los análisis simultáneos comparten un
+    # único trabajo del pool. La síntesis final usa el historial, por eso va en la llave.
+    flight_key = (
+        f"gh_analyze:{(normalize_github_repo_url(url) or url).lower()}@{commit_sha or 'HEAD'}"
+        f"#{build_repo_history_digest(history)}"
+    )
+    pool = get_repo_worker_pool()
     try:
-        process.start()
+        queue_position = pool.submit(
+            analysis_id, url, history, commit_sha, state['events'], flight_key=flight_key
+        )
+        state['submitted'] = True
     except Exception:
         remove_repo_analysis_state(application, analysis_id, stop_process=True)
         await query_safe_edit_message(
@@ -1791,18 +2266,37 @@ async def process_github_repository(update: Update, context: ContextTypes.DEFAUL
             context,
             "❌ No pude iniciar el análisis del repositorio en este momento. Intenta de nuevo más tarde.",
         )
-        logging.error("No se pudo iniciar el proceso de análisis GitHub %s", analysis_id, exc_info=True)
+        logging.error("No se pudo encolar el análisis GitHub %s", analysis_id, exc_info=True)
         return
 
-    logging.info("Análisis GitHub %s iniciado para usuario %s: %s", analysis_id, user_id, url)
+    logging.info(
+        "Análisis GitHub %s encolado para usuario %s (posición %s): %s",
+        analysis_id,
+        user_id,
+        queue_position,
+        url,
+    )
 
+    if pool.shared_with(analysis_id):
+        initial_status = "⏳ Ese repositorio ya se está analizando; te uno al análisis en curso..."
+    elif queue_position:
+        initial_status = f"⏳ Tu análisis está en cola (posición {queue_position})."
+    else:
+        initial_status = "⏳ Obteniendo el código del repositorio con GitIngest..."
     await update_repo_status_message(
         context.bot,
         state,
-        "⏳ Obteniendo el código del repositorio con GitIngest...",
+        initial_status,
         reply_markup=build_repo_cancel_markup(analysis_id),
     )
 
+    # El consumidor arranca después del estado inicial para que este no pise
+    # un progreso más reciente; mientras tanto los eventos esperan en la cola.
+    if analysis_id in get_active_repo_analyses(application):
+        state['consumer_task'] = application.create_task(
+            consume_repo_analysis_events(application, analysis_id, state['events'])
+        )
+
 
 async def query_safe_edit_message(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None):
     query = update.callback_query
@@ -2343,6 +2837,108 @@ def split_message(text, max_length=4096):
     
     return chunks
 
+def build_stream_preview(text, max_chars=STREAM_PREVIEW_MAX_CHARS, cursor=" ▌"):
+    """Texto a mostrar mientras la respuesta sigue llegando (cabe en un solo mensaje)."""
+    if len(text) > max_chars:
+        return text[:max_chars].rstrip() + " …"
+    return text + cursor
+
+
+def get_retry_after_seconds(exc):
+    retry_after = exc.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class StreamingMessageRenderer:
+    """Edita un mensaje de Telegram con la respuesta parcial del modelo.
+
+    Como mucho hace una edición cada `min_interval_ms` y respeta los RetryAfter
+    de Telegram; los fragmentos que llegan entre ediciones se acumulan.
+    `reply_markup` (p. ej. un botón "Cancelar") se conserva en cada edición
+    intermedia y se quita al terminar.
+    """
+
+    def __init__(self, message, prefix="", min_interval_ms=STREAM_EDIT_INTERVAL_MS, reply_markup=None):
+        self.message = message
+        self.prefix = prefix
+        self.reply_markup = reply_markup
+        self.min_interval = max(0.3, min_interval_ms / 1000)
+        self.text = ""
+        self.edit_count = 0
+        self._last_edit_at = 0.0
+        self._blocked_until = 0.0
+        self._last_rendered = None
+        self._flush_task = None
+
+    async def on_delta(self, delta):
+        self.text += delta
+        self._schedule_flush()
+
+    async def on_progress(self, status):
+        """Reemplaza la línea de estado (p. ej. el avance por tramos de un video largo)."""
+        self.prefix = f"{status}\n\n"
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_when_allowed())
+
+    async def _flush_when_allowed(self):
+        loop = asyncio.get_running_loop()
+        wait_seconds = max(self._last_edit_at + self.min_interval, self._blocked_until) - loop.time()
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+        await self._edit(build_stream_preview(self.prefix + self.text))
+
+    async def _edit(self, text):
+        if not text or text == self._last_rendered:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await self.message.edit_text(text, reply_markup=self.reply_markup)
+            self._last_rendered = text
+            self.edit_count += 1
+        except RetryAfter as exc:
+            self._blocked_until = loop.time() + get_retry_after_seconds(exc)
+            logging.info("Telegram pidió esperar %.1fs antes de editar de nuevo", self._blocked_until - loop.time())
+        except BadRequest as exc:
+            if 'not modified' not in str(exc).lower():
+                logging.warning(f"No se pudo editar el mensaje en streaming: {exc}")
+        except Exception as exc:
+            logging.warning(f"No se pudo editar el mensaje en streaming: {exc}")
+        finally:
+            self._last_edit_at = loop.time()
+
+    async def close(self):
+        """Cancela la edición pendiente (p. ej. antes de borrar el mensaje)."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+
+    async def finish(self, final_text):
+        """Deja el mensaje con el texto final; lo que excede un mensaje se envía aparte."""
+        await self.close()
+        self.reply_markup = None
+        loop = asyncio.get_running_loop()
+        chunks = split_message(final_text, 4096)
+        wait_seconds = self._blocked_until - loop.time()
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+        await self._edit(chunks[0])
+        if self._last_rendered != chunks[0]:
+            # La edición falló: se envía como mensaje nuevo para no perder la respuesta.
+            await self.message.reply_text(chunks[0])
+        for chunk in chunks[1:]:
+            await self.message.reply_text(chunk)
+
+
 # --- MANEJADOR DE MENSAJES ---
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.effective_message
@@ -2368,7 +2964,7 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         voice.file_size,
     )
 
-    if voice.file_size and voice.file_size > MAX_AUDIO_SIZE_BYTES:
+    if voice.file_size and voice.file_size > MAX_LONG_AUDIO_SIZE_BYTES:
         size_mb = voice.file_size / (1024 * 1024)
         await msg.reply_text(
             f"❌ Tu audio es demasiado grande ({size_mb:.1f} MB). Envíame una nota de voz más corta."
@@ -2376,18 +2972,49 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     try:
-        status_msg = await msg.reply_text("🎙️ Transcribiendo tu audio...")
-        audio_path = await download_telegram_file_to_temp_path(
-            context.bot,
-            voice.file_id,
-            suffix='.ogg',
+        job_id = uuid.uuid4().hex[:12]
+        status_msg = await msg.reply_text(
+            "🎙️ Transcribiendo tu audio...",
+            reply_markup=build_media_cancel_markup(job_id),
         )
 
-        if not audio_path:
-            await status_msg.edit_text("❌ No pude descargar tu audio. Intenta de nuevo.")
+        in_memory = bool(voice.file_size) and voice.file_size <= MAX_AUDIO_SIZE_BYTES
+        if in_memory and supports_in_memory_transcription():
+            # Ruta habitual: bytes de Telegram → multipart asíncrono, sin archivos temporales.
+            audio_buffer = await download_telegram_file_to_memory(context.bot, voice.file_id)
+            if audio_buffer is None:
+                await status_msg.edit_text("❌ No pude descargar tu audio. Intenta de nuevo.")
+                return
+
+            transcription = async_transcribe_audio_with_active_provider(
+                audio_buffer,
+                'voice.ogg',
+                get_audio_mime_type('voice.ogg'),
+            )
+        else:
+            # Audios largos o de tamaño desconocido (se trocean con FFmpeg si hace falta): archivo + executor.
+            audio_path = await download_telegram_file_to_temp_path(
+                context.bot,
+                voice.file_id,
+                suffix='.ogg',
+            )
+
+            if not audio_path:
+                await status_msg.edit_text("❌ No pude descargar tu audio. Intenta de nuevo.")
+                return
+
+            transcription = get_media_executor().run(transcribe_audio, audio_path)
+
+        try:
+            transcribed, cancelled = await run_cancellable_media_job(
+                context, user_id, job_id, transcription, status_msg, "❌ Transcripción cancelada."
+            )
+        except MediaJobError as exc:
+            transcribed, cancelled = (None, str(exc)), False
+        if cancelled:
             return
+        transcript, error = transcribed
 
-        transcript, error = transcribe_audio(audio_path)
         if transcript is None:
             await status_msg.edit_text(f"❌ {error}")
             return
@@ -2561,6 +3188,28 @@ async def handle_image_reminder_entrypoint(
     return True
 
 
+def retrieve_relevant_notes(user_id, query, limit=NOTES_QUERY_TOP_K):
+    """Combina búsqueda FTS y semántica (fusión por rango recíproco) para acotar el contexto."""
+    keyword_ids = [note[0] for note in search_notes(user_id, query, limit=limit)]
+    try:
+        semantic_ids = [
+            note_id for note_id, _score in get_note_vector_index().search(user_id, query, limit=limit)
+        ]
+    except Exception as e:
+        logging.warning(f"Búsqueda semántica de notas no disponible: {e}")
+        semantic_ids = []
+
+    scores = {}
+    for ranked_ids in (keyword_ids, semantic_ids):
+        for rank, note_id in enumerate(ranked_ids):
+            scores[note_id] = scores.get(note_id, 0.0) + 1.0 / (NOTES_RRF_K + rank + 1)
+
+    ranked_note_ids = sorted(scores, key=scores.get, reverse=True)[:limit]
+    if not ranked_note_ids:
+        return get_notes_by_user(user_id, limit=limit)
+    return get_notes_by_ids(user_id, ranked_note_ids)
+
+
 async def process_normal_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, user_id: int):
     """Procesamiento normal de mensajes (IA, recordatorios, notas, etc.)"""
     
@@ -2602,7 +3251,7 @@ async def process_normal_message(update: Update, context: ContextTypes.DEFAULT_T
     text_to_process = user_text
     
     try:
-        res = process_user_input(text_to_process, history=history, active_reminders=active_reminders)
+        res = await async_process_user_input(text_to_process, history=history, active_reminders=active_reminders)
         
         if not res:
             failure = get_last_brain_failure()
@@ -2637,6 +3286,7 @@ async def process_normal_message(update: Update, context: ContextTypes.DEFAULT_T
 
         action = res.get("action")
         reply_message = None
+        reply_already_sent = False
         
         if action == "CREATE":
             reminders_to_create = normalize_create_reminders(res)
@@ -2784,10 +3434,19 @@ async def process_normal_message(update: Update, context: ContextTypes.DEFAULT_T
                         logging.error(f"UPDATE error en database para usuario {user_id}: {e}", exc_info=True)
             
         elif action == "CONSULTAR_NOTAS":
-            # Recuperar notas del usuario y hacer segunda llamada al LLM
-            user_notes = get_notes_by_user(user_id)
-            notes_response = process_notes_query(user_text, user_notes, history)
+            # Recuperar solo las notas relevantes (o las más recientes) para acotar el prompt
+            user_notes = await asyncio.to_thread(retrieve_relevant_notes, user_id, user_text)
+            notes_status_msg = await update.effective_message.reply_text("🔎 Consultando tus notas...")
+            renderer = StreamingMessageRenderer(notes_status_msg)
+            notes_response = await async_process_notes_query(
+                user_text,
+                user_notes,
+                history,
+                on_delta=renderer.on_delta,
+            )
             reply_message = notes_response if notes_response else "No pude consultar tus notas en este momento."
+            await renderer.finish(reply_message)
+            reply_already_sent = True
             
         elif action == "CHAT":
             # Respuesta directa de la IA (incluyendo preguntas como ¿qué hora es?)
@@ -2812,7 +3471,7 @@ async def process_normal_message(update: Update, context: ContextTypes.DEFAULT_T
             reply_message = "No estoy seguro de qué hacer. ¿Puedes repetirlo?"
         
         # Enviar respuesta
-        if reply_message:
+        if reply_message and not reply_already_sent:
             if action == "LIST":
                 await update.effective_message.reply_text(reply_message, parse_mode="Markdown", reply_markup=reply_markup)
             else:
@@ -2925,9 +3584,81 @@ async def x_link_callback_handler(update: Update, context: ContextTypes.DEFAULT_
                 pass
 
 
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Procesa usuarios distintos en paralelo y los updates de cada usuario en orden.
+
+    Cada usuario tiene un asyncio.Lock (FIFO); el cupo de ejecución solo se
+    toma después de obtener el lock, así un usuario con muchos mensajes en cola
+    no ocupa los cupos de los demás. El semáforo de PTB (que envuelve a
+    do_process_update) acota además los updates pendientes en total.
+
+    Los demás callback queries se ordenan con los mensajes del usuario, porque
+    flujos como x_video o yt_analyze escriben su historial. Solo los botones de
+    cancelar (LOCK_FREE_CALLBACK_PREFIXES) saltan el lock: deben responder
+    aunque el mismo usuario tenga un trabajo largo en curso.
+    """
+
+    LOCK_FREE_CALLBACK_PREFIXES = (
+        'gh_cancel:',
+        f'{REMINDER_CALLBACK_PREFIX}cancel:',
+        f'{LINK_REMINDER_CALLBACK_PREFIX}cancel:',
+        MEDIA_CANCEL_CALLBACK_PREFIX,
+    )
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None):
+        super().__init__(max_pending_updates or max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._user_locks = {}
+
+    @classmethod
+    def get_update_key(cls, update):
+        if isinstance(update, Update):
+            callback_query = update.callback_query
+            if callback_query and (callback_query.data or '').startswith(cls.LOCK_FREE_CALLBACK_PREFIXES):
+                return None
+            if update.effective_user:
+                return ('user', update.effective_user.id)
+            if update.effective_chat:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = {'lock': asyncio.Lock(), 'refs': 0}
+            self._user_locks[key] = entry
+        entry['refs'] += 1
+        try:
+            async with entry['lock']:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry['refs'] -= 1
+            if entry['refs'] == 0:
+                self._user_locks.pop(key, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
 async def post_init(application):
     """Configura el botón de menú después de que la aplicación haya iniciado."""
     from telegram import MenuButtonWebApp
+    reminder_scheduler = ReminderScheduler(application)
+    reminder_scheduler.start()
+    application.bot_data['reminder_scheduler'] = reminder_scheduler
+    get_note_vector_index().start()
+    get_repo_worker_pool().start()
+
     try:
         # Configurar el botón de menú para abrir la Web App en modo calendario
         url = build_webapp_url(mode="calendar")
@@ -2942,6 +3673,24 @@ async def post_init(application):
     except Exception as e:
         logging.error(f"Error configurando el botón de menú: {e}")
 
+
+async def post_shutdown(application):
+    """Cierra el pool de workers de repositorios y los pools HTTP de los proveedores de IA."""
+    try:
+        await get_media_executor().shutdown()
+    except Exception as e:
+        logging.error(f"Error cerrando el executor de medios: {e}")
+
+    try:
+        await get_repo_worker_pool().shutdown()
+    except Exception as e:
+        logging.error(f"Error cerrando el pool de análisis de repositorios: {e}")
+
+    try:
+        await get_connection_manager().aclose()
+    except Exception as e:
+        logging.error(f"Error cerrando conexiones de IA: {e}")
+
 # --- HANDLER PARA COMANDO /nota ---
 # --- HANDLER PARA /nota CON FOTO ---
 async def nota_photo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3031,7 +3780,14 @@ if __name__ == '__main__':
     logging.info("Base de datos inicializada correctamente")
     validate_ai_configuration()
     
-    application = ApplicationBuilder().token(telegram_token).post_init(post_init).build()
+    application = (
+        ApplicationBuilder()
+        .token(telegram_token)
+        .concurrent_updates(PerUserUpdateProcessor(BOT_MAX_CONCURRENT_UPDATES, BOT_MAX_PENDING_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler(["ai", "modelo"], ai_command))
@@ -3045,17 +3801,13 @@ if __name__ == '__main__':
     application.add_handler(CallbackQueryHandler(link_reminder_callback_handler, pattern=r"^lrem:"))
     application.add_handler(CallbackQueryHandler(reminder_callback_handler, pattern=r"^rem:"))
     application.add_handler(CallbackQueryHandler(x_link_callback_handler, pattern=r"^(x_|gh_|yt_)"))
+    application.add_handler(CallbackQueryHandler(media_cancel_callback_handler, pattern=rf"^{MEDIA_CANCEL_CALLBACK_PREFIX}"))
     application.add_handler(MessageHandler(filters.VOICE & (~filters.COMMAND), handle_voice_message))
     application.add_handler(MessageHandler((filters.TEXT | filters.PHOTO | filters.Document.ALL) & (~filters.COMMAND), handle_message))
     
-    # Programar el revisor de recordatorios con una cadencia corta para reducir atrasos evitables.
+    # Los recordatorios los programa ReminderScheduler (ver post_init).
     job_queue = application.job_queue
-    job_queue.run_repeating(
-        check_reminders,
-        interval=CHECK_REMINDERS_INTERVAL_SECONDS,
-        first=CHECK_REMINDERS_FIRST_DELAY_SECONDS,
-    )
-    job_queue.run_repeating(poll_repo_analysis_updates, interval=1, first=1)
+    job_queue.run_repeating(backfill_note_vectors, interval=NOTE_VECTOR_BACKFILL_SECONDS, first=30)
     
     # Programar resumen diario a las 7:45 AM Bogotá (Mon-Fri)
     from datetime import time
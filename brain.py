@@ -1,22 +1,31 @@
 import os
+import asyncio
+import contextvars
 import requests
+import httpx
 import json
 import pytz
 import logging
 import re
+import threading
 import base64
+import hashlib
 import random
-import threading
 import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from ai_connections import get_connection_manager
+from repo_handler import estimate_tokens
 from database import (
     AI_ANALYSIS_CAPABILITY,
     AI_CAPABILITY_ORDER,
     AI_TEXT_CAPABILITY,
     AI_TRANSCRIPT_CAPABILITY,
     AI_VISION_CAPABILITY,
-    get_ai_setting,
+    get_ai_settings_version,
+    get_all_ai_settings,
+    get_local_ai_settings_version,
 )
 
 load_dotenv()
@@ -50,18 +59,31 @@ REPO_CHUNK_TREE_CHARS = int(os.getenv("REPO_CHUNK_TREE_CHARS", "2500"))
 REPO_SYNTHESIS_TREE_CHARS = int(os.getenv("REPO_SYNTHESIS_TREE_CHARS", "4000"))
 REPO_PARTIAL_MAX_TOKENS = int(os.getenv("REPO_PARTIAL_MAX_TOKENS", "450"))
 REPO_SYNTHESIS_MAX_TOKENS = int(os.getenv("REPO_SYNTHESIS_MAX_TOKENS", "800"))
+AI_CONFIG_CACHE_TTL_SECONDS = float(os.getenv("AI_CONFIG_CACHE_TTL_SECONDS", "5"))
+AI_MAX_CONCURRENT_CALLS = int(os.getenv("AI_MAX_CONCURRENT_CALLS", "8"))
+# Transcripciones: hasta este tamaño se resumen en una sola llamada; por encima,
+# se resumen por tramos (map) y luego se consolidan (reduce).
+VIDEO_TRANSCRIPT_DIRECT_MAX_TOKENS = int(os.getenv("VIDEO_TRANSCRIPT_DIRECT_MAX_TOKENS", "3750"))
+VIDEO_SEGMENT_MAX_TOKENS = int(os.getenv("VIDEO_SEGMENT_MAX_TOKENS", "3000"))
+VIDEO_SEGMENT_SUMMARY_MAX_TOKENS = int(os.getenv("VIDEO_SEGMENT_SUMMARY_MAX_TOKENS", "350"))
+VIDEO_SEGMENT_CONCURRENCY = max(1, int(os.getenv("VIDEO_SEGMENT_CONCURRENCY", "4")))
+VIDEO_SEGMENT_CACHE_SIZE = int(os.getenv("VIDEO_SEGMENT_CACHE_SIZE", "512"))
+VIDEO_REDUCE_MAX_LEVELS = 3
+VIDEO_HISTORY_MESSAGES = int(os.getenv("VIDEO_HISTORY_MESSAGES", "6"))
 
 # Configurar logging para este módulo
 logger = logging.getLogger(__name__)
-_last_brain_failure = threading.local()
+# ContextVar en lugar de threading.local: aísla el último fallo tanto por hilo
+# como por tarea asyncio, de modo que handlers concurrentes no se pisen.
+_last_brain_failure = contextvars.ContextVar("last_brain_failure", default=None)
 
 
 def clear_last_brain_failure():
-    _last_brain_failure.data = None
+    _last_brain_failure.set(None)
 
 
 def get_last_brain_failure():
-    return getattr(_last_brain_failure, "data", None)
+    return _last_brain_failure.get()
 
 
 def is_transient_brain_failure(failure=None):
@@ -94,7 +116,7 @@ def _record_brain_failure(kind, context_label, **details):
         "context": context_label,
         **details,
     }
-    _last_brain_failure.data = failure
+    _last_brain_failure.set(failure)
     logger.error(
         "Diagnóstico brain failure (%s): %s",
         context_label,
@@ -103,6 +125,32 @@ def _record_brain_failure(kind, context_label, **details):
     return failure
 
 
+_rate_limit_listeners = []
+
+
+def register_rate_limit_listener(listener):
+    """Registra un callback(provider, log_context) que se invoca con cada 429 del proveedor.
+
+    Se llama también cuando el 429 se reintenta, para que quien reparte la carga
+    (p. ej. el análisis de repositorios) reduzca su concurrencia a tiempo.
+    """
+    if listener not in _rate_limit_listeners:
+        _rate_limit_listeners.append(listener)
+
+
+def unregister_rate_limit_listener(listener):
+    if listener in _rate_limit_listeners:
+        _rate_limit_listeners.remove(listener)
+
+
+def _notify_rate_limited(provider, log_context):
+    for listener in list(_rate_limit_listeners):
+        try:
+            listener(provider, log_context)
+        except Exception:
+            logger.exception("Error notificando un 429 de %s (%s)", provider, log_context)
+
+
 def _coerce_provider_name(provider_name, fallback="openrouter"):
     normalized = str(provider_name or fallback).strip().lower()
     if normalized in {"openrouter", "nvidia", "groq"}:
@@ -145,13 +193,66 @@ def get_default_ai_settings():
     }
 
 
+_ai_settings_cache = {
+    "settings": None,
+    "db_version": None,
+    "local_version": None,
+    "checked_at": 0.0,
+}
+_ai_settings_cache_lock = threading.Lock()
+
+
+def invalidate_ai_configuration_cache():
+    with _ai_settings_cache_lock:
+        _ai_settings_cache["settings"] = None
+
+
+def _get_cached_ai_settings():
+    """Retorna la configuración activa cacheada; solo consulta SQLite al vencer el TTL.
+
+    Los cambios hechos en este proceso invalidan la caché al instante mediante el
+    contador local; los de otros procesos se detectan con la versión persistida.
+    """
+    local_version = get_local_ai_settings_version()
+    now = time.monotonic()
+    with _ai_settings_cache_lock:
+        settings = _ai_settings_cache["settings"]
+        if (
+            settings is not None
+            and _ai_settings_cache["local_version"] == local_version
+            and now - _ai_settings_cache["checked_at"] < AI_CONFIG_CACHE_TTL_SECONDS
+        ):
+            return settings
+        cached_db_version = _ai_settings_cache["db_version"]
+
+    db_version = get_ai_settings_version()
+    if settings is not None and db_version == cached_db_version:
+        with _ai_settings_cache_lock:
+            _ai_settings_cache["local_version"] = local_version
+            _ai_settings_cache["checked_at"] = now
+        return settings
+
+    # La versión se lee antes que las filas: si otro proceso escribe en medio,
+    # la próxima verificación verá una versión mayor y recargará de nuevo.
+    settings = get_all_ai_settings()
+    with _ai_settings_cache_lock:
+        _ai_settings_cache.update({
+            "settings": settings,
+            "db_version": db_version,
+            "local_version": local_version,
+            "checked_at": now,
+        })
+    logger.info("Configuración de IA recargada desde la base de datos (versión %s)", db_version)
+    return settings
+
+
 def get_ai_configuration(capability):
     normalized_capability = str(capability).strip().lower()
     default_config = get_default_ai_settings().get(normalized_capability)
     if default_config is None:
         raise ValueError(f"Capacidad de IA no soportada: {capability}")
 
-    stored_config = get_ai_setting(normalized_capability)
+    stored_config = _get_cached_ai_settings().get(normalized_capability)
     if stored_config and stored_config.get("provider") and stored_config.get("model_name"):
         return {
             "capability": normalized_capability,
@@ -383,13 +484,15 @@ def extract_response_text(response_data, *, log_context, ai_config):
     return None
 
 
-def post_openrouter_chat(data, *, timeout, log_context, ai_config=None, max_attempts=None):
-    ai_config = ai_config or get_ai_configuration(AI_TEXT_CAPABILITY)
-    provider = "openrouter"
-    model_name = data.get("model") or ai_config.get("model_name")
+# --- LLAMADAS A CHAT/COMPLETIONS ---
+# Las versiones síncronas, asyncio y de streaming solo difieren en el transporte;
+# la clasificación de errores, los reintentos y el registro de fallos son comunes.
+
+
+def _check_provider_credentials(provider, log_context, ai_config, model_name):
     api_key = get_provider_api_key(provider)
     if not api_key:
-        logger.error("ERROR: OPENROUTER_API_KEY no está configurado")
+        logger.error("ERROR: API key de %s no está configurada", provider)
         _record_brain_failure(
             "missing_api_key",
             log_context,
@@ -398,6 +501,179 @@ def post_openrouter_chat(data, *, timeout, log_context, ai_config=None, max_atte
             model=model_name,
             transient=False,
         )
+    return api_key
+
+
+def _import_openai_errors(log_context, ai_config, model_name):
+    try:
+        from openai import APIConnectionError, APIStatusError, APITimeoutError
+    except ImportError as exc:
+        logger.error("La dependencia openai no está instalada para el proveedor Nvidia")
+        _record_brain_failure(
+            "missing_dependency",
+            log_context,
+            provider="nvidia",
+            capability=ai_config.get("capability"),
+            model=model_name,
+            dependency="openai",
+            exception_message=str(exc),
+            transient=False,
+        )
+        return None
+    return APIConnectionError, APIStatusError, APITimeoutError
+
+
+def _http_status_failure(status_code, body_preview, **details):
+    return ("http_status_error", status_code in TRANSIENT_STATUS_CODES, {
+        "status_code": status_code,
+        "response_excerpt": body_preview,
+        **details,
+    })
+
+
+def _classify_request_exception(exc, provider, log_context, openai_errors=None):
+    """Traduce una excepción de requests, httpx o del SDK de OpenAI a (tipo, transitorio, detalles)."""
+    exception_details = {
+        "exception_type": type(exc).__name__,
+        "exception_message": str(exc),
+    }
+    if openai_errors is not None:
+        APIConnectionError, APIStatusError, APITimeoutError = openai_errors
+        if isinstance(exc, APITimeoutError):
+            return "timeout", True, {}
+        if isinstance(exc, APIConnectionError):
+            return "network_error", True, exception_details
+        if isinstance(exc, APIStatusError):
+            return _http_status_failure(getattr(exc, "status_code", None), str(exc)[:500])
+
+    if isinstance(exc, (requests.exceptions.Timeout, httpx.TimeoutException)):
+        return "timeout", True, {}
+    if isinstance(exc, (requests.exceptions.RequestException, httpx.RequestError)):
+        return "network_error", True, exception_details
+
+    logger.error("Error inesperado al invocar %s (%s): %s", provider, log_context, exc, exc_info=True)
+    return "unexpected_exception", False, exception_details
+
+
+def _resolve_chat_failure(kind, log_context, ai_config, model_name, *, provider, attempt, max_attempts,
+                          timeout, transient, received_chars=0, **details):
+    """Decide si una llamada fallida se reintenta; si no, registra el fallo.
+
+    Un stream solo se reintenta si aún no llegó ningún token: una vez que el
+    usuario vio texto parcial, reintentar duplicaría la respuesta en pantalla.
+    Retorna los segundos a esperar antes de reintentar, o None si se abandona.
+    """
+    if details.get("status_code") == 429:
+        _notify_rate_limited(provider, log_context)
+    if transient and received_chars == 0 and attempt < max_attempts:
+        sleep_seconds = _build_retry_delay(attempt)
+        logger.warning(
+            "Llamada a %s falló (%s, %s), reintentando en %.2fs: %s",
+            provider,
+            kind,
+            log_context,
+            sleep_seconds,
+            _serialize_preview(details),
+        )
+        return sleep_seconds
+
+    if received_chars:
+        kind = "stream_interrupted"
+        details["received_chars"] = received_chars
+    logger.error(
+        "Llamada a %s falló (%s, %s), intento %s/%s: %s",
+        provider,
+        kind,
+        log_context,
+        attempt,
+        max_attempts,
+        _serialize_preview(details),
+    )
+    _record_brain_failure(
+        kind,
+        log_context,
+        provider=provider,
+        capability=ai_config.get("capability"),
+        model=model_name,
+        attempt=attempt,
+        max_attempts=max_attempts,
+        timeout_seconds=timeout,
+        transient=transient,
+        **details,
+    )
+    return None
+
+
+def _record_unsupported_chat_provider(log_context, ai_config):
+    logger.error(
+        "Proveedor Groq no soportado para chat/completions en esta capacidad (%s)",
+        ai_config.get("capability"),
+    )
+    _record_brain_failure(
+        "unsupported_provider_for_chat",
+        log_context,
+        provider=ai_config.get("provider"),
+        capability=ai_config.get("capability"),
+        model=ai_config.get("model_name"),
+        transient=False,
+    )
+
+
+def _log_chat_attempt(provider, log_context, ai_config, model_name, attempt, max_attempts):
+    logger.info(
+        "Enviando request a %s (%s), intento %s/%s, capacidad=%s, modelo=%s",
+        provider,
+        log_context,
+        attempt,
+        max_attempts,
+        ai_config.get('capability'),
+        model_name,
+    )
+
+
+def _log_chat_response(provider, log_context, ai_config, model_name, attempt, max_attempts, elapsed_ms,
+                       status_code=None):
+    logger.info(
+        "Respuesta de %s (%s), intento %s/%s, capacidad=%s, modelo=%s, status=%s, duracion_ms=%s",
+        provider,
+        log_context,
+        attempt,
+        max_attempts,
+        ai_config.get('capability'),
+        model_name,
+        status_code,
+        elapsed_ms,
+    )
+
+
+def _read_openrouter_response(response, elapsed_ms):
+    """Retorna (payload, None) o (None, fallo) para una respuesta de requests o httpx."""
+    if response.status_code != 200:
+        return None, _http_status_failure(response.status_code, response.text[:500], duration_ms=elapsed_ms)
+    try:
+        return response.json(), None
+    except ValueError:
+        return None, ("invalid_provider_payload", False, {
+            "status_code": response.status_code,
+            "duration_ms": elapsed_ms,
+            "response_excerpt": response.text[:500],
+        })
+
+
+def _openai_response_to_dict(response):
+    if hasattr(response, 'model_dump'):
+        return response.model_dump(exclude_none=True)
+    if isinstance(response, dict):
+        return response
+    return json.loads(response.json())
+
+
+def post_openrouter_chat(data, *, timeout, log_context, ai_config=None, max_attempts=None):
+    ai_config = ai_config or get_ai_configuration(AI_TEXT_CAPABILITY)
+    provider = "openrouter"
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials(provider, log_context, ai_config, model_name)
+    if not api_key:
         return None
 
     max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
@@ -405,372 +681,272 @@ def post_openrouter_chat(data, *, timeout, log_context, ai_config=None, max_atte
 
     for attempt in range(1, max_attempts + 1):
         started_at = time.monotonic()
+        _log_chat_attempt(provider, log_context, ai_config, model_name, attempt, max_attempts)
         try:
-            logger.info(
-                "Enviando request a %s (%s), intento %s/%s, capacidad=%s, modelo=%s",
-                provider,
-                log_context,
-                attempt,
-                max_attempts,
-                ai_config.get('capability'),
-                model_name,
-            )
-            response = requests.post(
-                OPENROUTER_URL,
-                headers=headers,
-                json=data,
-                timeout=timeout,
-            )
+            session = get_connection_manager().get_session(provider, OPENROUTER_URL, api_key)
+            response = session.post(OPENROUTER_URL, headers=headers, json=data, timeout=timeout)
+        except Exception as exc:
+            failure = _classify_request_exception(exc, provider, log_context)
+        else:
             elapsed_ms = int((time.monotonic() - started_at) * 1000)
+            _log_chat_response(provider, log_context, ai_config, model_name, attempt, max_attempts,
+                               elapsed_ms, response.status_code)
+            payload, failure = _read_openrouter_response(response, elapsed_ms)
+            if failure is None:
+                return payload
+
+        kind, transient, details = failure
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider=provider,
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout, transient=transient, **details,
+        )
+        if sleep_seconds is None:
+            return None
+        time.sleep(sleep_seconds)
 
-            logger.info(
-                "Respuesta de %s (%s), intento %s/%s, capacidad=%s, modelo=%s, status=%s, duracion_ms=%s",
-                provider,
-                log_context,
-                attempt,
-                max_attempts,
-                ai_config.get('capability'),
-                model_name,
-                response.status_code,
-                elapsed_ms,
-            )
+    return None
 
-            if response.status_code != 200:
-                body_preview = response.text[:500]
-                if response.status_code in TRANSIENT_STATUS_CODES and attempt < max_attempts:
-                    sleep_seconds = _build_retry_delay(attempt)
-                    logger.warning(
-                        "%s devolvió status %s (%s), reintentando en %.2fs. Respuesta: %s",
-                        provider,
-                        response.status_code,
-                        log_context,
-                        sleep_seconds,
-                        body_preview,
-                    )
-                    time.sleep(sleep_seconds)
-                    continue
-
-                logger.error(
-                    "Error en API %s (%s): Status %s, Response: %s",
-                    provider,
-                    log_context,
-                    response.status_code,
-                    body_preview,
-                )
-                _record_brain_failure(
-                    "http_status_error",
-                    log_context,
-                    provider=provider,
-                    capability=ai_config.get("capability"),
-                    model=model_name,
-                    status_code=response.status_code,
-                    attempt=attempt,
-                    max_attempts=max_attempts,
-                    timeout_seconds=timeout,
-                    duration_ms=elapsed_ms,
-                    response_excerpt=body_preview,
-                    transient=response.status_code in TRANSIENT_STATUS_CODES,
-                )
-                return None
 
-            try:
-                return response.json()
-            except ValueError:
-                logger.error(
-                    "%s devolvió una respuesta no JSON (%s): %s",
-                    provider,
-                    log_context,
-                    response.text[:500],
-                )
-                _record_brain_failure(
-                    "invalid_provider_payload",
-                    log_context,
-                    provider=provider,
-                    capability=ai_config.get("capability"),
-                    model=model_name,
-                    status_code=response.status_code,
-                    attempt=attempt,
-                    max_attempts=max_attempts,
-                    timeout_seconds=timeout,
-                    duration_ms=elapsed_ms,
-                    response_excerpt=response.text[:500],
-                    transient=False,
-                )
-                return None
-
-        except requests.exceptions.Timeout:
-            if attempt < max_attempts:
-                sleep_seconds = _build_retry_delay(attempt)
-                logger.warning(
-                    "Timeout al conectar con %s (%ss) (%s), reintentando en %.2fs",
-                    provider,
-                    timeout,
-                    log_context,
-                    sleep_seconds,
-                )
-                time.sleep(sleep_seconds)
-                continue
+def post_nvidia_chat(data, *, timeout, log_context, ai_config=None, max_attempts=None):
+    ai_config = ai_config or get_ai_configuration(AI_TEXT_CAPABILITY)
+    provider = "nvidia"
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials(provider, log_context, ai_config, model_name)
+    if not api_key:
+        return None
+    openai_errors = _import_openai_errors(log_context, ai_config, model_name)
+    if openai_errors is None:
+        return None
 
-            logger.error("Timeout al conectar con %s (%ss) (%s)", provider, timeout, log_context)
-            _record_brain_failure(
-                "timeout",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                transient=True,
-            )
-            return None
-        except requests.exceptions.RequestException as exc:
-            if attempt < max_attempts:
-                sleep_seconds = _build_retry_delay(attempt)
-                logger.warning(
-                    "Error de conexión con %s (%s), reintentando en %.2fs: %s",
-                    provider,
-                    log_context,
-                    sleep_seconds,
-                    exc,
-                )
-                time.sleep(sleep_seconds)
-                continue
+    max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
 
-            logger.error("Error de conexión con %s (%s): %s", provider, log_context, exc)
-            _record_brain_failure(
-                "network_error",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                exception_type=type(exc).__name__,
-                exception_message=str(exc),
-                transient=True,
-            )
-            return None
+    for attempt in range(1, max_attempts + 1):
+        started_at = time.monotonic()
+        _log_chat_attempt(provider, log_context, ai_config, model_name, attempt, max_attempts)
+        try:
+            client = get_connection_manager().get_openai_client(provider, NVIDIA_BASE_URL, api_key)
+            response = client.with_options(timeout=timeout).chat.completions.create(**data)
+            _log_chat_response(provider, log_context, ai_config, model_name, attempt, max_attempts,
+                               int((time.monotonic() - started_at) * 1000))
+            return _openai_response_to_dict(response)
         except Exception as exc:
-            logger.error(
-                "Error inesperado al invocar %s (%s): %s",
-                provider,
-                log_context,
-                exc,
-                exc_info=True,
-            )
-            _record_brain_failure(
-                "unexpected_exception",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                exception_type=type(exc).__name__,
-                exception_message=str(exc),
-                transient=False,
-            )
+            kind, transient, details = _classify_request_exception(exc, provider, log_context, openai_errors)
+
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider=provider,
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout, transient=transient, **details,
+        )
+        if sleep_seconds is None:
             return None
+        time.sleep(sleep_seconds)
 
+    return None
 
-def post_nvidia_chat(data, *, timeout, log_context, ai_config=None, max_attempts=None):
+
+def post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
+    with _ai_call_slots:
+        return _post_ai_chat(
+            data,
+            timeout=timeout,
+            log_context=log_context,
+            ai_config=ai_config,
+            max_attempts=max_attempts,
+        )
+
+
+def _post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
+    provider = _coerce_provider_name(ai_config.get("provider"))
+    if provider == "nvidia":
+        return post_nvidia_chat(
+            data,
+            timeout=timeout,
+            log_context=log_context,
+            ai_config=ai_config,
+            max_attempts=max_attempts,
+        )
+    if provider == "groq":
+        _record_unsupported_chat_provider(log_context, ai_config)
+        return None
+
+    return post_openrouter_chat(
+        data,
+        timeout=timeout,
+        log_context=log_context,
+        ai_config=ai_config,
+        max_attempts=max_attempts,
+    )
+
+
+async def async_post_openrouter_chat(data, *, timeout, log_context, ai_config=None, max_attempts=None):
+    """Versión asyncio de post_openrouter_chat: mismos reintentos y diagnóstico sin bloquear el loop."""
     ai_config = ai_config or get_ai_configuration(AI_TEXT_CAPABILITY)
-    provider = "nvidia"
+    provider = "openrouter"
     model_name = data.get("model") or ai_config.get("model_name")
-    api_key = get_provider_api_key(provider)
+    api_key = _check_provider_credentials(provider, log_context, ai_config, model_name)
     if not api_key:
-        logger.error("ERROR: NVIDIA_API_KEY no está configurado")
-        _record_brain_failure(
-            "missing_api_key",
-            log_context,
-            provider=provider,
-            capability=ai_config.get("capability"),
-            model=model_name,
-            transient=False,
-        )
         return None
 
-    try:
-        from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI
-    except ImportError as exc:
-        logger.error("La dependencia openai no está instalada para el proveedor Nvidia")
-        _record_brain_failure(
-            "missing_dependency",
-            log_context,
-            provider=provider,
-            capability=ai_config.get("capability"),
-            model=model_name,
-            dependency="openai",
-            exception_message=str(exc),
-            transient=False,
+    max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
+    headers = build_openrouter_headers(api_key)
+
+    for attempt in range(1, max_attempts + 1):
+        started_at = time.monotonic()
+        _log_chat_attempt(provider, log_context, ai_config, model_name, attempt, max_attempts)
+        try:
+            client = get_connection_manager().get_async_client(provider, OPENROUTER_URL, api_key)
+            response = await client.post(OPENROUTER_URL, headers=headers, json=data, timeout=timeout)
+        except Exception as exc:
+            failure = _classify_request_exception(exc, provider, log_context)
+        else:
+            elapsed_ms = int((time.monotonic() - started_at) * 1000)
+            _log_chat_response(provider, log_context, ai_config, model_name, attempt, max_attempts,
+                               elapsed_ms, response.status_code)
+            payload, failure = _read_openrouter_response(response, elapsed_ms)
+            if failure is None:
+                return payload
+
+        kind, transient, details = failure
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider=provider,
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout, transient=transient, **details,
         )
+        if sleep_seconds is None:
+            return None
+        await asyncio.sleep(sleep_seconds)
+
+    return None
+
+
+async def async_post_nvidia_chat(data, *, timeout, log_context, ai_config=None, max_attempts=None):
+    """Versión asyncio de post_nvidia_chat usando AsyncOpenAI."""
+    ai_config = ai_config or get_ai_configuration(AI_TEXT_CAPABILITY)
+    provider = "nvidia"
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials(provider, log_context, ai_config, model_name)
+    if not api_key:
+        return None
+    openai_errors = _import_openai_errors(log_context, ai_config, model_name)
+    if openai_errors is None:
         return None
 
     max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
 
     for attempt in range(1, max_attempts + 1):
         started_at = time.monotonic()
+        _log_chat_attempt(provider, log_context, ai_config, model_name, attempt, max_attempts)
         try:
-            logger.info(
-                "Enviando request a %s (%s), intento %s/%s, capacidad=%s, modelo=%s",
-                provider,
-                log_context,
-                attempt,
-                max_attempts,
-                ai_config.get('capability'),
-                model_name,
-            )
-            client = OpenAI(
-                base_url=NVIDIA_BASE_URL,
-                api_key=api_key,
-                timeout=timeout,
-            )
-            response = client.chat.completions.create(**data)
-            elapsed_ms = int((time.monotonic() - started_at) * 1000)
+            client = get_connection_manager().get_async_openai_client(provider, NVIDIA_BASE_URL, api_key)
+            response = await client.with_options(timeout=timeout).chat.completions.create(**data)
+            _log_chat_response(provider, log_context, ai_config, model_name, attempt, max_attempts,
+                               int((time.monotonic() - started_at) * 1000))
+            return _openai_response_to_dict(response)
+        except Exception as exc:
+            kind, transient, details = _classify_request_exception(exc, provider, log_context, openai_errors)
 
-            logger.info(
-                "Respuesta de %s (%s), intento %s/%s, capacidad=%s, modelo=%s, duracion_ms=%s",
-                provider,
-                log_context,
-                attempt,
-                max_attempts,
-                ai_config.get('capability'),
-                model_name,
-                elapsed_ms,
-            )
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider=provider,
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout, transient=transient, **details,
+        )
+        if sleep_seconds is None:
+            return None
+        await asyncio.sleep(sleep_seconds)
 
-            if hasattr(response, 'model_dump'):
-                return response.model_dump(exclude_none=True)
-            if isinstance(response, dict):
-                return response
-
-            return json.loads(response.json())
-
-        except APITimeoutError:
-            if attempt < max_attempts:
-                sleep_seconds = _build_retry_delay(attempt)
-                logger.warning(
-                    "Timeout al conectar con %s (%ss) (%s), reintentando en %.2fs",
-                    provider,
-                    timeout,
-                    log_context,
-                    sleep_seconds,
-                )
-                time.sleep(sleep_seconds)
-                continue
+    return None
 
-            logger.error("Timeout al conectar con %s (%ss) (%s)", provider, timeout, log_context)
-            _record_brain_failure(
-                "timeout",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                transient=True,
-            )
-            return None
-        except APIConnectionError as exc:
-            if attempt < max_attempts:
-                sleep_seconds = _build_retry_delay(attempt)
-                logger.warning(
-                    "Error de conexión con %s (%s), reintentando en %.2fs: %s",
-                    provider,
-                    log_context,
-                    sleep_seconds,
-                    exc,
-                )
-                time.sleep(sleep_seconds)
-                continue
 
-            logger.error("Error de conexión con %s (%s): %s", provider, log_context, exc)
-            _record_brain_failure(
-                "network_error",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                exception_type=type(exc).__name__,
-                exception_message=str(exc),
-                transient=True,
-            )
-            return None
-        except APIStatusError as exc:
-            status_code = getattr(exc, 'status_code', None)
-            body_preview = str(exc)[:500]
-            elapsed_ms = int((time.monotonic() - started_at) * 1000)
+# Cupo global de llamadas de IA en vuelo: el bot atiende usuarios en paralelo,
+# pero los proveedores limitan la concurrencia por API key.
+class _AICallSlots:
+    """Un solo cupo de AI_MAX_CONCURRENT_CALLS compartido por hilos y corrutinas.
 
-            if status_code in TRANSIENT_STATUS_CODES and attempt < max_attempts:
-                sleep_seconds = _build_retry_delay(attempt)
-                logger.warning(
-                    "%s devolvió status %s (%s), reintentando en %.2fs. Respuesta: %s",
-                    provider,
-                    status_code,
-                    log_context,
-                    sleep_seconds,
-                    body_preview,
-                )
-                time.sleep(sleep_seconds)
+    Se usa como `with` desde código síncrono y como `async with` desde el event
+    loop; la espera asíncrona no ocupa un hilo. Cada liberación despierta a un
+    hilo y a una corrutina en espera, que vuelven a intentar tomar el cupo.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._async_waiters = deque()
+
+    def _try_acquire_locked(self):
+        if self._in_flight >= self.limit:
+            return False
+        self._in_flight += 1
+        return True
+
+    def _wake_async_waiter_locked(self):
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if future.done() or loop.is_closed():
                 continue
+            loop.call_soon_threadsafe(self._resolve_waiter, future)
+            return
+
+    def _resolve_waiter(self, future):
+        if future.done():
+            # Se canceló antes de despertar: el aviso pasa al siguiente.
+            with self._lock:
+                self._wake_async_waiter_locked()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._released.notify()
+            self._wake_async_waiter_locked()
+
+    def __enter__(self):
+        with self._released:
+            while not self._try_acquire_locked():
+                self._released.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._try_acquire_locked():
+                    return self
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if future.done() and not future.cancelled():
+                        # Ya lo habían despertado: cede el aviso.
+                        self._wake_async_waiter_locked()
+                raise
 
-            logger.error(
-                "Error en API %s (%s): Status %s, Response: %s",
-                provider,
-                log_context,
-                status_code,
-                body_preview,
-            )
-            _record_brain_failure(
-                "http_status_error",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                status_code=status_code,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                duration_ms=elapsed_ms,
-                response_excerpt=body_preview,
-                transient=status_code in TRANSIENT_STATUS_CODES,
-            )
-            return None
-        except Exception as exc:
-            logger.error(
-                "Error inesperado al invocar %s (%s): %s",
-                provider,
-                log_context,
-                exc,
-                exc_info=True,
-            )
-            _record_brain_failure(
-                "unexpected_exception",
-                log_context,
-                provider=provider,
-                capability=ai_config.get("capability"),
-                model=model_name,
-                attempt=attempt,
-                max_attempts=max_attempts,
-                timeout_seconds=timeout,
-                exception_type=type(exc).__name__,
-                exception_message=str(exc),
-                transient=False,
-            )
-            return None
+    async def __aexit__(self, *exc_info):
+        self.release()
 
 
-def post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
+_ai_call_slots = _AICallSlots(AI_MAX_CONCURRENT_CALLS)
+
+
+async def async_post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
+    async with _ai_call_slots:
+        return await _async_post_ai_chat(
+            data,
+            timeout=timeout,
+            log_context=log_context,
+            ai_config=ai_config,
+            max_attempts=max_attempts,
+        )
+
+
+async def _async_post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
     provider = _coerce_provider_name(ai_config.get("provider"))
     if provider == "nvidia":
-        return post_nvidia_chat(
+        return await async_post_nvidia_chat(
             data,
             timeout=timeout,
             log_context=log_context,
@@ -778,21 +954,10 @@ def post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
             max_attempts=max_attempts,
         )
     if provider == "groq":
-        logger.error(
-            "Proveedor Groq no soportado para chat/completions en esta capacidad (%s)",
-            ai_config.get("capability"),
-        )
-        _record_brain_failure(
-            "unsupported_provider_for_chat",
-            log_context,
-            provider=provider,
-            capability=ai_config.get("capability"),
-            model=ai_config.get("model_name"),
-            transient=False,
-        )
+        _record_unsupported_chat_provider(log_context, ai_config)
         return None
 
-    return post_openrouter_chat(
+    return await async_post_openrouter_chat(
         data,
         timeout=timeout,
         log_context=log_context,
@@ -800,6 +965,322 @@ def post_ai_chat(data, *, timeout, log_context, ai_config, max_attempts=None):
         max_attempts=max_attempts,
     )
 
+# --- STREAMING ---
+# Los reintentos y fallos se resuelven con _resolve_chat_failure, que no
+# reintenta un stream del que ya llegó algún token.
+
+_SSE_DONE = object()
+
+
+def _parse_sse_line(line):
+    """Retorna el payload JSON de una línea SSE `data:`, _SSE_DONE o None si se ignora."""
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    line = (line or "").strip()
+    if not line.startswith("data:"):
+        # Comentarios (": OPENROUTER PROCESSING"), líneas vacías y otros campos SSE.
+        return None
+
+    payload = line[5:].strip()
+    if payload == "[DONE]":
+        return _SSE_DONE
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError:
+        logger.warning("Evento SSE no JSON ignorado: %s", payload[:200])
+        return None
+
+
+def _extract_stream_delta(event):
+    """Extrae (texto_delta, finish_reason, error) de un evento de streaming."""
+    if hasattr(event, "model_dump"):
+        event = event.model_dump(exclude_none=True)
+    if not isinstance(event, dict):
+        return None, None, None
+    if event.get("error"):
+        return None, None, event["error"]
+
+    choices = event.get("choices") or []
+    if not choices:
+        return None, None, None
+    choice = choices[0] or {}
+    delta = choice.get("delta") or {}
+    return extract_message_content_text(delta.get("content")), choice.get("finish_reason"), None
+
+
+def _build_streamed_response(text, finish_reason, model_name):
+    """Da a un stream la misma forma que una respuesta completa de chat/completions."""
+    return {
+        "model": model_name,
+        "choices": [{
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": finish_reason,
+        }],
+    }
+
+
+def _log_stream_completion(ai_config, log_context, model_name, attempt, max_attempts, started_at, first_token_at, chars):
+    logger.info(
+        "Stream de %s completado (%s), intento %s/%s, capacidad=%s, modelo=%s, ttft_ms=%s, duracion_ms=%s, caracteres=%s",
+        ai_config.get("provider"),
+        log_context,
+        attempt,
+        max_attempts,
+        ai_config.get("capability"),
+        model_name,
+        int((first_token_at - started_at) * 1000) if first_token_at else None,
+        int((time.monotonic() - started_at) * 1000),
+        chars,
+    )
+
+
+def stream_openrouter_chat(data, *, timeout, log_context, ai_config, on_delta, max_attempts=None):
+    """Llama a OpenRouter con stream=True, invocando on_delta(texto) por cada fragmento."""
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials("openrouter", log_context, ai_config, model_name)
+    if not api_key:
+        return None
+
+    max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
+    headers = build_openrouter_headers(api_key)
+    payload = dict(data, stream=True)
+
+    for attempt in range(1, max_attempts + 1):
+        started_at = time.monotonic()
+        first_token_at = None
+        parts = []
+        finish_reason = None
+        failure = None
+        try:
+            session = get_connection_manager().get_session("openrouter", OPENROUTER_URL, api_key)
+            with session.post(OPENROUTER_URL, headers=headers, json=payload, timeout=timeout, stream=True) as response:
+                if response.status_code != 200:
+                    failure = _http_status_failure(response.status_code, response.text[:500])
+                else:
+                    for line in response.iter_lines():
+                        event = _parse_sse_line(line)
+                        if event is None:
+                            continue
+                        if event is _SSE_DONE:
+                            break
+                        delta, reason, error = _extract_stream_delta(event)
+                        if error:
+                            failure = ("provider_stream_error", False, {"response_excerpt": _serialize_preview(error)})
+                            break
+                        finish_reason = reason or finish_reason
+                        if delta:
+                            first_token_at = first_token_at or time.monotonic()
+                            parts.append(delta)
+                            on_delta(delta)
+        except Exception as exc:
+            failure = _classify_request_exception(exc, "openrouter", log_context)
+
+        if failure is None:
+            _log_stream_completion(ai_config, log_context, model_name, attempt, max_attempts, started_at, first_token_at, sum(map(len, parts)))
+            return _build_streamed_response("".join(parts), finish_reason, model_name)
+
+        kind, transient, details = failure
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider="openrouter",
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout,
+            received_chars=sum(map(len, parts)), transient=transient, **details,
+        )
+        if sleep_seconds is None:
+            return None
+        time.sleep(sleep_seconds)
+
+    return None
+
+
+def stream_nvidia_chat(data, *, timeout, log_context, ai_config, on_delta, max_attempts=None):
+    """Llama a Nvidia con el SDK de OpenAI en modo stream."""
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials("nvidia", log_context, ai_config, model_name)
+    if not api_key:
+        return None
+    openai_errors = _import_openai_errors(log_context, ai_config, model_name)
+    if openai_errors is None:
+        return None
+
+    max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
+    for attempt in range(1, max_attempts + 1):
+        started_at = time.monotonic()
+        first_token_at = None
+        parts = []
+        finish_reason = None
+        failure = None
+        try:
+            client = get_connection_manager().get_openai_client("nvidia", NVIDIA_BASE_URL, api_key)
+            stream = client.with_options(timeout=timeout).chat.completions.create(**data, stream=True)
+            for chunk in stream:
+                delta, reason, _error = _extract_stream_delta(chunk)
+                finish_reason = reason or finish_reason
+                if delta:
+                    first_token_at = first_token_at or time.monotonic()
+                    parts.append(delta)
+                    on_delta(delta)
+        except Exception as exc:
+            failure = _classify_request_exception(exc, "nvidia", log_context, openai_errors)
+
+        if failure is None:
+            _log_stream_completion(ai_config, log_context, model_name, attempt, max_attempts, started_at, first_token_at, sum(map(len, parts)))
+            return _build_streamed_response("".join(parts), finish_reason, model_name)
+
+        kind, transient, details = failure
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider="nvidia",
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout,
+            received_chars=sum(map(len, parts)), transient=transient, **details,
+        )
+        if sleep_seconds is None:
+            return None
+        time.sleep(sleep_seconds)
+
+    return None
+
+
+async def async_stream_openrouter_chat(data, *, timeout, log_context, ai_config, on_delta, max_attempts=None):
+    """Versión asyncio de stream_openrouter_chat; on_delta es una corrutina."""
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials("openrouter", log_context, ai_config, model_name)
+    if not api_key:
+        return None
+
+    max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
+    headers = build_openrouter_headers(api_key)
+    payload = dict(data, stream=True)
+
+    for attempt in range(1, max_attempts + 1):
+        started_at = time.monotonic()
+        first_token_at = None
+        parts = []
+        finish_reason = None
+        failure = None
+        try:
+            client = get_connection_manager().get_async_client("openrouter", OPENROUTER_URL, api_key)
+            async with client.stream("POST", OPENROUTER_URL, headers=headers, json=payload, timeout=timeout) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    failure = _http_status_failure(
+                        response.status_code, body.decode("utf-8", errors="replace")[:500]
+                    )
+                else:
+                    async for line in response.aiter_lines():
+                        event = _parse_sse_line(line)
+                        if event is None:
+                            continue
+                        if event is _SSE_DONE:
+                            break
+                        delta, reason, error = _extract_stream_delta(event)
+                        if error:
+                            failure = ("provider_stream_error", False, {"response_excerpt": _serialize_preview(error)})
+                            break
+                        finish_reason = reason or finish_reason
+                        if delta:
+                            first_token_at = first_token_at or time.monotonic()
+                            parts.append(delta)
+                            await on_delta(delta)
+        except Exception as exc:
+            failure = _classify_request_exception(exc, "openrouter", log_context)
+
+        if failure is None:
+            _log_stream_completion(ai_config, log_context, model_name, attempt, max_attempts, started_at, first_token_at, sum(map(len, parts)))
+            return _build_streamed_response("".join(parts), finish_reason, model_name)
+
+        kind, transient, details = failure
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider="openrouter",
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout,
+            received_chars=sum(map(len, parts)), transient=transient, **details,
+        )
+        if sleep_seconds is None:
+            return None
+        await asyncio.sleep(sleep_seconds)
+
+    return None
+
+
+async def async_stream_nvidia_chat(data, *, timeout, log_context, ai_config, on_delta, max_attempts=None):
+    """Versión asyncio de stream_nvidia_chat usando AsyncOpenAI."""
+    model_name = data.get("model") or ai_config.get("model_name")
+    api_key = _check_provider_credentials("nvidia", log_context, ai_config, model_name)
+    if not api_key:
+        return None
+    openai_errors = _import_openai_errors(log_context, ai_config, model_name)
+    if openai_errors is None:
+        return None
+
+    max_attempts = max_attempts or OPENROUTER_MAX_ATTEMPTS
+    for attempt in range(1, max_attempts + 1):
+        started_at = time.monotonic()
+        first_token_at = None
+        parts = []
+        finish_reason = None
+        failure = None
+        try:
+            client = get_connection_manager().get_async_openai_client("nvidia", NVIDIA_BASE_URL, api_key)
+            stream = await client.with_options(timeout=timeout).chat.completions.create(**data, stream=True)
+            async for chunk in stream:
+                delta, reason, _error = _extract_stream_delta(chunk)
+                finish_reason = reason or finish_reason
+                if delta:
+                    first_token_at = first_token_at or time.monotonic()
+                    parts.append(delta)
+                    await on_delta(delta)
+        except Exception as exc:
+            failure = _classify_request_exception(exc, "nvidia", log_context, openai_errors)
+
+        if failure is None:
+            _log_stream_completion(ai_config, log_context, model_name, attempt, max_attempts, started_at, first_token_at, sum(map(len, parts)))
+            return _build_streamed_response("".join(parts), finish_reason, model_name)
+
+        kind, transient, details = failure
+        sleep_seconds = _resolve_chat_failure(
+            kind, log_context, ai_config, model_name, provider="nvidia",
+            attempt=attempt, max_attempts=max_attempts, timeout=timeout,
+            received_chars=sum(map(len, parts)), transient=transient, **details,
+        )
+        if sleep_seconds is None:
+            return None
+        await asyncio.sleep(sleep_seconds)
+
+    return None
+
+
+def stream_ai_chat(data, *, timeout, log_context, ai_config, on_delta, max_attempts=None):
+    provider = _coerce_provider_name(ai_config.get("provider"))
+    if provider == "groq":
+        _record_unsupported_chat_provider(log_context, ai_config)
+        return None
+    stream_function = stream_nvidia_chat if provider == "nvidia" else stream_openrouter_chat
+    with _ai_call_slots:
+        return stream_function(
+            data,
+            timeout=timeout,
+            log_context=log_context,
+            ai_config=ai_config,
+            on_delta=on_delta,
+            max_attempts=max_attempts,
+        )
+
+
+async def async_stream_ai_chat(data, *, timeout, log_context, ai_config, on_delta, max_attempts=None):
+    provider = _coerce_provider_name(ai_config.get("provider"))
+    if provider == "groq":
+        _record_unsupported_chat_provider(log_context, ai_config)
+        return None
+    stream_function = async_stream_nvidia_chat if provider == "nvidia" else async_stream_openrouter_chat
+    async with _ai_call_slots:
+        return await stream_function(
+            data,
+            timeout=timeout,
+            log_context=log_context,
+            ai_config=ai_config,
+            on_delta=on_delta,
+            max_attempts=max_attempts,
+        )
+
+
 def extract_json_from_text(text):
     """
     Extrae JSON válido de texto que puede contener markdown o texto adicional.
@@ -825,8 +1306,12 @@ def extract_json_from_text(text):
         return None
 
 
-def request_ai_text(messages, timeout=OPENROUTER_TEXT_TIMEOUT, max_tokens=None, log_context=None, capability=AI_TEXT_CAPABILITY):
-    """Hace una llamada de texto al proveedor activo y retorna texto plano."""
+def request_ai_text(messages, timeout=OPENROUTER_TEXT_TIMEOUT, max_tokens=None, log_context=None, capability=AI_TEXT_CAPABILITY, on_delta=None):
+    """Hace una llamada de texto al proveedor activo y retorna texto plano.
+
+    Si se pasa `on_delta`, la respuesta se pide en streaming y cada fragmento
+    se entrega a ese callback a medida que llega.
+    """
     clear_last_brain_failure()
     ai_config = get_ai_configuration(capability)
     data = {
@@ -837,12 +1322,67 @@ def request_ai_text(messages, timeout=OPENROUTER_TEXT_TIMEOUT, max_tokens=None,
         data["max_tokens"] = max_tokens
 
     resolved_log_context = log_context or f"texto/{len(messages)}_mensajes"
-    response_data = post_ai_chat(
-        data,
-        timeout=timeout,
+    if on_delta is not None:
+        response_data = stream_ai_chat(
+            data,
+            timeout=timeout,
+            log_context=resolved_log_context,
+            ai_config=ai_config,
+            on_delta=on_delta,
+        )
+    else:
+        response_data = post_ai_chat(
+            data,
+            timeout=timeout,
+            log_context=resolved_log_context,
+            ai_config=ai_config,
+        )
+    if not response_data:
+        return None
+
+    content = extract_response_text(
+        response_data,
         log_context=resolved_log_context,
         ai_config=ai_config,
     )
+    if content is None:
+        return None
+
+    logger.info(
+        "Respuesta de %s generada: %s caracteres",
+        ai_config["provider"],
+        len(content),
+    )
+    return content
+
+
+async def async_request_ai_text(messages, timeout=OPENROUTER_TEXT_TIMEOUT, max_tokens=None, log_context=None, capability=AI_TEXT_CAPABILITY, on_delta=None):
+    """Equivalente asyncio de request_ai_text; `on_delta` debe ser una corrutina."""
+    clear_last_brain_failure()
+    ai_config = get_ai_configuration(capability)
+    data = {
+        "model": ai_config["model_name"],
+        "messages": messages,
+    }
+    if max_tokens is not None:
+        data["max_tokens"] = max_tokens
+
+    resolved_log_context = log_context or f"texto/{len(messages)}_mensajes"
+    if on_delta is not None:
+        response_data = await async_stream_ai_chat(
+            data,
+            timeout=timeout,
+            log_context=resolved_log_context,
+            ai_config=ai_config,
+            on_delta=on_delta,
+        )
+    else:
+        response_data = await async_post_ai_chat(
+            data,
+            timeout=timeout,
+            log_context=resolved_log_context,
+            ai_config=ai_config,
+        )
     if not response_data:
         return None
 
@@ -861,9 +1401,9 @@ def request_ai_text(messages, timeout=OPENROUTER_TEXT_TIMEOUT, max_tokens=None,
     )
     return content
 
-def process_user_input(text, history=None, active_reminders=None):
-    clear_last_brain_failure()
 
+def build_user_input_messages(text, history=None, active_reminders=None):
+    """Construye el prompt de recordatorios/chat con calendario, recordatorios activos e historial."""
     # Obtener hora actual de Bogotá
     tz_bogota = pytz.timezone('America/Bogota')
     now = datetime.now(tz_bogota)
@@ -993,12 +1533,10 @@ def process_user_input(text, history=None, active_reminders=None):
     
     # Agregar mensaje actual del usuario
     messages.append({"role": "user", "content": text})
-    
-    content = request_ai_text(
-        messages,
-        timeout=OPENROUTER_TEXT_TIMEOUT,
-        log_context=f"recordatorios/{len(messages)}_mensajes",
-    )
+    return messages
+
+
+def _parse_user_input_response(content):
     if content is None:
         return None
 
@@ -1011,20 +1549,30 @@ def process_user_input(text, history=None, active_reminders=None):
     return parsed_result
 
 
-def process_vision_input(text, image_base64, history=None, active_reminders=None):
-    """Procesa mensajes con imágenes usando el modelo de visión.
-    
-    Args:
-        text: Texto del usuario (puede ser caption o instrucción posterior)
-        image_base64: Imagen codificada en base64 (formato: data:image/jpeg;base64,...)
-        history: Historial de conversación
-        active_reminders: Recordatorios activos del usuario
-    
-    Returns:
-        Dict con la respuesta parseada o None si hay error
-    """
+def process_user_input(text, history=None, active_reminders=None):
     clear_last_brain_failure()
-    
+    messages = build_user_input_messages(text, history, active_reminders)
+    content = request_ai_text(
+        messages,
+        timeout=OPENROUTER_TEXT_TIMEOUT,
+        log_context=f"recordatorios/{len(messages)}_mensajes",
+    )
+    return _parse_user_input_response(content)
+
+
+async def async_process_user_input(text, history=None, active_reminders=None):
+    clear_last_brain_failure()
+    messages = build_user_input_messages(text, history, active_reminders)
+    content = await async_request_ai_text(
+        messages,
+        timeout=OPENROUTER_TEXT_TIMEOUT,
+        log_context=f"recordatorios/{len(messages)}_mensajes",
+    )
+    return _parse_user_input_response(content)
+
+
+def build_vision_messages(text, image_base64, history=None, active_reminders=None):
+    """Construye el prompt multimodal (texto + imagen) para el modelo de visión."""
     # Obtener hora actual de Bogotá
     tz_bogota = pytz.timezone('America/Bogota')
     now = datetime.now(tz_bogota)
@@ -1116,13 +1664,10 @@ def process_vision_input(text, image_base64, history=None, active_reminders=None
     
     # Agregar mensaje actual con imagen
     messages.append({"role": "user", "content": user_content})
-    
-    content = request_ai_text(
-        messages,
-        timeout=OPENROUTER_VISION_TIMEOUT,
-        log_context="vision",
-        capability=AI_VISION_CAPABILITY,
-    )
+    return messages
+
+
+def _parse_vision_response(content):
     if content is None:
         return None
 
@@ -1135,22 +1680,47 @@ def process_vision_input(text, image_base64, history=None, active_reminders=None
     return parsed_result
 
 
-def process_notes_query(user_query, notes_data, history=None):
-    """Genera una respuesta natural del LLM basada en las notas del usuario.
-    
+def process_vision_input(text, image_base64, history=None, active_reminders=None):
+    """Procesa mensajes con imágenes usando el modelo de visión.
+
     Args:
-        user_query: La pregunta original del usuario
-        notes_data: Lista de tuplas con la forma actual de notas en la base de datos
+        text: Texto del usuario (puede ser caption o instrucción posterior)
+        image_base64: Imagen codificada en base64 (formato: data:image/jpeg;base64,...)
         history: Historial de conversación
-    
+        active_reminders: Recordatorios activos del usuario
+
     Returns:
-        String con la respuesta natural, o None si hay error
+        Dict con la respuesta parseada o None si hay error
     """
     clear_last_brain_failure()
+    messages = build_vision_messages(text, image_base64, history, active_reminders)
+    content = request_ai_text(
+        messages,
+        timeout=OPENROUTER_VISION_TIMEOUT,
+        log_context="vision",
+        capability=AI_VISION_CAPABILITY,
+    )
+    return _parse_vision_response(content)
+
+
+async def async_process_vision_input(text, image_base64, history=None, active_reminders=None):
+    """Versión asyncio de process_vision_input."""
+    clear_last_brain_failure()
+    messages = build_vision_messages(text, image_base64, history, active_reminders)
+    content = await async_request_ai_text(
+        messages,
+        timeout=OPENROUTER_VISION_TIMEOUT,
+        log_context="vision",
+        capability=AI_VISION_CAPABILITY,
+    )
+    return _parse_vision_response(content)
 
+
+def build_notes_query_messages(user_query, notes_data, history=None):
+    """Construye el prompt de consulta de notas con las notas como contexto."""
     # Formatear notas como contexto
     if notes_data:
-        notes_context = "NOTAS GUARDADAS POR EL USUARIO:\n"
+        notes_context = "NOTAS GUARDADAS POR EL USUARIO (las más relevantes para esta consulta):\n"
         for note in notes_data:
             note_id = note[0]
             content = note[1]
@@ -1174,7 +1744,7 @@ El usuario te preguntó algo y necesitas responder basándote en sus notas guard
 Reglas:
 - Responde de forma natural y amable en español.
 - Si el usuario pregunta por algo específico (como una contraseña o dato), busca en las notas y respóndele directamente.
-- Si pide ver todas sus notas, lístalas de forma organizada.
+- Si pide ver todas sus notas, lista las que aparecen arriba de forma organizada; pueden no ser todas las que tiene guardadas.
 - Si no tiene notas o no encuentras lo que busca, díselo amablemente y sugiere usar /nota para guardar información.
 - Responde SOLO con texto plano (NO JSON). Tu respuesta se enviará directamente al usuario.
 """
@@ -1185,7 +1755,22 @@ Reglas:
         messages.extend(history)
     
     messages.append({"role": "user", "content": user_query})
-    
+    return messages
+
+
+def process_notes_query(user_query, notes_data, history=None):
+    """Genera una respuesta natural del LLM basada en las notas del usuario.
+
+    Args:
+        user_query: La pregunta original del usuario
+        notes_data: Lista de tuplas con la forma actual de notas en la base de datos
+        history: Historial de conversación
+
+    Returns:
+        String con la respuesta natural, o None si hay error
+    """
+    clear_last_brain_failure()
+    messages = build_notes_query_messages(user_query, notes_data, history)
     content = request_ai_text(
         messages,
         timeout=OPENROUTER_TEXT_TIMEOUT,
@@ -1198,27 +1783,198 @@ Reglas:
     logger.info(f"Respuesta de notas: {content[:100]}...")
     return content
 
-def process_video_summary(transcript, user_instruction=None, history=None, video_source="X.com"):
-    """Analiza y resume la transcripción de un video usando el proveedor activo.
-    
-    Args:
-        transcript: Texto transcrito del video.
-        user_instruction: Instrucción adicional del usuario (ej: "¿de qué hablan?").
-        history: Historial de conversación.
-        video_source: Fuente del video, por ejemplo "X.com" o "YouTube".
-    
-    Returns:
-        String con el resumen/análisis, o None si hay error.
-    """
+
+async def async_process_notes_query(user_query, notes_data, history=None, on_delta=None):
+    """Versión asyncio de process_notes_query; con `on_delta` la respuesta llega en streaming."""
     clear_last_brain_failure()
+    messages = build_notes_query_messages(user_query, notes_data, history)
+    content = await async_request_ai_text(
+        messages,
+        timeout=OPENROUTER_TEXT_TIMEOUT,
+        log_context="notas",
+        on_delta=on_delta,
+    )
+    if content is None:
+        return None
 
-    # Truncar transcript si es muy largo para no exceder límites del modelo
-    max_transcript_chars = 15000  # ~3750 tokens aprox
+    content = content.strip()
+    logger.info(f"Respuesta de notas: {content[:100]}...")
+    return content
+
+
+def _format_media_timestamp(seconds):
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def split_transcript_segments(transcript, max_tokens=VIDEO_SEGMENT_MAX_TOKENS, duration_seconds=None):
+    """Parte una transcripción en tramos de hasta `max_tokens`, cortando entre oraciones.
+
+    Si se conoce la duración del video, cada tramo lleva su rango de tiempo
+    aproximado (proporcional a su posición en el texto).
+    Retorna [{"index", "text", "time_range"}].
+    """
+    max_tokens = max(50, max_tokens)
+    sentences = re.split(r"(?<=[.!?…])\s+", transcript.strip())
+
+    pieces = []
+    for sentence in sentences:
+        sentence_tokens = estimate_tokens(sentence)
+        if sentence_tokens <= max_tokens:
+            pieces.append((sentence, sentence_tokens))
+            continue
+        # Subtítulos automáticos sin puntuación: se corta por palabras.
+        current = []
+        current_tokens = 0
+        for word in sentence.split():
+            word_tokens = estimate_tokens(word)
+            if current and current_tokens + word_tokens > max_tokens:
+                pieces.append((" ".join(current), current_tokens))
+                current = []
+                current_tokens = 0
+            current.append(word)
+            current_tokens += word_tokens
+        if current:
+            pieces.append((" ".join(current), current_tokens))
+
+    segments = []
+    current = []
+    current_tokens = 0
+    for piece, piece_tokens in pieces:
+        if current and current_tokens + piece_tokens > max_tokens:
+            segments.append(" ".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        segments.append(" ".join(current))
+
+    total_chars = sum(len(segment) for segment in segments) or 1
+    result = []
+    offset = 0
+    for index, text in enumerate(segments, start=1):
+        time_range = None
+        if duration_seconds:
+            start_seconds = duration_seconds * offset / total_chars
+            end_seconds = duration_seconds * (offset + len(text)) / total_chars
+            time_range = f"{_format_media_timestamp(start_seconds)}–{_format_media_timestamp(end_seconds)}"
+        result.append({"index": index, "text": text, "time_range": time_range})
+        offset += len(text)
+    return result
+
+
+_segment_summary_cache = OrderedDict()
+_segment_summary_cache_lock = threading.Lock()
+
+
+def _segment_summary_cache_key(text):
+    model_key = f"{get_analysis_provider()}:{get_analysis_model()}"
+    return hashlib.sha256(f"{model_key}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _get_cached_segment_summary(cache_key):
+    with _segment_summary_cache_lock:
+        summary = _segment_summary_cache.get(cache_key)
+        if summary is not None:
+            _segment_summary_cache.move_to_end(cache_key)
+        return summary
+
+
+def _store_segment_summary(cache_key, summary):
+    with _segment_summary_cache_lock:
+        _segment_summary_cache[cache_key] = summary
+        _segment_summary_cache.move_to_end(cache_key)
+        while len(_segment_summary_cache) > VIDEO_SEGMENT_CACHE_SIZE:
+            _segment_summary_cache.popitem(last=False)
+
+
+def build_video_segment_messages(segment, total_segments, video_source="X.com"):
+    """Prompt de la fase map: resumir un tramo sin perder datos concretos."""
+    time_hint = f" ({segment['time_range']})" if segment.get("time_range") else ""
+    system_prompt = """Eres 'Clusivai'. Recibes UN TRAMO de la transcripción de un video largo.
+Resume solo ese tramo para una consolidación posterior.
+
+Reglas:
+- Responde en español y en texto plano.
+- Máximo 6 bullets de una línea.
+- Conserva nombres, cifras, fechas y afirmaciones concretas.
+- No inventes contenido ni hables del proceso.
+"""
+    user_content = (
+        f"VIDEO DE {(video_source or 'video').upper()} · TRAMO {segment['index']}/{total_segments}{time_hint}\n"
+        + "─" * 40 + "\n"
+        + segment["text"]
+        + "\n" + "─" * 40
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def _format_segment_summaries(segments, summaries):
+    return "\n\n".join(
+        f"TRAMO {segment['index']}"
+        + (f" ({segment['time_range']})" if segment.get("time_range") else "")
+        + f":\n{summary}"
+        for segment, summary in zip(segments, summaries)
+        if summary
+    )
+
+
+def _group_for_reduce(segments, summaries):
+    """Agrupa resúmenes consecutivos en bloques que caben en un tramo del reduce."""
+    groups = []
+    current = []
+    current_tokens = 0
+    for segment, summary in zip(segments, summaries):
+        if not summary:
+            continue
+        tokens = estimate_tokens(summary)
+        if current and current_tokens + tokens > VIDEO_SEGMENT_MAX_TOKENS:
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append((segment, summary))
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+
+    reduced_segments = []
+    for index, group in enumerate(groups, start=1):
+        ranges = [segment["time_range"] for segment, _summary in group if segment.get("time_range")]
+        time_range = None
+        if ranges:
+            time_range = f"{ranges[0].split('–')[0]}–{ranges[-1].split('–')[-1]}"
+        reduced_segments.append({
+            "index": index,
+            "text": _format_segment_summaries(
+                [segment for segment, _summary in group],
+                [summary for _segment, summary in group],
+            ),
+            "time_range": time_range,
+        })
+    return reduced_segments
+
+
+def build_video_summary_messages(transcript, user_instruction=None, history=None, video_source="X.com",
+                                 from_segment_summaries=False):
+    """Construye el prompt de análisis de video a partir de la transcripción.
+
+    Con `from_segment_summaries`, `transcript` contiene los resúmenes por tramo
+    de un video largo (fase reduce) en lugar del texto transcrito.
+    """
+    # Red de seguridad: lo que supere el límite directo ya llega resumido por tramos.
+    transcript_tokens = estimate_tokens(transcript)
     truncated = False
-    if len(transcript) > max_transcript_chars:
-        transcript = transcript[:max_transcript_chars]
+    if transcript_tokens > VIDEO_TRANSCRIPT_DIRECT_MAX_TOKENS:
+        transcript = transcript[:len(transcript) * VIDEO_TRANSCRIPT_DIRECT_MAX_TOKENS // transcript_tokens]
         truncated = True
-
     source_label = (video_source or "video").strip()
     source_upper = source_label.upper()
     transcript_origin = "se ha transcrito automaticamente su audio"
@@ -1246,16 +2002,14 @@ Reglas:
 
     messages = [{"role": "system", "content": system_prompt}]
     
-    # Agregar historial relevante (solo los últimos mensajes para contexto)
-    if history:
-        # Limitar historial para no exceder el contexto del modelo
-        recent_history = history[-6:] if len(history) > 6 else history
-        for msg in recent_history:
-            if isinstance(msg.get("content"), str):
-                messages.append(msg)
+    # Agregar historial relevante (solo los últimos mensajes, para no exceder el contexto del modelo)
+    messages.extend(recent_history_messages(history, VIDEO_HISTORY_MESSAGES))
     
     # Construir mensaje del usuario con la transcripción
-    user_content = f"TRANSCRIPCION DEL VIDEO DE {source_upper}:\n"
+    if from_segment_summaries:
+        user_content = f"RESÚMENES POR TRAMOS DEL VIDEO DE {source_upper} (cubren el video completo):\n"
+    else:
+        user_content = f"TRANSCRIPCION DEL VIDEO DE {source_upper}:\n"
     user_content += "─" * 40 + "\n"
     user_content += transcript
     user_content += "\n" + "─" * 40
@@ -1267,7 +2021,116 @@ Reglas:
         user_content += f"\n\nINSTRUCCIÓN DEL USUARIO: {user_instruction}"
     
     messages.append({"role": "user", "content": user_content})
-    
+    return messages
+
+
+def _summarize_video_segments(segments, video_source, on_progress=None):
+    """Fase map síncrona: resume cada tramo (con caché por contenido)."""
+    summaries = []
+    for segment in segments:
+        cache_key = _segment_summary_cache_key(segment["text"])
+        summary = _get_cached_segment_summary(cache_key)
+        if summary is None:
+            summary = request_ai_text(
+                build_video_segment_messages(segment, len(segments), video_source),
+                timeout=OPENROUTER_VIDEO_TIMEOUT,
+                max_tokens=VIDEO_SEGMENT_SUMMARY_MAX_TOKENS,
+                log_context=f"video_segment/{segment['index']}_{len(segments)}",
+                capability=AI_ANALYSIS_CAPABILITY,
+            )
+            if summary:
+                summary = summary.strip()
+                _store_segment_summary(cache_key, summary)
+        summaries.append(summary)
+        if on_progress:
+            on_progress(len(summaries), len(segments))
+    return summaries
+
+
+async def _async_summarize_video_segments(segments, video_source, on_progress=None):
+    """Fase map: resume los tramos en paralelo (acotado) y conserva su orden."""
+    slots = asyncio.Semaphore(VIDEO_SEGMENT_CONCURRENCY)
+    completed = 0
+
+    async def summarize(segment):
+        nonlocal completed
+        cache_key = _segment_summary_cache_key(segment["text"])
+        summary = _get_cached_segment_summary(cache_key)
+        if summary is None:
+            async with slots:
+                summary = await async_request_ai_text(
+                    build_video_segment_messages(segment, len(segments), video_source),
+                    timeout=OPENROUTER_VIDEO_TIMEOUT,
+                    max_tokens=VIDEO_SEGMENT_SUMMARY_MAX_TOKENS,
+                    log_context=f"video_segment/{segment['index']}_{len(segments)}",
+                    capability=AI_ANALYSIS_CAPABILITY,
+                )
+            if summary:
+                summary = summary.strip()
+                _store_segment_summary(cache_key, summary)
+        completed += 1
+        if on_progress:
+            await on_progress(completed, len(segments))
+        return summary
+
+    return await asyncio.gather(*(summarize(segment) for segment in segments))
+
+
+def _needs_map_reduce(transcript):
+    return estimate_tokens(transcript) > VIDEO_TRANSCRIPT_DIRECT_MAX_TOKENS
+
+
+def _finish_video_reduce_level(level, segments, summaries):
+    """Cierra un nivel del map-reduce, igual en la versión síncrona y en la asyncio.
+
+    Retorna (texto consolidado, tramos del siguiente nivel), o (None, None)
+    si no se obtuvo ningún resumen.
+    """
+    if not any(summaries):
+        return None, None
+    logger.info(
+        "Transcripción resumida por tramos (nivel %s): %s tramos, %s fallidos",
+        level,
+        len(segments),
+        sum(1 for summary in summaries if not summary),
+    )
+    return _format_segment_summaries(segments, summaries), _group_for_reduce(segments, summaries)
+
+
+def process_video_summary(transcript, user_instruction=None, history=None, video_source="X.com",
+                          duration_seconds=None):
+    """Analiza y resume la transcripción de un video usando el proveedor activo.
+
+    Las transcripciones largas se resumen por tramos y luego se consolidan,
+    de modo que el análisis cubre el video completo.
+
+    Args:
+        transcript: Texto transcrito del video.
+        user_instruction: Instrucción adicional del usuario (ej: "¿de qué hablan?").
+        history: Historial de conversación.
+        video_source: Fuente del video, por ejemplo "X.com" o "YouTube".
+        duration_seconds: Duración del video, para ubicar los tramos en el tiempo.
+
+    Returns:
+        String con el resumen/análisis, o None si hay error.
+    """
+    clear_last_brain_failure()
+    from_segments = False
+    segments = None
+    level = 0
+    while _needs_map_reduce(transcript) and level < VIDEO_REDUCE_MAX_LEVELS:
+        level += 1
+        if segments is None:
+            segments = split_transcript_segments(transcript, duration_seconds=duration_seconds)
+        summaries = _summarize_video_segments(segments, video_source)
+        transcript, segments = _finish_video_reduce_level(level, segments, summaries)
+        if transcript is None:
+            return None
+        from_segments = True
+
+    messages = build_video_summary_messages(
+        transcript, user_instruction, history, video_source, from_segment_summaries=from_segments
+    )
     content = request_ai_text(
         messages,
         timeout=OPENROUTER_VIDEO_TIMEOUT,
@@ -1282,8 +2145,76 @@ Reglas:
     return content
 
 
-def process_repository_chunk(repo_slug, repo_summary, repo_tree, chunk_content, chunk_index, total_chunks, history=None):
-    """Analiza una parte del digest de GitIngest y produce hallazgos parciales compactos."""
+async def async_process_video_summary(transcript, user_instruction=None, history=None, video_source="X.com",
+                                      on_delta=None, on_progress=None, duration_seconds=None):
+    """Versión asyncio de process_video_summary; con `on_delta` la respuesta llega en streaming.
+
+    `on_progress(texto)` (corrutina) recibe el avance de la fase por tramos.
+    """
+    clear_last_brain_failure()
+    from_segments = False
+    segments = None
+    level = 0
+    while _needs_map_reduce(transcript) and level < VIDEO_REDUCE_MAX_LEVELS:
+        level += 1
+        if segments is None:
+            segments = split_transcript_segments(transcript, duration_seconds=duration_seconds)
+        label = "Resumiendo el video por tramos" if level == 1 else "Consolidando los resúmenes"
+
+        async def report(completed, total, label=label):
+            if on_progress:
+                await on_progress(f"🧠 {label} ({completed}/{total})...")
+
+        if on_progress:
+            await on_progress(f"🧠 {label} (0/{len(segments)})...")
+        summaries = await _async_summarize_video_segments(segments, video_source, report)
+        transcript, segments = _finish_video_reduce_level(level, segments, summaries)
+        if transcript is None:
+            return None
+        from_segments = True
+
+    if from_segments and on_progress:
+        await on_progress("🧠 Redactando el análisis del video completo...")
+
+    messages = build_video_summary_messages(
+        transcript, user_instruction, history, video_source, from_segment_summaries=from_segments
+    )
+    content = await async_request_ai_text(
+        messages,
+        timeout=OPENROUTER_VIDEO_TIMEOUT,
+        log_context="video_summary",
+        capability=AI_ANALYSIS_CAPABILITY,
+        on_delta=on_delta,
+    )
+    if content is None:
+        return None
+
+    content = content.strip()
+    logger.info(f"Resumen de video generado: {len(content)} caracteres")
+    return content
+
+
+def recent_history_messages(history, limit):
+    """Mensajes de texto entre los últimos `limit` del historial: el contexto que ve el modelo."""
+    if not history:
+        return []
+    return [msg for msg in history[-limit:] if isinstance(msg.get("content"), str)]
+
+
+def build_history_digest(history, limit):
+    """Digest del historial que entra al prompt, para las llaves de caché ("" si no hay)."""
+    recent_history = recent_history_messages(history, limit)
+    if not recent_history:
+        return ""
+    serialized = json.dumps(recent_history, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+def process_repository_chunk(repo_slug, repo_summary, repo_tree, chunk_content, chunk_index, total_chunks):
+    """Analiza una parte del digest de GitIngest y produce hallazgos parciales compactos.
+
+    No usa el historial del usuario: el resultado se cachea y se comparte entre usuarios.
+    """
     system_prompt = """Eres 'Clusivai', un asistente técnico que analiza repositorios de GitHub.
 El usuario quiere entender de qué trata un repositorio basándote en un digest generado con GitIngest.
 
@@ -1304,12 +2235,6 @@ Reglas:
 
     messages = [{"role": "system", "content": system_prompt}]
 
-    if history:
-        recent_history = history[-REPO_HISTORY_MESSAGES:] if len(history) > REPO_HISTORY_MESSAGES else history
-        for msg in recent_history:
-            if isinstance(msg.get("content"), str):
-                messages.append(msg)
-
     user_content = (
         f"REPOSITORIO: {repo_slug}\n"
         f"PARTE: {chunk_index}/{total_chunks}\n\n"
@@ -1328,8 +2253,12 @@ Reglas:
     )
 
 
-def synthesize_repository_analysis(repo_slug, repo_summary, repo_tree, partial_analyses, history=None):
-    """Consolida los análisis parciales en una explicación final compacta."""
+def synthesize_repository_analysis(repo_slug, repo_summary, repo_tree, partial_analyses, history=None, on_delta=None):
+    """Consolida los análisis parciales en una explicación final compacta.
+
+    Solo esta etapa usa el historial (sin historial, para consolidaciones
+    intermedias compartibles). `on_delta` permite recibir la síntesis en streaming.
+    """
     system_prompt = """Eres 'Clusivai', un asistente técnico que explica repositorios de GitHub en español.
 Has recibido varios análisis parciales del mismo repositorio y debes producir una explicación final compacta, clara y puntual.
 
@@ -1348,12 +2277,7 @@ Reglas:
 """
 
     messages = [{"role": "system", "content": system_prompt}]
-
-    if history:
-        recent_history = history[-REPO_HISTORY_MESSAGES:] if len(history) > REPO_HISTORY_MESSAGES else history
-        for msg in recent_history:
-            if isinstance(msg.get("content"), str):
-                messages.append(msg)
+    messages.extend(recent_history_messages(history, REPO_HISTORY_MESSAGES))
 
     partials_text = "\n\n".join(
         f"ANÁLISIS PARCIAL {index}:\n{analysis}"
@@ -1375,4 +2299,5 @@ Reglas:
         max_tokens=REPO_SYNTHESIS_MAX_TOKENS,
         log_context="repo_synthesis",
         capability=AI_ANALYSIS_CAPABILITY,
+        on_delta=on_delta,
     )
@@ -1,8 +1,14 @@
+import logging
 import os
+import re
 import sqlite3
+import threading
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'reminders.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '128'))
 UNCATEGORIZED_LABEL = 'Sin categoría'
 AI_TEXT_CAPABILITY = 'text'
 AI_ANALYSIS_CAPABILITY = 'analysis'
@@ -22,9 +28,83 @@ AI_PROVIDER_CAPABILITIES = {
     'groq': (AI_TRANSCRIPT_CAPABILITY,),
 }
 
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión SQLite cuyo close() la devuelve al pool en lugar de cerrarla."""
+
+    def close(self):
+        _release_connection(self)
+
+    def close_physical(self):
+        sqlite3.Connection.close(self)
+
+
+_pool_lock = threading.Lock()
+_idle_connections = []
+_pool_owner_pid = None
+_pool_db_path = None
+
+
+def _open_pooled_connection():
+    # check_same_thread=False: la conexión pasa de un hilo a otro entre usos,
+    # pero el pool garantiza que nunca la usan dos hilos al mismo tiempo.
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+        factory=PooledConnection,
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}')
+    return conn
+
 
 def get_connection():
-    return sqlite3.connect(DB_PATH)
+    """Toma una conexión del pool compartido (bot, jobs y hilos de Flask)."""
+    global _pool_owner_pid, _pool_db_path
+    with _pool_lock:
+        # Tras un fork (worker de análisis) o un cambio de DB_PATH, las
+        # conexiones heredadas no son reutilizables.
+        if _pool_owner_pid != os.getpid() or _pool_db_path != DB_PATH:
+            _idle_connections.clear()
+            _pool_owner_pid = os.getpid()
+            _pool_db_path = DB_PATH
+        if _idle_connections:
+            return _idle_connections.pop()
+
+    return _open_pooled_connection()
+
+
+def _release_connection(conn):
+    # Igual que con un close() real, lo no confirmado se descarta.
+    if conn.in_transaction:
+        conn.rollback()
+
+    with _pool_lock:
+        if (
+            _pool_owner_pid == os.getpid()
+            and _pool_db_path == DB_PATH
+            and len(_idle_connections) < DB_POOL_SIZE
+            and conn not in _idle_connections
+        ):
+            _idle_connections.append(conn)
+            return
+
+    conn.close_physical()
+
+
+def close_all_connections():
+    """Cierra físicamente las conexiones ociosas del pool."""
+    with _pool_lock:
+        connections = list(_idle_connections)
+        _idle_connections.clear()
+
+    for conn in connections:
+        conn.close_physical()
 
 
 def normalize_note_category(category):
@@ -195,6 +275,141 @@ def ensure_note_subcategories_table(cursor):
     ''')
 
 
+def ensure_query_indexes(cursor):
+    """Crea los índices que usan las consultas de recordatorios y notas.
+
+    Los ORDER BY y rangos por fecha se resuelven sobre el índice porque
+    `remind_at` se guarda con espacio; migrate_db.py normaliza una sola vez
+    los valores antiguos con 'T'.
+    """
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reminders_pending_due
+        ON reminders (remind_at)
+        WHERE status = 'pending'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reminders_user_status_due
+        ON reminders (user_id, status, remind_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notes_user_created
+        ON notes (user_id, created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notes_user_category_created
+        ON notes (user_id, lower(category), created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notes_subcategory
+        ON notes (subcategory_id)
+    ''')
+
+
+
+def ensure_reminders_version(cursor):
+    """Crea el contador de cambios de recordatorios y los triggers que lo incrementan.
+
+    Solo cuentan las altas, bajas y cambios de fecha o estado, que son lo que
+    mueve la agenda del bot; así otro proceso (server.py) se detecta con un
+    SELECT de una fila.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminders_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO reminders_version (id, version) VALUES (1, 0)
+    ''')
+    for trigger_name, trigger_event in (
+        ('reminders_version_after_insert', 'AFTER INSERT ON reminders'),
+        ('reminders_version_after_delete', 'AFTER DELETE ON reminders'),
+        ('reminders_version_after_update', 'AFTER UPDATE OF remind_at, status ON reminders'),
+    ):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {trigger_name} {trigger_event} BEGIN
+                UPDATE reminders_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+NOTES_SEARCH_STOPWORDS = frozenset({
+    'a', 'al', 'algo', 'con', 'cual', 'cuál', 'cuales', 'cuáles', 'de', 'del', 'donde',
+    'dónde', 'el', 'en', 'es', 'esta', 'este', 'la', 'las', 'le', 'lo', 'los', 'me',
+    'mi', 'mis', 'nota', 'notas', 'o', 'para', 'por', 'que', 'qué', 'se', 'su', 'sus',
+    'tengo', 'tu', 'tus', 'un', 'una', 'unos', 'y', 'yo',
+})
+
+_notes_fts_available = None
+
+
+def ensure_notes_fts(cursor):
+    """Crea el índice FTS5 de notas y los triggers que lo mantienen sincronizado.
+
+    Retorna False si la versión de SQLite no incluye FTS5; en ese caso
+    search_notes() cae en una búsqueda LIKE.
+    """
+    global _notes_fts_available
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'")
+    fts_exists = cursor.fetchone() is not None
+
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                content,
+                category,
+                content = 'notes',
+                content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as exc:
+        logger.warning("FTS5 no disponible; la búsqueda de notas usará LIKE: %s", exc)
+        _notes_fts_available = False
+        return False
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS notes_fts_after_insert AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts (rowid, content, category)
+            VALUES (new.id, new.content, new.category);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS notes_fts_after_delete AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts (notes_fts, rowid, content, category)
+            VALUES ('delete', old.id, old.content, old.category);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS notes_fts_after_update AFTER UPDATE OF content, category ON notes BEGIN
+            INSERT INTO notes_fts (notes_fts, rowid, content, category)
+            VALUES ('delete', old.id, old.content, old.category);
+            INSERT INTO notes_fts (rowid, content, category)
+            VALUES (new.id, new.content, new.category);
+        END
+    ''')
+
+    if not fts_exists:
+        # Indexa las notas que existían antes de crear la tabla FTS.
+        cursor.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+
+    _notes_fts_available = True
+    return True
+
+
+def build_notes_fts_query(text):
+    """Convierte una consulta en lenguaje natural en una expresión MATCH de FTS5."""
+    terms = []
+    for token in re.findall(r'\w+', str(text or '').lower()):
+        if len(token) < 2 or token in NOTES_SEARCH_STOPWORDS or token in terms:
+            continue
+        terms.append(token)
+
+    # Cada término va entre comillas para neutralizar la sintaxis de FTS5 y con
+    # prefijo para que "contraseña" encuentre "contraseñas".
+    return ' OR '.join(f'"{term}"*' for term in terms[:16])
+
+
 def ensure_ai_config_tables(cursor):
     """Crea las tablas e índices necesarios para la configuración global de IA."""
     cursor.execute('''
@@ -221,6 +436,46 @@ def ensure_ai_config_tables(cursor):
         CREATE INDEX IF NOT EXISTS idx_ai_model_catalog_lookup
         ON ai_model_catalog (capability, provider, model_name)
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_settings_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO ai_settings_version (id, version) VALUES (1, 0)
+    ''')
+
+
+# Contador local del proceso: permite invalidar cachés de configuración en el
+# mismo proceso sin esperar a releer la versión persistida en la base de datos.
+_local_ai_settings_version = 0
+
+
+def bump_ai_settings_version(cursor):
+    """Incrementa la versión de configuración de IA compartida entre procesos."""
+    global _local_ai_settings_version
+    cursor.execute('UPDATE ai_settings_version SET version = version + 1 WHERE id = 1')
+    _local_ai_settings_version += 1
+
+
+def get_local_ai_settings_version():
+    """Versión de configuración modificada por este proceso (sin I/O)."""
+    return _local_ai_settings_version
+
+
+def get_ai_settings_version():
+    """Obtiene la versión persistida de la configuración de IA.
+
+    Se consulta en cada lectura de la configuración, así que es un SELECT sin
+    DDL: init_db crea la tabla y su fila.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM ai_settings_version WHERE id = 1')
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
 
 
 def serialize_ai_setting_row(row):
@@ -336,9 +591,91 @@ def init_db():
     ensure_notes_subcategory_column(cursor)
     ensure_note_subcategories_table(cursor)
     ensure_ai_config_tables(cursor)
+    ensure_query_indexes(cursor)
+    ensure_reminders_version(cursor)
+    ensure_notes_fts(cursor)
     conn.commit()
     conn.close()
 
+_reminder_change_listeners = []
+
+
+def register_reminder_change_listener(listener):
+    """Registra un callback `listener(reminder_ids)` para cambios en recordatorios.
+
+    `reminder_ids` es una lista de IDs afectados, o None si no se conocen
+    (por ejemplo, un borrado por coincidencia de texto).
+    """
+    if listener not in _reminder_change_listeners:
+        _reminder_change_listeners.append(listener)
+
+
+def unregister_reminder_change_listener(listener):
+    if listener in _reminder_change_listeners:
+        _reminder_change_listeners.remove(listener)
+
+
+def _notify_reminder_change(reminder_ids):
+    for listener in list(_reminder_change_listeners):
+        try:
+            listener(reminder_ids)
+        except Exception:
+            logger.exception("Error notificando cambio de recordatorios")
+
+
+# Consultas calientes de recordatorios. Son constantes para que
+# tests/test_query_plans.py verifique su EXPLAIN QUERY PLAN.
+DUE_REMINDERS_QUERY = (
+    "SELECT id, user_id, message, remind_at, recurrence, image_file_id FROM reminders "
+    "WHERE remind_at <= ? AND status = 'pending'"
+)
+PENDING_REMINDER_SCHEDULE_QUERY = "SELECT id, remind_at FROM reminders WHERE status = 'pending'"
+# Ordenar por remind_at hace que SQLite recorra el índice parcial de pendientes
+# en lugar de todo idx_reminders_user_status_due (que incluye los enviados).
+PENDING_REMINDER_SCHEDULE_ORDER = ' ORDER BY remind_at'
+USER_REMINDERS_QUERY = '''
+    SELECT id, message, remind_at, recurrence, image_file_id
+    FROM reminders
+    WHERE user_id = ? AND status = 'pending'
+    ORDER BY remind_at ASC, id ASC
+'''
+TODAY_REMINDERS_QUERY = '''
+    SELECT id, message, remind_at FROM reminders
+    WHERE user_id = ? AND status = 'pending'
+    AND remind_at >= ? AND remind_at <= ?
+    ORDER BY remind_at ASC
+'''
+
+
+def get_pending_reminder_schedule(reminder_ids=None):
+    """Lista (id, remind_at) de recordatorios pendientes, opcionalmente filtrando por IDs."""
+    query = PENDING_REMINDER_SCHEDULE_QUERY
+    params = []
+    if reminder_ids is not None:
+        if not reminder_ids:
+            return []
+        query += f' AND id IN ({", ".join("?" for _ in reminder_ids)})'
+        params.extend(int(reminder_id) for reminder_id in reminder_ids)
+    query += PENDING_REMINDER_SCHEDULE_ORDER
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    conn.close()
+    return [(row[0], normalize_reminder_datetime(row[1])) for row in rows]
+
+
+def get_reminders_version():
+    """Versión del contador de recordatorios; cambia con cada escritura de cualquier proceso."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM reminders_version WHERE id = 1')
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
 def add_reminder(user_id, message, remind_at, recurrence=None, image_file_id=None):
     remind_at = normalize_reminder_datetime(remind_at)
 
@@ -349,20 +686,13 @@ def add_reminder(user_id, message, remind_at, recurrence=None, image_file_id=Non
     reminder_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    _notify_reminder_change([reminder_id])
     return reminder_id
 
 def get_user_reminders(user_id):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT id, message, remind_at, recurrence, image_file_id
-        FROM reminders
-        WHERE user_id = ? AND status = "pending"
-        ORDER BY datetime(replace(remind_at, 'T', ' ')) ASC, id ASC
-        ''',
-        (user_id,),
-    )
+    cursor.execute(USER_REMINDERS_QUERY, (user_id,))
     rows = cursor.fetchall()
     conn.close()
     return rows
@@ -383,16 +713,18 @@ def delete_reminder_by_text(user_id, search_text):
     try:
         # Intenta convertir search_text a ID (entero)
         reminder_id = int(search_text)
-        cursor.execute('DELETE FROM reminders WHERE user_id = ? AND id = ? AND status = "pending"', 
+        cursor.execute("DELETE FROM reminders WHERE user_id = ? AND id = ? AND status = 'pending'", 
                        (user_id, reminder_id))
     except ValueError:
         # Si no es un ID numérico, busca por palabra clave (búsqueda parcial con LIKE)
-        cursor.execute('DELETE FROM reminders WHERE user_id = ? AND message LIKE ? AND status = "pending"', 
+        cursor.execute("DELETE FROM reminders WHERE user_id = ? AND message LIKE ? AND status = 'pending'", 
                        (user_id, f"%{search_text}%"))
     
     deleted_count = cursor.rowcount
     conn.commit()
     conn.close()
+    if deleted_count:
+        _notify_reminder_change(None)
     return deleted_count
 
 def update_reminder_by_id(user_id, reminder_id, new_message=None, new_date=None, new_recurrence=None):
@@ -443,6 +775,8 @@ def update_reminder_by_id(user_id, reminder_id, new_message=None, new_date=None,
     success = cursor.rowcount > 0
     conn.commit()
     conn.close()
+    if success:
+        _notify_reminder_change([reminder_id])
     return success
 
 def delete_reminder_by_id(user_id, reminder_id):
@@ -461,6 +795,8 @@ def delete_reminder_by_id(user_id, reminder_id):
     success = cursor.rowcount > 0
     conn.commit()
     conn.close()
+    if success:
+        _notify_reminder_change([reminder_id])
     return success
 
 def set_daily_summary(user_id, enabled, time='07:45:00'):
@@ -492,6 +828,7 @@ def ensure_default_ai_settings(default_settings):
     conn = get_connection()
     cursor = conn.cursor()
     ensure_ai_config_tables(cursor)
+    seeded_settings = False
 
     for capability, raw_config in (default_settings or {}).items():
         normalized_capability = normalize_ai_capability(capability)
@@ -516,7 +853,11 @@ def ensure_default_ai_settings(default_settings):
             ''',
             (normalized_capability, provider, model_name)
         )
+        if cursor.rowcount:
+            seeded_settings = True
 
+    if seeded_settings:
+        bump_ai_settings_version(cursor)
     conn.commit()
     conn.close()
     return get_all_ai_settings()
@@ -580,6 +921,7 @@ def save_ai_model(provider, capability, model_name):
         ''',
         (normalized_provider, normalized_capability, normalized_model_name)
     )
+    bump_ai_settings_version(cursor)
     conn.commit()
     conn.close()
 
@@ -679,6 +1021,7 @@ def activate_ai_model(capability, provider, model_name):
         ''',
         (normalized_capability, normalized_provider, normalized_model_name)
     )
+    bump_ai_settings_version(cursor)
     conn.commit()
     conn.close()
     return get_ai_setting(normalized_capability)
@@ -695,17 +1038,29 @@ def get_today_reminders(user_id):
     conn = get_connection()
     cursor = conn.cursor()
     # Buscamos recordatorios con status pending que caigan hoy
-    cursor.execute('''
-        SELECT id, message, remind_at FROM reminders 
-        WHERE user_id = ? AND status = "pending" 
-        AND remind_at >= ? AND remind_at <= ?
-        ORDER BY remind_at ASC
-    ''', (user_id, today_start, today_end))
+    cursor.execute(TODAY_REMINDERS_QUERY, (user_id, today_start, today_end))
     rows = cursor.fetchall()
     conn.close()
     return rows
 
 # --- FUNCIONES DE NOTAS ---
+_note_change_listeners = []
+
+
+def register_note_change_listener(listener):
+    """Registra un callback `listener(user_id, note_id, action)`; action es 'upsert' o 'delete'."""
+    if listener not in _note_change_listeners:
+        _note_change_listeners.append(listener)
+
+
+def _notify_note_change(user_id, note_id, action):
+    for listener in list(_note_change_listeners):
+        try:
+            listener(user_id, note_id, action)
+        except Exception:
+            logger.exception("Error notificando cambio de notas")
+
+
 def create_note(user_id, content, image_file_id=None, category=None):
     """Crea una nueva nota para el usuario, opcionalmente con imagen."""
     conn = get_connection()
@@ -715,17 +1070,31 @@ def create_note(user_id, content, image_file_id=None, category=None):
         'INSERT INTO notes (user_id, content, category, subcategory_id, image_file_id) VALUES (?, ?, ?, ?, ?)',
         (user_id, content, normalized_category, None, image_file_id)
     )
+    note_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    _notify_note_change(user_id, note_id, 'upsert')
+    return note_id
 
-def get_notes_by_user(user_id, category=None, subcategory_id=None):
-    """Retorna las notas de un usuario, opcionalmente filtradas por categoría o subcategoría."""
+def get_note_user_ids():
+    """Lista los usuarios que tienen al menos una nota."""
     conn = get_connection()
     cursor = conn.cursor()
-    normalized_category = normalize_note_category(category)
-    normalized_subcategory_id = normalize_note_subcategory_id(subcategory_id)
+    cursor.execute('SELECT DISTINCT user_id FROM notes')
+    rows = cursor.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
 
-    query = '''
+def get_notes_by_ids(user_id, note_ids):
+    """Retorna las notas indicadas del usuario, en el mismo orden que `note_ids`."""
+    note_ids = [int(note_id) for note_id in note_ids]
+    if not note_ids:
+        return []
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f'''
         SELECT
             n.id,
             n.content,
@@ -737,65 +1106,161 @@ def get_notes_by_user(user_id, category=None, subcategory_id=None):
             ns.name
         FROM notes n
         LEFT JOIN note_subcategories ns ON ns.id = n.subcategory_id
-        WHERE n.user_id = ?
-    '''
+        WHERE n.user_id = ? AND n.id IN ({', '.join('?' for _ in note_ids)})
+        ''',
+        (user_id, *note_ids)
+    )
+    rows_by_id = {row[0]: row for row in cursor.fetchall()}
+    conn.close()
+    return [rows_by_id[note_id] for note_id in note_ids if note_id in rows_by_id]
+
+# get_notes_by_user arma su consulta con estas piezas; tests/test_query_plans.py
+# verifica el plan de cada combinación.
+NOTES_BY_USER_QUERY = '''
+    SELECT
+        n.id,
+        n.content,
+        n.category,
+        n.created_at,
+        n.updated_at,
+        n.image_file_id,
+        n.subcategory_id,
+        ns.name
+    FROM notes n
+    LEFT JOIN note_subcategories ns ON ns.id = n.subcategory_id
+    WHERE n.user_id = ?
+'''
+NOTES_UNCATEGORIZED_FILTER = '''
+    AND (n.category IS NULL OR TRIM(n.category) = '' OR lower(n.category) = lower(?))
+'''
+NOTES_CATEGORY_FILTER = ' AND lower(n.category) = lower(?)'
+NOTES_SUBCATEGORY_FILTER = ' AND n.subcategory_id = ?'
+NOTES_BY_USER_ORDER = ' ORDER BY n.created_at DESC'
+
+
+def get_notes_by_user(user_id, category=None, subcategory_id=None, limit=None):
+    """Retorna las notas de un usuario, opcionalmente filtradas por categoría o subcategoría."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    normalized_category = normalize_note_category(category)
+    normalized_subcategory_id = normalize_note_subcategory_id(subcategory_id)
+
+    query = NOTES_BY_USER_QUERY
     params = [user_id]
 
     if category is not None:
         if normalized_category is None or normalized_category.lower() == UNCATEGORIZED_LABEL.lower():
-            query += '''
-                AND (n.category IS NULL OR TRIM(n.category) = '' OR lower(n.category) = lower(?))
-            '''
+            query += NOTES_UNCATEGORIZED_FILTER
             params.append(UNCATEGORIZED_LABEL)
         else:
-            query += ' AND lower(n.category) = lower(?)'
+            query += NOTES_CATEGORY_FILTER
             params.append(normalized_category)
 
     if normalized_subcategory_id is not None:
-        query += ' AND n.subcategory_id = ?'
+        query += NOTES_SUBCATEGORY_FILTER
         params.append(normalized_subcategory_id)
 
-    query += ' ORDER BY n.created_at DESC'
+    query += NOTES_BY_USER_ORDER
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(int(limit))
     cursor.execute(query, params)
     rows = cursor.fetchall()
     conn.close()
     return rows
 
+def search_notes(user_id, query, limit=10):
+    """Busca las notas del usuario más relevantes para la consulta, ordenadas por bm25.
+
+    Retorna filas con la misma forma que get_notes_by_user().
+    """
+    match_query = build_notes_fts_query(query)
+    if not match_query:
+        return []
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    if _notes_fts_available is None:
+        ensure_notes_fts(cursor)
+        conn.commit()
+
+    select_columns = '''
+        SELECT
+            n.id,
+            n.content,
+            n.category,
+            n.created_at,
+            n.updated_at,
+            n.image_file_id,
+            n.subcategory_id,
+            ns.name
+    '''
+
+    if _notes_fts_available:
+        cursor.execute(
+            select_columns + '''
+            FROM notes_fts
+            JOIN notes n ON n.id = notes_fts.rowid
+            LEFT JOIN note_subcategories ns ON ns.id = n.subcategory_id
+            WHERE notes_fts MATCH ? AND n.user_id = ?
+            ORDER BY bm25(notes_fts, 1.0, 0.5), n.created_at DESC
+            LIMIT ?
+            ''',
+            (match_query, user_id, int(limit))
+        )
+    else:
+        terms = re.findall(r'"([^"]+)"', match_query)
+        conditions = ' OR '.join('lower(n.content) LIKE ?' for _ in terms)
+        cursor.execute(
+            select_columns + f'''
+            FROM notes n
+            LEFT JOIN note_subcategories ns ON ns.id = n.subcategory_id
+            WHERE n.user_id = ? AND ({conditions})
+            ORDER BY n.created_at DESC
+            LIMIT ?
+            ''',
+            (user_id, *(f'%{term}%' for term in terms), int(limit))
+        )
+
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+# Sin ORDER BY: get_note_categories_by_user ordena el resultado combinado en Python.
+NOTE_CATEGORY_COUNTS_QUERY = '''
+    SELECT
+        MIN(COALESCE(NULLIF(TRIM(category), ''), ?)) AS category,
+        COUNT(*) AS note_count,
+        MAX(updated_at) AS last_updated_at
+    FROM notes
+    WHERE user_id = ?
+    GROUP BY lower(COALESCE(NULLIF(TRIM(category), ''), ?))
+'''
+NOTE_SUBCATEGORY_COUNTS_QUERY = '''
+    SELECT
+        ns.id,
+        ns.category_name,
+        ns.name,
+        COUNT(n.id) AS note_count,
+        MAX(COALESCE(n.updated_at, ns.updated_at)) AS last_updated_at
+    FROM note_subcategories ns
+    LEFT JOIN notes n ON n.subcategory_id = ns.id
+    WHERE ns.user_id = ?
+    GROUP BY ns.id, ns.category_name, ns.name, ns.updated_at
+'''
+
+
 def get_note_categories_by_user(user_id):
     """Retorna las categorías del usuario con subcategorías y contadores."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(
-        '''
-        SELECT
-            MIN(COALESCE(NULLIF(TRIM(category), ''), ?)) AS category,
-            COUNT(*) AS note_count,
-            MAX(updated_at) AS last_updated_at
-        FROM notes
-        WHERE user_id = ?
-        GROUP BY lower(COALESCE(NULLIF(TRIM(category), ''), ?))
-        ORDER BY lower(MIN(COALESCE(NULLIF(TRIM(category), ''), ?))) ASC
-        ''',
-        (UNCATEGORIZED_LABEL, user_id, UNCATEGORIZED_LABEL, UNCATEGORIZED_LABEL)
+        NOTE_CATEGORY_COUNTS_QUERY,
+        (UNCATEGORIZED_LABEL, user_id, UNCATEGORIZED_LABEL)
     )
     category_rows = cursor.fetchall()
 
-    cursor.execute(
-        '''
-        SELECT
-            ns.id,
-            ns.category_name,
-            ns.name,
-            COUNT(n.id) AS note_count,
-            MAX(COALESCE(n.updated_at, ns.updated_at)) AS last_updated_at
-        FROM note_subcategories ns
-        LEFT JOIN notes n ON n.subcategory_id = ns.id
-        WHERE ns.user_id = ?
-        GROUP BY ns.id, ns.category_name, ns.name, ns.updated_at
-        ORDER BY lower(ns.category_name) ASC, lower(ns.name) ASC
-        ''',
-        (user_id,)
-    )
+    cursor.execute(NOTE_SUBCATEGORY_COUNTS_QUERY, (user_id,))
     subcategory_rows = cursor.fetchall()
     conn.close()
 
@@ -961,16 +1426,22 @@ def update_note(note_id, new_content, category=None, subcategory_id=None):
     success = cursor.rowcount > 0
     conn.commit()
     conn.close()
+    if success:
+        _notify_note_change(user_id, note_id, 'upsert')
     return success
 
 def delete_note(note_id):
     """Elimina una nota por su ID."""
     conn = get_connection()
     cursor = conn.cursor()
+    cursor.execute('SELECT user_id FROM notes WHERE id = ?', (note_id,))
+    note_row = cursor.fetchone()
     cursor.execute('DELETE FROM notes WHERE id = ?', (note_id,))
     success = cursor.rowcount > 0
     conn.commit()
     conn.close()
+    if success and note_row:
+        _notify_note_change(note_row[0], note_id, 'delete')
     return success
 
 
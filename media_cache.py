@@ -0,0 +1,257 @@
+"""media_cache.py
+Caché persistente de videos de X.com y YouTube.
+
+Cada entrada se indexa por plataforma + ID del video + tipo (metadatos,
+idiomas de subtítulos, transcripción o resumen) + una variante (idioma, o
+instrucción del usuario, modelo y digest del historial reciente). Así,
+cuando varios usuarios comparten el mismo video, las descargas con yt-dlp,
+la transcripción con Groq y las consultas a RapidAPI se hacen una sola vez.
+Las entradas caducan por TTL y, si el tamaño total supera
+MEDIA_CACHE_MAX_BYTES, se expulsan las menos usadas.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", os.path.join(BASE_DIR, "media_cache.db"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+MEDIA_CACHE_BUSY_TIMEOUT_MS = int(os.getenv("MEDIA_CACHE_BUSY_TIMEOUT_MS", "5000"))
+# Las transcripciones no cambian; la lista de subtítulos y los resúmenes sí pueden quedar viejos.
+MEDIA_TRANSCRIPT_TTL_SECONDS = int(os.getenv("MEDIA_TRANSCRIPT_TTL_SECONDS", str(30 * 24 * 3600)))
+MEDIA_SUMMARY_TTL_SECONDS = int(os.getenv("MEDIA_SUMMARY_TTL_SECONDS", str(7 * 24 * 3600)))
+MEDIA_LANGUAGES_TTL_SECONDS = int(os.getenv("MEDIA_LANGUAGES_TTL_SECONDS", str(24 * 3600)))
+# Se incrementa cuando cambian los prompts de resumen y los resultados viejos dejan de servir.
+MEDIA_CACHE_VERSION = "2"
+
+MEDIA_KIND_METADATA = "metadata"
+MEDIA_KIND_LANGUAGES = "languages"
+MEDIA_KIND_TRANSCRIPT = "transcript"
+MEDIA_KIND_SUMMARY = "summary"
+MEDIA_CACHE_KINDS = (MEDIA_KIND_METADATA, MEDIA_KIND_LANGUAGES, MEDIA_KIND_TRANSCRIPT, MEDIA_KIND_SUMMARY)
+
+_MEDIA_KIND_TTLS = {
+    MEDIA_KIND_METADATA: MEDIA_TRANSCRIPT_TTL_SECONDS,
+    MEDIA_KIND_LANGUAGES: MEDIA_LANGUAGES_TTL_SECONDS,
+    MEDIA_KIND_TRANSCRIPT: MEDIA_TRANSCRIPT_TTL_SECONDS,
+    MEDIA_KIND_SUMMARY: MEDIA_SUMMARY_TTL_SECONDS,
+}
+
+_schema_lock = threading.Lock()
+_schema_ready_for = None
+
+
+def _connect():
+    global _schema_ready_for
+    conn = sqlite3.connect(MEDIA_CACHE_PATH, timeout=MEDIA_CACHE_BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    schema_key = (os.getpid(), MEDIA_CACHE_PATH)
+    if _schema_ready_for != schema_key:
+        with _schema_lock:
+            if _schema_ready_for != schema_key:
+                _create_schema(conn)
+                _schema_ready_for = schema_key
+    return conn
+
+
+def _create_schema(conn):
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS media_entries (
+            cache_key TEXT PRIMARY KEY,
+            platform TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value_json TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_accessed_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS media_cache_stats (
+            kind TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_media_entries_lru ON media_entries(last_accessed_at);
+        CREATE INDEX IF NOT EXISTS idx_media_entries_expiry ON media_entries(expires_at);
+        """
+    )
+    conn.commit()
+
+
+def normalize_instruction(instruction):
+    """Normaliza la instrucción del usuario para que variaciones triviales compartan resumen."""
+    text = re.sub(r"\s+", " ", str(instruction or "").strip().lower())
+    return text.strip(" .,;:!?¿¡")
+
+
+def build_summary_variant(instruction, model_key, video_source, history_digest=""):
+    """Variante de un resumen: instrucción normalizada + modelo + versión del prompt + historial.
+
+    El resumen final incluye los mensajes recientes del usuario; `history_digest`
+    impide servirlo a quien tiene otra conversación.
+    """
+    return (
+        f"v{MEDIA_CACHE_VERSION}|{model_key}|{video_source}|{history_digest}"
+        f"|{normalize_instruction(instruction)}"
+    )
+
+
+def _build_cache_key(platform, video_id, kind, variant):
+    hasher = hashlib.sha256()
+    for part in (platform, str(video_id), kind, variant or ""):
+        hasher.update(str(part).encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def _count_lookup(conn, kind, hit):
+    column = "hits" if hit else "misses"
+    conn.execute(
+        f"INSERT INTO media_cache_stats (kind, {column}) VALUES (?, 1) "
+        f"ON CONFLICT(kind) DO UPDATE SET {column} = {column} + 1",
+        (kind,),
+    )
+
+
+def get_media_entry(platform, video_id, kind, variant=""):
+    """Retorna el valor guardado (ya deserializado) o None si no existe o caducó."""
+    if not video_id:
+        return None
+    try:
+        conn = _connect()
+    except sqlite3.Error as exc:
+        logger.warning("Caché de videos no disponible: %s", exc)
+        return None
+
+    cache_key = _build_cache_key(platform, video_id, kind, variant)
+    now = time.time()
+    try:
+        row = conn.execute(
+            "SELECT value_json FROM media_entries WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, now),
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE media_entries SET last_accessed_at = ? WHERE cache_key = ?",
+                (now, cache_key),
+            )
+        _count_lookup(conn, kind, bool(row))
+        conn.commit()
+    except sqlite3.Error as exc:
+        logger.warning("Error leyendo la caché de videos (%s): %s", kind, exc)
+        return None
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    try:
+        return json.loads(row[0])
+    except ValueError:
+        return None
+
+
+def store_media_entry(platform, video_id, kind, value, variant="", ttl_seconds=None):
+    if not video_id or value is None:
+        return
+    value_json = json.dumps(value, ensure_ascii=False)
+    ttl_seconds = _MEDIA_KIND_TTLS.get(kind, MEDIA_SUMMARY_TTL_SECONDS) if ttl_seconds is None else ttl_seconds
+    now = time.time()
+
+    try:
+        conn = _connect()
+    except sqlite3.Error as exc:
+        logger.warning("Caché de videos no disponible: %s", exc)
+        return
+
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO media_entries "
+            "(cache_key, platform, video_id, kind, value_json, size_bytes, created_at, expires_at, last_accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                _build_cache_key(platform, video_id, kind, variant),
+                platform,
+                str(video_id),
+                kind,
+                value_json,
+                len(value_json.encode("utf-8")),
+                now,
+                now + ttl_seconds,
+                now,
+            ),
+        )
+        _evict_if_needed(conn)
+        conn.commit()
+    except sqlite3.Error as exc:
+        logger.warning("Error guardando en la caché de videos: %s", exc)
+    finally:
+        conn.close()
+
+
+def _evict_if_needed(conn, max_bytes=None):
+    """Borra lo caducado y, si aún sobra, lo menos usado hasta el 90% del límite."""
+    max_bytes = MEDIA_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    expired = conn.execute("DELETE FROM media_entries WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM media_entries").fetchone()[0]
+    evicted = 0
+    if total > max_bytes:
+        target = int(max_bytes * 0.9)
+        rows = conn.execute(
+            "SELECT cache_key, size_bytes FROM media_entries ORDER BY last_accessed_at"
+        ).fetchall()
+        for cache_key, size_bytes in rows:
+            if total <= target:
+                break
+            conn.execute("DELETE FROM media_entries WHERE cache_key = ?", (cache_key,))
+            total -= size_bytes
+            evicted += 1
+
+    if expired or evicted:
+        logger.info("Caché de videos: %s entradas caducadas y %s expulsadas (LRU)", expired, evicted)
+    return expired + evicted
+
+
+def get_media_cache_stats():
+    """Aciertos, fallos y tamaño de la caché, por tipo de entrada."""
+    stats = {
+        kind: {"hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0}
+        for kind in MEDIA_CACHE_KINDS
+    }
+    try:
+        conn = _connect()
+    except sqlite3.Error:
+        return {"size_bytes": 0, **stats}
+
+    try:
+        for kind, hits, misses in conn.execute("SELECT kind, hits, misses FROM media_cache_stats"):
+            if kind in stats:
+                lookups = hits + misses
+                stats[kind].update(
+                    hits=hits,
+                    misses=misses,
+                    hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+                )
+        for kind, entries in conn.execute(
+            "SELECT kind, COUNT(*) FROM media_entries WHERE expires_at > ? GROUP BY kind",
+            (time.time(),),
+        ):
+            if kind in stats:
+                stats[kind]["entries"] = entries
+        size_bytes = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM media_entries").fetchone()[0]
+        return {"size_bytes": size_bytes, **stats}
+    finally:
+        conn.close()
@@ -0,0 +1,184 @@
+"""media_executor.py
+Ejecución de trabajos de medios (yt-dlp, FFmpeg, transcripción) fuera del event loop.
+
+Cada trabajo corre en su propio proceso, creado desde el forkserver que ya
+importó video_handler y transcription_service, de modo que ni la descarga ni
+la extracción de audio bloquean el procesamiento de updates de Telegram. Un
+semáforo limita los procesos simultáneos (MEDIA_MAX_WORKERS) y el resto espera
+en orden de llegada. Cada trabajo tiene timeout; si vence, o si se cancela la
+corrutina que lo espera (p. ej. con el botón "Cancelar"), el proceso se termina. El avance que reporta la
+función (`on_progress(texto)` en el hijo) llega a la corrutina del padre por un
+Pipe leído con loop.add_reader; entre ediciones solo se conserva el último.
+"""
+
+import asyncio
+import logging
+import os
+
+from repo_worker_pool import build_forkserver_context, reap_process
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MAX_WORKERS = max(1, int(os.getenv("MEDIA_MAX_WORKERS", str(min(4, os.cpu_count() or 2)))))
+MEDIA_JOB_TIMEOUT_SECONDS = int(os.getenv("MEDIA_JOB_TIMEOUT_SECONDS", "900"))
+
+
+class MediaJobError(Exception):
+    """El trabajo no terminó: venció su timeout o el proceso murió. El mensaje es apto para el usuario."""
+
+
+def _media_job_main(connection, function, args, kwargs, report_progress):
+    """Proceso hijo: ejecuta la función y envía ("progress", texto) y ("result", valor)."""
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    def on_progress(text):
+        try:
+            connection.send(("progress", text))
+        except (OSError, ValueError):
+            pass
+
+    if report_progress:
+        kwargs = {**kwargs, "on_progress": on_progress}
+    try:
+        result = function(*args, **kwargs)
+        connection.send(("result", result))
+    except Exception as exc:
+        logger.error("Error en el trabajo de medios %s: %s", getattr(function, "__name__", function), exc,
+                     exc_info=True)
+        connection.send(("error", str(exc)[:300]))
+    finally:
+        connection.close()
+
+
+class MediaExecutor:
+    """Cola acotada de trabajos de medios, cada uno en un proceso propio."""
+
+    def __init__(self, max_workers=MEDIA_MAX_WORKERS, timeout=MEDIA_JOB_TIMEOUT_SECONDS, context=None):
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self._context = context
+        self._slots = None
+        self._waiting = 0
+        self._processes = set()
+
+    def _get_slots(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        return self._slots
+
+    async def run(self, function, *args, on_progress=None, timeout=None, **kwargs):
+        """Ejecuta `function(*args, **kwargs)` en un proceso y retorna su resultado.
+
+        Si se pasa `on_progress` (corrutina), la función recibe un `on_progress`
+        síncrono cuyos textos llegan aquí. Lanza MediaJobError por timeout o si
+        el proceso muere.
+        """
+        slots = self._get_slots()
+        if slots.locked() and on_progress:
+            await on_progress(f"⏳ Trabajo en cola (posición {self._waiting + 1})...")
+
+        self._waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            return await self._run_in_process(function, args, kwargs, on_progress, timeout or self.timeout)
+        finally:
+            slots.release()
+
+    async def _run_in_process(self, function, args, kwargs, on_progress, timeout):
+        loop = asyncio.get_running_loop()
+        if self._context is None:
+            self._context = build_forkserver_context()
+
+        parent_connection, child_connection = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_media_job_main,
+            args=(child_connection, function, args, kwargs, on_progress is not None),
+            name="media-job",
+            daemon=True,
+        )
+        try:
+            process.start()
+        finally:
+            child_connection.close()
+        self._processes.add(process)
+
+        outcome = loop.create_future()
+        progress = asyncio.Queue()
+
+        def on_readable():
+            try:
+                while parent_connection.poll():
+                    kind, payload = parent_connection.recv()
+                    if kind == "progress":
+                        progress.put_nowait(payload)
+                    elif not outcome.done():
+                        outcome.set_result((kind, payload))
+            except (EOFError, OSError):
+                if not outcome.done():
+                    outcome.set_exception(MediaJobError("El procesamiento del archivo terminó de forma inesperada."))
+                loop.remove_reader(parent_connection.fileno())
+
+        async def relay_progress():
+            while True:
+                text = await progress.get()
+                # Se salta lo acumulado: solo importa el estado más reciente.
+                while not progress.empty():
+                    text = progress.get_nowait()
+                await on_progress(text)
+
+        loop.add_reader(parent_connection.fileno(), on_readable)
+        relay_task = loop.create_task(relay_progress()) if on_progress else None
+        function_name = getattr(function, "__name__", str(function))
+        try:
+            kind, payload = await asyncio.wait_for(outcome, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Trabajo de medios %s superó %ss; se termina el proceso %s",
+                           function_name, timeout, process.pid)
+            raise MediaJobError("El procesamiento tardó demasiado. Intenta con un audio o video más corto.")
+        finally:
+            try:
+                loop.remove_reader(parent_connection.fileno())
+            except (OSError, ValueError):
+                pass
+            parent_connection.close()
+            if relay_task is not None:
+                relay_task.cancel()
+            self._processes.discard(process)
+            # Si venció el timeout o se canceló la espera, el proceso sigue vivo: se termina.
+            await reap_process(process, terminate=True)
+
+        if kind == "error":
+            raise MediaJobError(f"Error inesperado procesando el archivo: {payload}")
+        return payload
+
+    async def shutdown(self):
+        """Termina los trabajos en curso y espera a recogerlos (sin dejar zombis)."""
+        processes = list(self._processes)
+        self._processes.clear()
+        await asyncio.gather(
+            *(reap_process(process, terminate=True) for process in processes),
+            return_exceptions=True,
+        )
+
+    def get_stats(self):
+        return {
+            "running": len(self._processes),
+            "queued": self._waiting,
+            "max_workers": self.max_workers,
+        }
+
+
+_media_executor = None
+
+
+def get_media_executor():
+    global _media_executor
+    if _media_executor is None:
+        _media_executor = MediaExecutor()
+    return _media_executor
@@ -8,17 +8,41 @@ Actualmente asegura:
 - note_subcategories
 - ai_global_settings
 - ai_model_catalog
+- índices de recordatorios y notas
+- reminders.remind_at con espacio en lugar de 'T' (una vez, según PRAGMA user_version)
 """
 
 import sqlite3
 import os
 import sys
 
-from database import ensure_ai_config_tables, ensure_note_subcategories_table, ensure_notes_subcategory_column
+from database import (ensure_ai_config_tables, ensure_note_subcategories_table,
+                      ensure_notes_subcategory_column, ensure_query_indexes)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'reminders.db')
 
+# PRAGMA user_version tras cada migración de datos de una sola vez.
+SCHEMA_VERSION_REMIND_AT_NORMALIZED = 1
+
+
+def get_schema_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+def normalize_reminder_datetimes(cursor):
+    """Reescribe remind_at con 'T' al formato con espacio. Retorna las filas cambiadas o None si ya estaba hecho."""
+    if get_schema_version(cursor) >= SCHEMA_VERSION_REMIND_AT_NORMALIZED:
+        return None
+    cursor.execute(
+        "UPDATE reminders SET remind_at = replace(remind_at, 'T', ' ') WHERE instr(remind_at, 'T') > 0"
+    )
+    updated = cursor.rowcount
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION_REMIND_AT_NORMALIZED}")
+    return updated
+
+
 def migrate_db():
     """Agrega columnas faltantes a tablas existentes si aún no existen."""
     
@@ -44,6 +68,13 @@ def migrate_db():
             migrated_any = True
         else:
             print("✓ La columna image_file_id ya existe en la tabla reminders.")
+
+        normalized_reminders = normalize_reminder_datetimes(cursor)
+        if normalized_reminders is None:
+            print("✓ Las fechas de recordatorios ya están normalizadas.")
+        else:
+            print(f"Normalizando fechas de recordatorios: {normalized_reminders} actualizadas.")
+            migrated_any = True
         
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='notes'")
         notes_table_exists = cursor.fetchone() is not None
@@ -96,6 +127,18 @@ def migrate_db():
         else:
             print("Creando tabla ai_model_catalog...")
             migrated_any = True
+
+        if notes_table_exists:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'")
+            existing_indexes = {row[0] for row in cursor.fetchall()}
+            ensure_query_indexes(cursor)
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'")
+            created_indexes = sorted({row[0] for row in cursor.fetchall()} - existing_indexes)
+            if created_indexes:
+                print(f"Creando índices: {', '.join(created_indexes)}...")
+                migrated_any = True
+            else:
+                print("✓ Los índices de recordatorios y notas ya existen.")
         
         conn.commit()
         conn.close()
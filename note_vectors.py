@@ -0,0 +1,275 @@
+"""note_vectors.py
+Índice vectorial local de notas para recuperación semántica.
+
+Cada usuario tiene una matriz float32 (una fila normalizada por nota) guardada
+como .npy y leída con mmap, más un archivo pequeño con IDs y checksums. Los
+embeddings se calculan en CPU con un modelo sentence-transformers si está
+instalado, o con un vectorizador por hashing de n-gramas como respaldo.
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
+import unicodedata
+import zlib
+
+import numpy as np
+
+from database import (get_note_user_ids, get_notes_by_user,
+                      register_note_change_listener)
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # pragma: no cover - depende del entorno de despliegue
+    SentenceTransformer = None
+
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+NOTE_VECTORS_DIR = os.getenv("NOTE_VECTORS_DIR", os.path.join(BASE_DIR, "note_vectors"))
+NOTE_EMBEDDING_MODEL = os.getenv("NOTE_EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+NOTE_HASHING_DIMENSIONS = int(os.getenv("NOTE_HASHING_DIMENSIONS", "512"))
+NOTE_VECTOR_MIN_SCORE = float(os.getenv("NOTE_VECTOR_MIN_SCORE", "0.12"))
+
+
+def _normalize_text(text):
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def build_note_text(content, category=None):
+    if category:
+        return f"{category}: {content}"
+    return str(content or "")
+
+
+def note_checksum(text):
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class HashingEmbedder:
+    """Vectorizador por hashing de palabras y n-gramas de caracteres (sin dependencias)."""
+
+    def __init__(self, dimensions=NOTE_HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.signature = f"hash{dimensions}"
+
+    def _features(self, text):
+        words = re.findall(r"\w+", _normalize_text(text))
+        for word in words:
+            yield word, 1.0
+            padded = f"<{word}>"
+            for size in (3, 4):
+                for start in range(max(1, len(padded) - size + 1)):
+                    yield padded[start:start + size], 0.5
+
+    def encode(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if hashed & 0x80000000 else -1.0
+                matrix[row, hashed % self.dimensions] += sign * weight
+        return _l2_normalize(matrix)
+
+
+class SentenceTransformerEmbedder:
+    """Embeddings densos con un modelo local de sentence-transformers (CPU)."""
+
+    def __init__(self, model_name):
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.signature = re.sub(r"[^A-Za-z0-9]+", "-", model_name).strip("-").lower()
+
+    def encode(self, texts):
+        vectors = self.model.encode(list(texts), convert_to_numpy=True, show_progress_bar=False)
+        return _l2_normalize(np.asarray(vectors, dtype=np.float32))
+
+
+def _l2_normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def build_embedder():
+    if SentenceTransformer is not None and NOTE_EMBEDDING_MODEL:
+        try:
+            embedder = SentenceTransformerEmbedder(NOTE_EMBEDDING_MODEL)
+            logger.info("Embeddings de notas con el modelo local %s", NOTE_EMBEDDING_MODEL)
+            return embedder
+        except Exception as exc:
+            logger.warning("No se pudo cargar %s; se usará hashing: %s", NOTE_EMBEDDING_MODEL, exc)
+
+    logger.info("Embeddings de notas con vectorizador por hashing (%s dims)", NOTE_HASHING_DIMENSIONS)
+    return HashingEmbedder()
+
+
+class NoteVectorIndex:
+    """Índice por usuario con actualización incremental en un hilo de fondo."""
+
+    def __init__(self, directory=NOTE_VECTORS_DIR, embedder=None):
+        self.directory = directory
+        self._embedder = embedder
+        self._lock = threading.RLock()
+        self._tasks = queue.Queue()
+        self._worker = None
+
+    @property
+    def embedder(self):
+        with self._lock:
+            if self._embedder is None:
+                self._embedder = build_embedder()
+            return self._embedder
+
+    def _paths(self, user_id):
+        prefix = os.path.join(self.directory, f"{int(user_id)}.{self.embedder.signature}")
+        return f"{prefix}.vectors.npy", f"{prefix}.meta.npz"
+
+    # --- Ciclo de vida ------------------------------------------------------
+
+    def start(self):
+        """Se suscribe a cambios de notas y arranca el hilo que calcula embeddings."""
+        with self._lock:
+            if self._worker is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            register_note_change_listener(self.on_note_changed)
+            self._worker = threading.Thread(target=self._run_worker, name="note-vectors", daemon=True)
+            self._worker.start()
+
+    def on_note_changed(self, user_id, note_id, action):
+        self._tasks.put(("sync_user", user_id))
+
+    def schedule_backfill(self):
+        self._tasks.put(("backfill", None))
+
+    def _run_worker(self):
+        while True:
+            task, user_id = self._tasks.get()
+            try:
+                if task == "backfill":
+                    for pending_user_id in get_note_user_ids():
+                        self.sync_user(pending_user_id)
+                else:
+                    self.sync_user(user_id)
+            except Exception:
+                logger.exception("Error actualizando el índice vectorial de notas")
+
+    # --- Persistencia -------------------------------------------------------
+
+    def _load(self, user_id, mmap=True):
+        vectors_path, meta_path = self._paths(user_id)
+        if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+            return None, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        with np.load(meta_path) as meta:
+            note_ids = meta["ids"]
+            checksums = meta["checksums"]
+        vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        return vectors, note_ids, checksums
+
+    def _save(self, user_id, vectors, note_ids, checksums):
+        vectors_path, meta_path = self._paths(user_id)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_vectors = f"{vectors_path}.tmp.npy"
+        tmp_meta = f"{meta_path}.tmp.npz"
+        np.save(tmp_vectors, np.ascontiguousarray(vectors, dtype=np.float32))
+        np.savez(tmp_meta, ids=np.asarray(note_ids, dtype=np.int64),
+                 checksums=np.asarray(checksums, dtype=np.int64))
+        # Reemplazo atómico: los lectores con mmap abierto siguen viendo la versión anterior.
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_meta, meta_path)
+
+    # --- Sincronización -----------------------------------------------------
+
+    def sync_user(self, user_id):
+        """Reconcilia el índice del usuario con la tabla notes; solo embebe lo nuevo o cambiado."""
+        notes = get_notes_by_user(user_id)
+        current = {}
+        for note in notes:
+            text = build_note_text(note[1], note[2])
+            current[note[0]] = (text, note_checksum(text))
+
+        with self._lock:
+            vectors, note_ids, checksums = self._load(user_id, mmap=False)
+            indexed = {
+                int(note_id): (row, int(checksum))
+                for row, (note_id, checksum) in enumerate(zip(note_ids, checksums))
+            }
+
+            keep_rows = []
+            keep_ids = []
+            keep_checksums = []
+            pending_ids = []
+            for note_id, (text, checksum) in current.items():
+                previous = indexed.get(note_id)
+                if previous and previous[1] == checksum:
+                    keep_rows.append(previous[0])
+                    keep_ids.append(note_id)
+                    keep_checksums.append(checksum)
+                else:
+                    pending_ids.append(note_id)
+
+            if not pending_ids and len(keep_ids) == len(indexed):
+                return 0
+
+            parts = []
+            if keep_rows:
+                parts.append(np.asarray(vectors[keep_rows], dtype=np.float32))
+            if pending_ids:
+                parts.append(self.embedder.encode([current[note_id][0] for note_id in pending_ids]))
+                keep_ids.extend(pending_ids)
+                keep_checksums.extend(current[note_id][1] for note_id in pending_ids)
+
+            if parts:
+                matrix = np.vstack(parts)
+            else:
+                matrix = np.empty((0, 0), dtype=np.float32)
+            self._save(user_id, matrix, keep_ids, keep_checksums)
+
+        logger.info(
+            "Índice vectorial del usuario %s: %s embebidas, %s notas indexadas",
+            user_id,
+            len(pending_ids),
+            len(keep_ids),
+        )
+        return len(pending_ids)
+
+    # --- Búsqueda -----------------------------------------------------------
+
+    def search(self, user_id, query, limit=10, min_score=NOTE_VECTOR_MIN_SCORE):
+        """Retorna [(note_id, score)] por similitud coseno, de mayor a menor."""
+        if not str(query or "").strip():
+            return []
+
+        with self._lock:
+            vectors, note_ids, _checksums = self._load(user_id)
+        if vectors is None or not len(note_ids) or vectors.shape[1] == 0:
+            return []
+
+        query_vector = self.embedder.encode([query])[0]
+        scores = vectors @ query_vector
+        limit = max(1, min(int(limit), len(scores)))
+        top_rows = np.argpartition(-scores, limit - 1)[:limit]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        return [
+            (int(note_ids[row]), float(scores[row]))
+            for row in top_rows
+            if scores[row] >= min_score
+        ]
+
+
+_note_vector_index = None
+_note_vector_index_lock = threading.Lock()
+
+
+def get_note_vector_index():
+    global _note_vector_index
+    if _note_vector_index is None:
+        with _note_vector_index_lock:
+            if _note_vector_index is None:
+                _note_vector_index = NoteVectorIndex()
+    return _note_vector_index
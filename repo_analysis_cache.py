@@ -0,0 +1,296 @@
+"""repo_analysis_cache.py
+Caché persistente de análisis de repositorios GitHub.
+
+Los análisis finales se indexan por URL normalizada + SHA del commit + modelo
+de análisis + parámetros de troceo + digest del historial reciente; los
+análisis parciales (que no usan historial), por los digests de los archivos
+que forman cada parte, para reutilizarlos entre commits y usuarios. Todo
+vive en un SQLite aparte de reminders.db, con expulsión LRU cuando el tamaño
+total supera REPO_ANALYSIS_CACHE_MAX_BYTES.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from repo_handler import (DEFAULT_MAX_FILE_SIZE, DEFAULT_REPO_ANALYSIS_TOKEN_BUDGET,
+                          DEFAULT_REPO_CHUNK_ANCHOR_FILES,
+                          DEFAULT_REPO_CHUNK_MAX_FILES, DEFAULT_REPO_CHUNK_MAX_TOKENS,
+                          DEFAULT_REPO_CHUNK_MIN_FILL, normalize_github_repo_url, tiktoken)
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ANALYSIS_CACHE_PATH = os.getenv(
+    "REPO_ANALYSIS_CACHE_PATH",
+    os.path.join(BASE_DIR, "repo_analysis_cache.db"),
+)
+REPO_ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("REPO_ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+REPO_ANALYSIS_CACHE_BUSY_TIMEOUT_MS = int(os.getenv("REPO_ANALYSIS_CACHE_BUSY_TIMEOUT_MS", "5000"))
+# Se incrementa cuando cambian los prompts de análisis y los resultados viejos dejan de servir.
+REPO_ANALYSIS_CACHE_VERSION = "4"
+
+_schema_lock = threading.Lock()
+_schema_ready_for = None
+
+
+def _connect():
+    global _schema_ready_for
+    conn = sqlite3.connect(
+        REPO_ANALYSIS_CACHE_PATH,
+        timeout=REPO_ANALYSIS_CACHE_BUSY_TIMEOUT_MS / 1000,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    schema_key = (os.getpid(), REPO_ANALYSIS_CACHE_PATH)
+    if _schema_ready_for != schema_key:
+        with _schema_lock:
+            if _schema_ready_for != schema_key:
+                _create_schema(conn)
+                _schema_ready_for = schema_key
+    return conn
+
+
+def _create_schema(conn):
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS repo_analyses (
+            cache_key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            commit_sha TEXT NOT NULL,
+            result_json TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_accessed_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS repo_chunk_analyses (
+            cache_key TEXT PRIMARY KEY,
+            analysis TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_accessed_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS repo_cache_stats (
+            kind TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_repo_analyses_lru ON repo_analyses(last_accessed_at);
+        CREATE INDEX IF NOT EXISTS idx_repo_chunk_analyses_lru ON repo_chunk_analyses(last_accessed_at);
+        """
+    )
+    conn.commit()
+
+
+def _digest(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(str(part).encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def _chunking_signature():
+    return (
+        f"v{REPO_ANALYSIS_CACHE_VERSION}"
+        f"|tokens={DEFAULT_REPO_CHUNK_MAX_TOKENS}"
+        f"|fill={DEFAULT_REPO_CHUNK_MIN_FILL}"
+        f"|tokenizer={'tiktoken' if tiktoken is not None else 'approx'}"
+        f"|files={DEFAULT_REPO_CHUNK_MAX_FILES}"
+        f"|anchor={DEFAULT_REPO_CHUNK_ANCHOR_FILES}"
+        f"|maxfile={DEFAULT_MAX_FILE_SIZE}"
+        f"|budget={DEFAULT_REPO_ANALYSIS_TOKEN_BUDGET}"
+    )
+
+
+def build_analysis_cache_key(repo_url, commit_sha, model_key, history_digest=""):
+    """Llave del análisis final: repo + commit + modelo + parámetros de troceo + historial.
+
+    La síntesis final incluye el historial reciente del usuario; `history_digest`
+    evita servirle a otro usuario una respuesta basada en una conversación ajena.
+    """
+    normalized_url = normalize_github_repo_url(repo_url) or repo_url
+    return _digest(
+        "analysis", normalized_url.lower(), commit_sha, model_key, _chunking_signature(), history_digest
+    )
+
+
+def build_chunk_cache_key(repo_slug, chunk_files, model_key):
+    """Llave de un análisis parcial: las rutas y digests de los archivos de la parte.
+
+    No incluye la posición de la parte: si otro archivo cambia, esta parte
+    conserva su llave aunque el total de partes varíe.
+    """
+    return _digest(
+        "chunk",
+        (repo_slug or "").lower(),
+        model_key,
+        _chunking_signature(),
+        *(f"{path}:{digest}" for path, digest in chunk_files),
+    )
+
+
+def build_condensed_cache_key(repo_slug, partial_analyses, model_key):
+    """Llave de una consolidación intermedia: los análisis parciales que resume."""
+    return _digest(
+        "condensed",
+        (repo_slug or "").lower(),
+        model_key,
+        _chunking_signature(),
+        *(hashlib.sha256(analysis.encode("utf-8")).hexdigest() for analysis in partial_analyses),
+    )
+
+
+def _count_lookup(conn, kind, hit):
+    column = "hits" if hit else "misses"
+    conn.execute(
+        f"INSERT INTO repo_cache_stats (kind, {column}) VALUES (?, 1) "
+        f"ON CONFLICT(kind) DO UPDATE SET {column} = {column} + 1",
+        (kind,),
+    )
+
+
+def _lookup(table, value_column, kind, cache_key):
+    try:
+        conn = _connect()
+    except sqlite3.Error as exc:
+        logger.warning("Caché de repositorios no disponible: %s", exc)
+        return None
+
+    try:
+        row = conn.execute(
+            f"SELECT {value_column} FROM {table} WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchone()
+        if row:
+            conn.execute(
+                f"UPDATE {table} SET last_accessed_at = ? WHERE cache_key = ?",
+                (time.time(), cache_key),
+            )
+        _count_lookup(conn, kind, bool(row))
+        conn.commit()
+        return row[0] if row else None
+    except sqlite3.Error as exc:
+        logger.warning("Error leyendo la caché de repositorios (%s): %s", kind, exc)
+        return None
+    finally:
+        conn.close()
+
+
+def get_cached_repo_analysis(cache_key):
+    """Retorna el resultado final guardado (dict del evento 'result') o None."""
+    result_json = _lookup("repo_analyses", "result_json", "analysis", cache_key)
+    if result_json is None:
+        return None
+    try:
+        return json.loads(result_json)
+    except ValueError:
+        return None
+
+
+def get_cached_chunk_analysis(cache_key):
+    return _lookup("repo_chunk_analyses", "analysis", "chunk", cache_key)
+
+
+def store_repo_analysis(cache_key, repo_url, commit_sha, result):
+    result_json = json.dumps(result, ensure_ascii=False)
+    now = time.time()
+    _store(
+        "INSERT OR REPLACE INTO repo_analyses "
+        "(cache_key, url, commit_sha, result_json, size_bytes, created_at, last_accessed_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (cache_key, repo_url, commit_sha, result_json, len(result_json.encode("utf-8")), now, now),
+    )
+
+
+def store_chunk_analysis(cache_key, analysis):
+    now = time.time()
+    _store(
+        "INSERT OR REPLACE INTO repo_chunk_analyses "
+        "(cache_key, analysis, size_bytes, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?)",
+        (cache_key, analysis, len(analysis.encode("utf-8")), now, now),
+    )
+
+
+def _store(statement, params):
+    try:
+        conn = _connect()
+    except sqlite3.Error as exc:
+        logger.warning("Caché de repositorios no disponible: %s", exc)
+        return
+
+    try:
+        conn.execute(statement, params)
+        _evict_if_needed(conn)
+        conn.commit()
+    except sqlite3.Error as exc:
+        logger.warning("Error guardando en la caché de repositorios: %s", exc)
+    finally:
+        conn.close()
+
+
+def _evict_if_needed(conn, max_bytes=None):
+    """Expulsa las entradas menos usadas hasta dejar la caché en el 90% del límite."""
+    max_bytes = REPO_ANALYSIS_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    total = conn.execute(
+        "SELECT (SELECT COALESCE(SUM(size_bytes), 0) FROM repo_analyses)"
+        " + (SELECT COALESCE(SUM(size_bytes), 0) FROM repo_chunk_analyses)"
+    ).fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    target = int(max_bytes * 0.9)
+    rows = conn.execute(
+        "SELECT 'repo_analyses', cache_key, size_bytes, last_accessed_at FROM repo_analyses "
+        "UNION ALL "
+        "SELECT 'repo_chunk_analyses', cache_key, size_bytes, last_accessed_at FROM repo_chunk_analyses "
+        "ORDER BY last_accessed_at"
+    ).fetchall()
+
+    evicted = 0
+    for table, cache_key, size_bytes, _last_accessed_at in rows:
+        if total <= target:
+            break
+        conn.execute(f"DELETE FROM {table} WHERE cache_key = ?", (cache_key,))
+        total -= size_bytes
+        evicted += 1
+
+    logger.info("Caché de repositorios: %s entradas expulsadas (LRU)", evicted)
+    return evicted
+
+
+def get_repo_cache_stats():
+    """Aciertos, fallos y tamaño de la caché, por tipo de entrada."""
+    stats = {
+        kind: {"hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0}
+        for kind in ("analysis", "chunk")
+    }
+    try:
+        conn = _connect()
+    except sqlite3.Error:
+        return {"size_bytes": 0, **stats}
+
+    try:
+        for kind, hits, misses in conn.execute("SELECT kind, hits, misses FROM repo_cache_stats"):
+            if kind in stats:
+                lookups = hits + misses
+                stats[kind].update(
+                    hits=hits,
+                    misses=misses,
+                    hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+                )
+        size_bytes = 0
+        for kind, table in (("analysis", "repo_analyses"), ("chunk", "repo_chunk_analyses")):
+            entries, table_bytes = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM {table}"
+            ).fetchone()
+            stats[kind]["entries"] = entries
+            size_bytes += table_bytes
+        return {"size_bytes": size_bytes, **stats}
+    finally:
+        conn.close()
@@ -1,94 +1,281 @@
 import asyncio
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from brain import process_repository_chunk, synthesize_repository_analysis
-from repo_handler import GitHubRepositoryError, ingest_github_repository, split_repository_content
+from brain import (REPO_HISTORY_MESSAGES, build_history_digest, get_analysis_model,
+                   get_analysis_provider, process_repository_chunk, register_rate_limit_listener,
+                   synthesize_repository_analysis, unregister_rate_limit_listener)
+from repo_analysis_cache import (build_analysis_cache_key, build_chunk_cache_key,
+                                 build_condensed_cache_key, get_cached_chunk_analysis,
+                                 store_chunk_analysis, store_repo_analysis)
+from repo_handler import (GitHubRepositoryError, ingest_github_repository, pack_repository_files,
+                          select_repository_files)
 
 
 logger = logging.getLogger(__name__)
 
+REPO_STREAM_EMIT_INTERVAL_SECONDS = float(os.getenv("REPO_STREAM_EMIT_INTERVAL_SECONDS", "1.5"))
+REPO_ANALYSIS_CONCURRENCY = max(1, int(os.getenv("REPO_ANALYSIS_CONCURRENCY", "4")))
+REPO_RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("REPO_RATE_LIMIT_COOLDOWN_SECONDS", "10"))
+REPO_PRUNED_FILES_LISTED = int(os.getenv("REPO_PRUNED_FILES_LISTED", "15"))
 
-def _emit(progress_queue, event_type, **payload):
-    progress_queue.put({"type": event_type, **payload})
 
+def _emit(progress_conn, event_type, **payload):
+    progress_conn.send({"type": event_type, **payload})
 
-def run_repository_analysis_worker(url, history, progress_queue):
-    """Ejecuta el análisis completo del repositorio en un proceso aislado."""
+
+class AdaptiveConcurrencyLimiter:
+    """Limita las llamadas simultáneas y se adapta a los 429 del proveedor (AIMD).
+
+    Cada 429 reduce el límite a la mitad (como máximo una vez por ventana de
+    enfriamiento); cada `limit` llamadas exitosas seguidas lo sube en uno.
+    """
+
+    def __init__(self, max_limit=REPO_ANALYSIS_CONCURRENCY, cooldown=REPO_RATE_LIMIT_COOLDOWN_SECONDS):
+        self.max_limit = max(1, int(max_limit))
+        self.limit = self.max_limit
+        self.cooldown = cooldown
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease_at = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        with self._condition:
+            self._in_flight -= 1
+            if exc_type is None:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+                    logger.info("Concurrencia del análisis de repositorio aumentada a %s", self.limit)
+            self._condition.notify_all()
+        return False
+
+    def on_rate_limited(self, provider, log_context):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease_at < self.cooldown:
+                return
+            self._last_decrease_at = now
+            self._successes = 0
+            previous_limit = self.limit
+            self.limit = max(1, self.limit // 2)
+            if self.limit != previous_limit:
+                logger.warning(
+                    "429 de %s (%s): concurrencia del análisis reducida de %s a %s",
+                    provider,
+                    log_context,
+                    previous_limit,
+                    self.limit,
+                )
+
+
+def _map_concurrently(function, items, limiter, on_done):
+    """Aplica `function` a cada item en paralelo y retorna los resultados en el orden original.
+
+    `on_done(completed, total)` se invoca desde el hilo que llama, así los
+    eventos se envían por el pipe sin competir entre hilos.
+    """
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    def run(item):
+        with limiter:
+            return function(item)
+
+    with ThreadPoolExecutor(max_workers=min(limiter.max_limit, len(items))) as executor:
+        futures = {executor.submit(run, item): position for position, item in enumerate(items)}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            position = futures[future]
+            try:
+                results[position] = future.result()
+            except Exception as exc:
+                logger.error("Falló una tarea del análisis de repositorio: %s", exc, exc_info=True)
+            on_done(completed, len(items))
+    return results
+
+
+def build_repo_analysis_model_key():
+    """Identifica el modelo de análisis vigente para las llaves de la caché."""
+    return f"{get_analysis_provider()}:{get_analysis_model()}"
+
+
+def build_repo_history_digest(history):
+    """Digest del historial que usa la síntesis final; forma parte de la llave del análisis final."""
+    return build_history_digest(history, REPO_HISTORY_MESSAGES)
+
+
+def _format_pruned_files(pruned_files):
+    if not pruned_files:
+        return ""
+
+    listed = ", ".join(path for path, _tokens in pruned_files[:REPO_PRUNED_FILES_LISTED])
+    remaining = len(pruned_files) - REPO_PRUNED_FILES_LISTED
+    if remaining > 0:
+        listed += f" y {remaining} más"
+    return f"\n\n✂️ Archivos omitidos por presupuesto ({len(pruned_files)}): {listed}"
+
+
+def _build_stream_emitter(progress_conn, title):
+    """Acumula los fragmentos de la síntesis y emite el texto parcial con un ritmo acotado."""
+    parts = []
+    last_emit_at = [0.0]
+
+    def on_delta(delta):
+        parts.append(delta)
+        now = time.monotonic()
+        if now - last_emit_at[0] >= REPO_STREAM_EMIT_INTERVAL_SECONDS:
+            last_emit_at[0] = now
+            _emit(progress_conn, "stream", title=title, text="".join(parts))
+
+    return on_delta
+
+
+def run_repository_analysis_worker(url, history, progress_conn, commit_sha=None):
+    """Ejecuta el análisis completo del repositorio en un proceso aislado.
+
+    Los eventos se envían por el extremo de escritura de un Pipe; el bot los
+    recibe con loop.add_reader, sin sondear. Con `commit_sha` los análisis
+    parciales y el resultado final se guardan en la caché de repositorios.
+    El historial solo entra en la síntesis final: las partes y consolidaciones
+    intermedias no dependen del usuario y se comparten en la caché.
+    """
+    limiter = AdaptiveConcurrencyLimiter()
+    register_rate_limit_listener(limiter.on_rate_limited)
     try:
         _emit(
-            progress_queue,
+            progress_conn,
             "progress",
             text="⏳ Obteniendo el código del repositorio con GitIngest...",
         )
 
-        repo_data = asyncio.run(ingest_github_repository(url))
-        repo_chunks = split_repository_content(repo_data["content"])
+        repo_data = asyncio.run(ingest_github_repository(url, commit_sha=commit_sha))
+        selected_files, pruned_files = select_repository_files(repo_data["content"])
+        repo_chunks = pack_repository_files(selected_files)
 
         if not repo_chunks:
             _emit(
-                progress_queue,
+                progress_conn,
                 "result",
                 status="failed",
                 error_message="No encontré contenido utilizable para analizar en ese repositorio.",
             )
             return
 
-        partial_analyses = []
         total_chunks = len(repo_chunks)
+        model_key = build_repo_analysis_model_key()
+        _emit(
+            progress_conn,
+            "progress",
+            text=f"🧠 Analizando el repositorio (0/{total_chunks} listas)...",
+        )
 
-        for index, chunk in enumerate(repo_chunks, start=1):
-            _emit(
-                progress_queue,
-                "progress",
-                text=f"🧠 Analizando el repositorio ({index}/{total_chunks})...",
+        # Solo las partes con archivos nuevos o modificados vuelven al LLM.
+        chunk_keys = [
+            build_chunk_cache_key(repo_data["slug"], chunk["files"], model_key)
+            for chunk in repo_chunks
+        ]
+        cached_partials = [get_cached_chunk_analysis(chunk_key) for chunk_key in chunk_keys]
+        reused_chunks = sum(1 for cached in cached_partials if cached)
+        if reused_chunks:
+            logger.info(
+                "Análisis incremental de %s: %s/%s partes reutilizadas de la caché",
+                repo_data["slug"],
+                reused_chunks,
+                total_chunks,
             )
 
+        def analyze_chunk(numbered_chunk):
+            index, chunk = numbered_chunk
+            if cached_partials[index - 1]:
+                return cached_partials[index - 1]
+
             partial_analysis = process_repository_chunk(
                 repo_data["slug"],
                 repo_data["summary"],
                 repo_data["tree"],
-                chunk,
+                chunk["content"],
                 index,
                 total_chunks,
-                history,
             )
-
             if partial_analysis:
-                partial_analyses.append(partial_analysis)
-            else:
-                partial_analyses.append(
-                    f"No se pudo obtener un análisis confiable para la parte {index} del repositorio."
-                )
+                store_chunk_analysis(chunk_keys[index - 1], partial_analysis)
+            return partial_analysis
+
+        partial_results = _map_concurrently(
+            analyze_chunk,
+            list(enumerate(repo_chunks, start=1)),
+            limiter,
+            lambda completed, total: _emit(
+                progress_conn,
+                "progress",
+                text=f"🧠 Analizando el repositorio ({completed}/{total} listas)...",
+            ),
+        )
+        partial_analyses = [
+            partial_analysis
+            or f"No se pudo obtener un análisis confiable para la parte {index} del repositorio."
+            for index, partial_analysis in enumerate(partial_results, start=1)
+        ]
 
         synthesis_inputs = partial_analyses
         if len(partial_analyses) > 6:
-            condensed_analyses = []
             batch_size = 4
-            total_batches = (len(partial_analyses) + batch_size - 1) // batch_size
+            batches = [
+                partial_analyses[start:start + batch_size]
+                for start in range(0, len(partial_analyses), batch_size)
+            ]
+            _emit(
+                progress_conn,
+                "progress",
+                text=f"🧩 Consolidando hallazgos intermedios (0/{len(batches)})...",
+            )
+
+            def condense_batch(batch):
+                batch_key = build_condensed_cache_key(repo_data["slug"], batch, model_key)
+                cached_condensed = get_cached_chunk_analysis(batch_key)
+                if cached_condensed:
+                    return cached_condensed
 
-            for batch_index, start in enumerate(range(0, len(partial_analyses), batch_size), start=1):
-                _emit(
-                    progress_queue,
-                    "progress",
-                    text=(
-                        "🧩 Consolidando hallazgos intermedios "
-                        f"({batch_index}/{total_batches})..."
-                    ),
-                )
-                batch = partial_analyses[start:start + batch_size]
                 condensed_analysis = synthesize_repository_analysis(
                     repo_data["slug"],
                     repo_data["summary"],
                     repo_data["tree"],
                     batch,
-                    history,
                 )
-                condensed_analyses.append(condensed_analysis or "\n\n".join(batch[:2]))
+                if condensed_analysis:
+                    store_chunk_analysis(batch_key, condensed_analysis)
+                return condensed_analysis
 
-            synthesis_inputs = condensed_analyses
+            condensed_results = _map_concurrently(
+                condense_batch,
+                batches,
+                limiter,
+                lambda completed, total: _emit(
+                    progress_conn,
+                    "progress",
+                    text=f"🧩 Consolidando hallazgos intermedios ({completed}/{total})...",
+                ),
+            )
+            synthesis_inputs = [
+                condensed_analysis or "\n\n".join(batch[:2])
+                for batch, condensed_analysis in zip(batches, condensed_results)
+            ]
 
         _emit(
-            progress_queue,
+            progress_conn,
             "progress",
             text="🧩 Consolidando la explicación final del repositorio...",
         )
@@ -99,6 +286,10 @@ def run_repository_analysis_worker(url, history, progress_queue):
             repo_data["tree"],
             synthesis_inputs,
             history,
+            on_delta=_build_stream_emitter(
+                progress_conn,
+                "🧩 Redactando la explicación final del repositorio...",
+            ),
         )
 
         if final_analysis:
@@ -114,23 +305,34 @@ def run_repository_analysis_worker(url, history, progress_queue):
                 "Te comparto los hallazgos parciales obtenidos:\n\n"
                 + "\n\n".join(partial_analyses[:6])
             )
+        response_text += _format_pruned_files(pruned_files)
 
-        _emit(
-            progress_queue,
-            "result",
-            status="completed",
-            repo_data={
+        result = {
+            "status": "completed",
+            "repo_data": {
                 "url": repo_data["url"],
                 "slug": repo_data["slug"],
                 "summary": repo_data["summary"],
             },
-            final_analysis=final_analysis,
-            response_text=response_text,
-        )
+            "final_analysis": final_analysis,
+            "response_text": response_text,
+            "pruned_files": [path for path, _tokens in pruned_files],
+        }
+        # Solo se cachea una síntesis completa; los hallazgos parciales de respaldo no.
+        if commit_sha and final_analysis:
+            store_repo_analysis(
+                build_analysis_cache_key(
+                    repo_data["url"], commit_sha, model_key, build_repo_history_digest(history)
+                ),
+                repo_data["url"],
+                commit_sha,
+                result,
+            )
+        _emit(progress_conn, "result", **result)
     except GitHubRepositoryError as exc:
         logger.warning("Error controlado analizando repositorio GitHub: %s", exc, exc_info=True)
         _emit(
-            progress_queue,
+            progress_conn,
             "result",
             status="failed",
             error_message=exc.user_message,
@@ -138,11 +340,14 @@ def run_repository_analysis_worker(url, history, progress_queue):
     except Exception as exc:
         logger.error("Error inesperado en worker de análisis GitHub: %s", exc, exc_info=True)
         _emit(
-            progress_queue,
+            progress_conn,
             "result",
             status="failed",
             error_message=(
                 "No pude analizar ese repositorio de GitHub en este momento. "
                 "Intenta de nuevo más tarde."
             ),
-        )
\ No newline at end of file
+        )
+    finally:
+        unregister_rate_limit_listener(limiter.on_rate_limited)
+        progress_conn.close()
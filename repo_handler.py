@@ -3,9 +3,20 @@ Herramientas para detectar enlaces de repositorios GitHub y preparar su contenid
 para análisis con GitIngest y el LLM.
 """
 
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import json
 import logging
+import math
 import os
+import posixpath
 import re
+import shutil
+import time
+import zlib
 from contextlib import contextmanager
 from urllib.parse import urlsplit
 
@@ -18,6 +29,16 @@ except ImportError:  # pragma: no cover - depende del entorno de despliegue
     class InvalidGitHubTokenError(ValueError):
         pass
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - depende del entorno de despliegue
+    tiktoken = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +52,28 @@ GITHUB_REPO_PATTERN = re.compile(
 )
 
 DEFAULT_MAX_FILE_SIZE = int(os.getenv("GITINGEST_MAX_FILE_SIZE", "200000"))
-DEFAULT_REPO_CHUNK_MAX_CHARS = int(os.getenv("REPO_CHUNK_MAX_CHARS", "24000"))
-DEFAULT_REPO_CHUNK_MAX_FILES = int(os.getenv("REPO_CHUNK_MAX_FILES", "16"))
+GIT_LS_REMOTE_TIMEOUT_SECONDS = float(os.getenv("GIT_LS_REMOTE_TIMEOUT_SECONDS", "10"))
+GIT_CLONE_TIMEOUT_SECONDS = float(os.getenv("GIT_CLONE_TIMEOUT_SECONDS", "180"))
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GITINGEST_CACHE_DIR = os.getenv("GITINGEST_CACHE_DIR", os.path.join(BASE_DIR, "gitingest_cache"))
+GITINGEST_CACHE_TTL_SECONDS = int(os.getenv("GITINGEST_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GITINGEST_CACHE_MAX_BYTES = int(os.getenv("GITINGEST_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Compatibilidad: si solo está REPO_CHUNK_MAX_CHARS, se convierte a ~4 caracteres por token.
+DEFAULT_REPO_CHUNK_MAX_TOKENS = int(os.getenv(
+    "REPO_CHUNK_MAX_TOKENS",
+    str(int(os.getenv("REPO_CHUNK_MAX_CHARS", "24000")) // 4),
+))
+DEFAULT_REPO_CHUNK_MIN_FILL = float(os.getenv("REPO_CHUNK_MIN_FILL", "0.6"))
+DEFAULT_REPO_CHUNK_MAX_FILES = int(os.getenv("REPO_CHUNK_MAX_FILES", "40"))
+DEFAULT_REPO_CHUNK_ANCHOR_FILES = int(os.getenv("REPO_CHUNK_ANCHOR_FILES", "6"))
+DEFAULT_REPO_ANALYSIS_TOKEN_BUDGET = int(os.getenv("REPO_ANALYSIS_TOKEN_BUDGET", "120000"))
+TOKEN_ESTIMATE_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+CODE_BOUNDARY_PATTERN = re.compile(
+    r"^(?:(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:def|class|function|interface|struct|enum|impl|trait|func|fn|module)\b"
+    r"|(?:public|private|protected|internal)\s"
+    r"|@\w"
+    r"|#{1,3}\s)"
+)
 DEFAULT_EXCLUDE_PATTERNS = {
     ".git/*",
     "__pycache__/*",
@@ -216,8 +257,232 @@ def get_repo_slug(url):
     return f"{path_parts[0]}/{path_parts[1]}"
 
 
-async def ingest_github_repository(repo_url):
-    """Obtiene el digest completo de un repositorio público usando GitIngest."""
+def _git_auth_args(token):
+    """Autenticación por cabecera en cada comando: el token no queda en .git/config."""
+    if not token:
+        return []
+    credentials = base64.b64encode(f"x-access-token:{token}".encode("utf-8")).decode("ascii")
+    return ["-c", f"http.https://github.com/.extraheader=AUTHORIZATION: basic {credentials}"]
+
+
+async def _run_git(*args, cwd=None, timeout=GIT_CLONE_TIMEOUT_SECONDS, token=None):
+    """Ejecuta git sin prompts interactivos. Retorna (código, stdout) o (None, "") si no se pudo."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "git", *_git_auth_args(token), *args,
+            cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+    except (FileNotFoundError, OSError) as exc:
+        logger.warning("No se pudo ejecutar git %s: %s", args[0], exc)
+        return None, ""
+
+    try:
+        stdout, _stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.warning("git %s excedió %ss", args[0], timeout)
+        return None, ""
+
+    return process.returncode, stdout.decode("utf-8", "replace")
+
+
+def _parse_sha(output):
+    first_line = output.strip().splitlines()[:1]
+    sha = first_line[0].split()[0] if first_line else ""
+    return sha if re.fullmatch(r"[0-9a-f]{40}", sha) else None
+
+
+async def resolve_github_head_sha(repo_url, timeout=GIT_LS_REMOTE_TIMEOUT_SECONDS):
+    """Consulta el SHA del HEAD remoto con `git ls-remote`, sin clonar.
+
+    Retorna None si git no está disponible o GitHub no responde a tiempo.
+    """
+    normalized_url = normalize_github_repo_url(repo_url)
+    if not normalized_url:
+        return None
+
+    returncode, stdout = await _run_git(
+        "ls-remote", normalized_url, "HEAD",
+        timeout=timeout,
+        token=_get_valid_github_token(),
+    )
+    if returncode != 0:
+        logger.info("git ls-remote falló para %s (código %s)", normalized_url, returncode)
+        return None
+    return _parse_sha(stdout)
+
+
+# --- Caché local de clones y digests ----------------------------------------
+
+def _repo_cache_name(normalized_url):
+    return hashlib.sha256(normalized_url.lower().encode("utf-8")).hexdigest()[:16]
+
+
+def _digest_cache_path(normalized_url, commit_sha):
+    return os.path.join(
+        GITINGEST_CACHE_DIR, "digests", f"{_repo_cache_name(normalized_url)}-{commit_sha}.json.gz"
+    )
+
+
+def _clone_cache_path(normalized_url):
+    return os.path.join(GITINGEST_CACHE_DIR, "clones", _repo_cache_name(normalized_url))
+
+
+def _load_cached_digest(normalized_url, commit_sha):
+    path = _digest_cache_path(normalized_url, commit_sha)
+    try:
+        if time.time() - os.path.getmtime(path) > GITINGEST_CACHE_TTL_SECONDS:
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+        os.utime(path)
+        return cached
+    except (OSError, ValueError):
+        return None
+
+
+def _store_cached_digest(normalized_url, commit_sha, summary, tree, content):
+    path = _digest_cache_path(normalized_url, commit_sha)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as cache_file:
+            json.dump({"summary": summary, "tree": tree, "content": content}, cache_file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        logger.warning("No se pudo guardar el digest en caché para %s: %s", normalized_url, exc)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+class _CloneLock:
+    """Lock de archivo por repositorio: dos workers no actualizan el mismo clon a la vez."""
+
+    def __init__(self, clone_path):
+        self.lock_path = f"{clone_path}.lock"
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        self._file = open(self.lock_path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        return False
+
+
+async def _update_shallow_clone(normalized_url, clone_path, token):
+    """Clona con --depth 1 la primera vez; después solo hace fetch del HEAD remoto.
+
+    Retorna el SHA del commit resultante o None si git falló.
+    """
+    if os.path.isdir(os.path.join(clone_path, ".git")):
+        returncode, _ = await _run_git("fetch", "--depth", "1", "origin", "HEAD", cwd=clone_path, token=token)
+        if returncode == 0:
+            returncode, _ = await _run_git("reset", "--hard", "FETCH_HEAD", cwd=clone_path)
+        if returncode != 0:
+            logger.info("No se pudo actualizar el clon de %s; se clonará de nuevo", normalized_url)
+            shutil.rmtree(clone_path, ignore_errors=True)
+
+    if not os.path.isdir(os.path.join(clone_path, ".git")):
+        os.makedirs(os.path.dirname(clone_path), exist_ok=True)
+        returncode, _ = await _run_git(
+            "clone", "--depth", "1", "--no-tags", "--single-branch", normalized_url, clone_path,
+            token=token,
+        )
+        if returncode != 0:
+            shutil.rmtree(clone_path, ignore_errors=True)
+            return None
+
+    returncode, stdout = await _run_git("rev-parse", "HEAD", cwd=clone_path)
+    os.utime(clone_path)
+    return _parse_sha(stdout) if returncode == 0 else None
+
+
+def _cache_entry_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                continue
+    return total
+
+
+def prune_ingest_cache(max_bytes=None, ttl_seconds=None):
+    """Borra digests y clones vencidos por TTL y, si hace falta, los menos usados (LRU)."""
+    max_bytes = GITINGEST_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ttl_seconds = GITINGEST_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    now = time.time()
+
+    entries = []
+    for kind in ("digests", "clones"):
+        directory = os.path.join(GITINGEST_CACHE_DIR, kind)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith((".lock", ".tmp")):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path, _cache_entry_size(path)))
+            except OSError:
+                continue
+
+    entries.sort()
+    total = sum(size for _mtime, _path, size in entries)
+    removed = 0
+    for mtime, path, size in entries:
+        if now - mtime <= ttl_seconds and total <= max_bytes:
+            continue
+        if os.path.isdir(path):
+            with _CloneLock(path):
+                shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        total -= size
+        removed += 1
+
+    if removed:
+        logger.info("Caché de GitIngest: %s entradas eliminadas, %.1f MB en uso", removed, total / (1024 * 1024))
+    return removed
+
+
+def _build_repo_data(normalized_url, summary, tree, content):
+    return {
+        "url": normalized_url,
+        "slug": get_repo_slug(normalized_url),
+        "summary": summary.strip(),
+        "tree": tree.strip(),
+        "content": content.strip(),
+    }
+
+
+async def ingest_github_repository(repo_url, commit_sha=None):
+    """Obtiene el digest completo de un repositorio público usando GitIngest.
+
+    Si ya hay un digest guardado para el commit, se reutiliza sin tocar la red.
+    Si no, se actualiza un clon superficial local (un `git fetch` cuando ya
+    existe) y GitIngest lo digiere desde disco. Si git falla, se recurre a la
+    ingestión remota de siempre.
+    """
     if ingest_async is None:
         raise GitHubRepoDependencyError(
             "GitIngest no está instalado en el entorno del bot. Ejecuta: pip install gitingest"
@@ -227,80 +492,478 @@ async def ingest_github_repository(repo_url):
     if not normalized_url:
         raise InvalidGitHubRepoUrlError("El enlace de GitHub no parece apuntar a un repositorio válido.")
 
+    if commit_sha:
+        cached = _load_cached_digest(normalized_url, commit_sha)
+        if cached:
+            logger.info("Digest de %s@%s reutilizado desde caché", normalized_url, commit_sha[:12])
+            return _build_repo_data(normalized_url, cached["summary"], cached["tree"], cached["content"])
+
     token = _get_valid_github_token()
+    clone_path = _clone_cache_path(normalized_url)
 
     logger.info("Iniciando ingestión del repositorio GitHub: %s", normalized_url)
-    try:
-        with _scoped_github_token(token):
-            summary, tree, content = await ingest_async(
+    # El lock se mantiene durante la ingestión: otro worker no puede mover el
+    # clon mientras GitIngest lo está leyendo.
+    with _CloneLock(clone_path):
+        local_sha = await _update_shallow_clone(normalized_url, clone_path, token)
+        if local_sha and local_sha != commit_sha:
+            cached = _load_cached_digest(normalized_url, local_sha)
+            if cached:
+                logger.info("Digest de %s@%s reutilizado desde caché", normalized_url, local_sha[:12])
+                return _build_repo_data(normalized_url, cached["summary"], cached["tree"], cached["content"])
+
+        source = clone_path if local_sha else normalized_url
+        try:
+            with _scoped_github_token(token):
+                summary, tree, content = await ingest_async(
+                    source,
+                    max_file_size=DEFAULT_MAX_FILE_SIZE,
+                    exclude_patterns=DEFAULT_EXCLUDE_PATTERNS,
+                    token=None if local_sha else token,
+                )
+        except FileNotFoundError as exc:
+            raise GitHubRepoDependencyError("Git no está disponible en el entorno del bot.") from exc
+        except Exception as exc:
+            classified_error = _classify_ingest_error(exc)
+            logger.error(
+                "Error DETALLADO ingestión %s: tipo=%s msg=%s",
                 normalized_url,
-                max_file_size=DEFAULT_MAX_FILE_SIZE,
-                exclude_patterns=DEFAULT_EXCLUDE_PATTERNS,
-                token=token,
+                type(exc).__name__,
+                str(exc),
+                exc_info=True,
             )
-    except FileNotFoundError as exc:
-        raise GitHubRepoDependencyError("Git no está disponible en el entorno del bot.") from exc
-    except Exception as exc:
-        classified_error = _classify_ingest_error(exc)
-        logger.error(
-            "Error DETALLADO ingestión %s: tipo=%s msg=%s",
-            normalized_url,
-            type(exc).__name__,
-            str(exc),
-            exc_info=True,
-        )
-        raise classified_error from exc
+            raise classified_error from exc
 
     if not content or not content.strip():
         raise GitHubRepoContentError("GitIngest no devolvió contenido utilizable para este repositorio.")
 
-    return {
-        "url": normalized_url,
-        "slug": get_repo_slug(normalized_url),
-        "summary": summary.strip(),
-        "tree": tree.strip(),
-        "content": content.strip(),
-    }
+    if local_sha:
+        # GitIngest nombra al directorio local; se muestra el repo en su lugar.
+        summary = summary.replace(os.path.basename(clone_path), get_repo_slug(normalized_url))
 
+    digest_sha = local_sha or commit_sha
+    if digest_sha:
+        _store_cached_digest(normalized_url, digest_sha, summary, tree, content)
+        prune_ingest_cache()
 
-def split_repository_content(
-    content,
-    max_chars=DEFAULT_REPO_CHUNK_MAX_CHARS,
-    max_files_per_chunk=DEFAULT_REPO_CHUNK_MAX_FILES,
-):
-    """Divide el digest en partes manejables, intentando respetar los límites por archivo."""
+    return _build_repo_data(normalized_url, summary, tree, content)
+
+
+def _is_file_separator(line):
+    stripped = line.strip()
+    return len(stripped) >= 8 and set(stripped) == {"="}
+
+
+def _get_token_encoder():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_token_encoder = _get_token_encoder()
+
+
+def estimate_tokens(text):
+    """Cuenta tokens con tiktoken si está instalado; si no, con una aproximación local.
+
+    La aproximación cuenta palabras (una por cada ~6 letras), números y
+    símbolos sueltos, que es lo que más pesa en código frente a prosa.
+    """
+    if not text:
+        return 0
+    if _token_encoder is not None:
+        return len(_token_encoder.encode(text, disallowed_special=()))
+
+    tokens = 0
+    for match in TOKEN_ESTIMATE_PATTERN.finditer(text):
+        length = match.end() - match.start()
+        tokens += 1 + (length - 1) // 6 if length > 1 else 1
+    return tokens
+
+
+def iter_repository_files(content):
+    """Recorre el digest de GitIngest y produce (ruta, texto, sha256) por archivo.
+
+    Lee línea a línea sin materializar la lista completa de líneas. El
+    separador '====' que precede a cada `FILE:` se adjunta a su propio bloque,
+    de modo que el texto de un archivo solo depende de ese archivo.
+    """
     if not content:
-        return []
+        return
 
-    chunks = []
+    current_path = ""
     current_lines = []
-    current_length = 0
-    current_file_count = 0
+    pending_separator = None
+
+    def build_file(path, lines):
+        text = "".join(lines)
+        if text.strip():
+            return path, text, hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return None
+
+    for line in io.StringIO(content):
+        if line.startswith("FILE:"):
+            finished = build_file(current_path, current_lines)
+            if finished:
+                yield finished
+            current_path = line[len("FILE:"):].strip()
+            current_lines = [pending_separator] if pending_separator else []
+            pending_separator = None
+            current_lines.append(line)
+            continue
+
+        if pending_separator is not None:
+            current_lines.append(pending_separator)
+            pending_separator = None
+        if _is_file_separator(line):
+            pending_separator = line
+            continue
+        current_lines.append(line)
+
+    if pending_separator is not None:
+        current_lines.append(pending_separator)
+    finished = build_file(current_path, current_lines)
+    if finished:
+        yield finished
+
+
+def split_repository_files(content):
+    """Separa el digest de GitIngest en bloques por archivo: [(ruta, texto, sha256)]."""
+    return list(iter_repository_files(content))
+
+
+def _split_lines_by_tokens(text, max_tokens):
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in io.StringIO(text):
+        line_tokens = estimate_tokens(line)
+        if current and current_tokens + line_tokens > max_tokens:
+            pieces.append("".join(current))
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def _split_oversized_file(text, max_tokens):
+    """Parte un archivo que no cabe en una parte por sus funciones o clases de primer nivel.
+
+    Los segmentos entre fronteras se agrupan hasta llenar el presupuesto; solo
+    un segmento que por sí solo lo excede se corta por líneas.
+    """
+    segments = []
+    current = []
+    for line in io.StringIO(text):
+        if current and CODE_BOUNDARY_PATTERN.match(line):
+            segments.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        segments.append("".join(current))
+
+    pieces = []
+    current_parts = []
+    current_tokens = 0
+    for segment in segments:
+        segment_tokens = estimate_tokens(segment)
+        if segment_tokens > max_tokens:
+            if current_parts:
+                pieces.append("".join(current_parts))
+                current_parts = []
+                current_tokens = 0
+            pieces.extend(_split_lines_by_tokens(segment, max_tokens))
+            continue
+        if current_parts and current_tokens + segment_tokens > max_tokens:
+            pieces.append("".join(current_parts))
+            current_parts = []
+            current_tokens = 0
+        current_parts.append(segment)
+        current_tokens += segment_tokens
+    if current_parts:
+        pieces.append("".join(current_parts))
+    return pieces
+
+
+def _split_file_header(text):
+    """Separa la cabecera de GitIngest ('====' / 'FILE: ruta' / '====') del cuerpo del archivo."""
+    header_lines = []
+    lines = io.StringIO(text)
+    for line in lines:
+        header_lines.append(line)
+        if line.startswith("FILE:"):
+            break
+    else:
+        return "", text
+
+    position = lines.tell()
+    next_line = lines.readline()
+    if _is_file_separator(next_line):
+        header_lines.append(next_line)
+    else:
+        lines.seek(position)
+    return "".join(header_lines), lines.read()
+
+
+def _build_piece_header(path, piece_index, total_pieces):
+    separator = "=" * 48
+    return f"{separator}\nFILE: {path} (parte {piece_index}/{total_pieces})\n{separator}\n"
+
 
-    for line in content.splitlines(keepends=True):
-        is_new_file = line.startswith("FILE:")
+def _is_chunk_anchor(path, anchor_files):
+    """Los cortes dependen de la ruta, no de la posición: un cambio no desplaza los demás."""
+    return zlib.crc32(path.encode("utf-8")) % max(1, anchor_files) == 0
 
-        if current_lines and is_new_file and (
-            current_length + len(line) > max_chars or current_file_count >= max_files_per_chunk
+
+def pack_repository_files(
+    files,
+    max_tokens=DEFAULT_REPO_CHUNK_MAX_TOKENS,
+    max_files_per_chunk=DEFAULT_REPO_CHUNK_MAX_FILES,
+    anchor_files=DEFAULT_REPO_CHUNK_ANCHOR_FILES,
+    min_fill=DEFAULT_REPO_CHUNK_MIN_FILL,
+):
+    """Agrupa los archivos del digest en partes llenas y con fronteras estables entre commits.
+
+    Los archivos se acumulan hasta el presupuesto de tokens. Una parte se
+    cierra después de un archivo "ancla" (elegido por hash de su ruta) solo si
+    ya alcanzó `min_fill` del presupuesto, o antes de desbordarlo. Editar un
+    archivo solo cambia su parte y, como mucho, las siguientes hasta el próximo
+    ancla. `files` son (ruta, texto, sha256) o, si ya se contaron, (ruta,
+    texto, sha256, tokens). Retorna [{"content": str, "files": [(ruta, sha256), ...], "tokens": int}].
+    """
+    max_tokens = max(1, int(max_tokens))
+    min_tokens = int(max_tokens * min_fill)
+    chunks = []
+    current_parts = []
+    current_files = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current_parts, current_files, current_tokens
+        text = "".join(current_parts).strip()
+        if text:
+            chunks.append({"content": text, "files": current_files, "tokens": current_tokens})
+        current_parts = []
+        current_files = []
+        current_tokens = 0
+
+    for entry in files:
+        path, text, digest = entry[:3]
+        file_tokens = entry[3] if len(entry) > 3 else estimate_tokens(text)
+        if file_tokens > max_tokens:
+            flush()
+            # Cada trozo lleva su propia cabecera para que el modelo sepa de qué archivo es.
+            _header, body = _split_file_header(text)
+            header_tokens = estimate_tokens(_build_piece_header(path, 99, 99))
+            pieces = _split_oversized_file(body, max(1, max_tokens - header_tokens))
+            for piece_index, piece in enumerate(pieces, start=1):
+                piece_text = _build_piece_header(path, piece_index, len(pieces)) + piece
+                current_parts.append(piece_text)
+                current_files.append((f"{path}#{piece_index}/{len(pieces)}", digest))
+                current_tokens = estimate_tokens(piece_text)
+                flush()
+            continue
+
+        if current_parts and (
+            current_tokens + file_tokens > max_tokens or len(current_files) >= max_files_per_chunk
         ):
-            chunks.append("".join(current_lines).strip())
-            current_lines = []
-            current_length = 0
-            current_file_count = 0
+            flush()
 
-        current_lines.append(line)
-        current_length += len(line)
+        current_parts.append(text)
+        current_files.append((path, digest))
+        current_tokens += file_tokens
+
+        if current_tokens >= min_tokens and _is_chunk_anchor(path, anchor_files):
+            flush()
+
+    flush()
+    return chunks
+
+
+def split_repository_chunks(content, **options):
+    """Trocea el digest completo de GitIngest (sin selección previa de archivos)."""
+    return pack_repository_files(iter_repository_files(content), **options)
+
+
+def split_repository_content(
+    content,
+    max_tokens=DEFAULT_REPO_CHUNK_MAX_TOKENS,
+    max_files_per_chunk=DEFAULT_REPO_CHUNK_MAX_FILES,
+):
+    """Divide el digest en partes manejables, intentando respetar los límites por archivo."""
+    return [
+        chunk["content"]
+        for chunk in split_repository_chunks(
+            content,
+            max_tokens=max_tokens,
+            max_files_per_chunk=max_files_per_chunk,
+        )
+    ]
 
-        if is_new_file:
-            current_file_count += 1
 
-        if current_length >= max_chars and not is_new_file:
-            chunks.append("".join(current_lines).strip())
-            current_lines = []
-            current_length = 0
-            current_file_count = 0
+# --- Selección de archivos relevantes --------------------------------------
 
-    if current_lines:
-        chunks.append("".join(current_lines).strip())
+README_PATTERN = re.compile(r"^readme(?:\.[a-z]+)?$", re.IGNORECASE)
+MANIFEST_FILENAMES = {
+    "package.json", "pyproject.toml", "setup.py", "setup.cfg", "requirements.txt",
+    "pipfile", "cargo.toml", "go.mod", "pom.xml", "build.gradle", "build.gradle.kts",
+    "composer.json", "gemfile", "dockerfile", "docker-compose.yml", "docker-compose.yaml",
+    "makefile", "cmakelists.txt", "tsconfig.json", "deno.json", "mix.exs", "pubspec.yaml",
+}
+ENTRY_POINT_FILENAMES = {
+    "main.py", "__main__.py", "app.py", "server.py", "cli.py", "manage.py", "wsgi.py", "asgi.py",
+    "index.js", "index.ts", "main.js", "main.ts", "app.js", "app.ts", "server.js", "server.ts",
+    "main.go", "main.rs", "lib.rs", "program.cs", "main.java", "main.kt", "main.c", "main.cpp",
+}
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".java", ".kt", ".rb", ".php", ".cs",
+    ".c", ".h", ".cpp", ".hpp", ".swift", ".scala", ".ex", ".exs", ".dart", ".vue", ".svelte",
+    ".lua", ".sh",
+}
+DATA_EXTENSIONS = {
+    ".json", ".csv", ".tsv", ".xml", ".svg", ".txt", ".log", ".sql", ".ipynb", ".yaml", ".yml",
+    ".snap", ".map", ".pem", ".lock",
+}
+TEST_PATH_PATTERN = re.compile(
+    r"(?:^|/)(?:tests?|__tests__|spec|specs|testing|e2e)(?:/|$)"
+    r"|(?:^|/)test_[^/]*$|_test\.[a-z]+$|\.(?:test|spec)\.[a-z]+$",
+    re.IGNORECASE,
+)
+FIXTURE_PATH_PATTERN = re.compile(
+    r"(?:^|/)(?:fixtures?|mocks?|__mocks__|__snapshots__|snapshots|testdata|samples?|examples?|benchmarks?)(?:/|$)",
+    re.IGNORECASE,
+)
+GENERATED_PATH_PATTERN = re.compile(
+    r"(?:^|/)(?:generated|gen|migrations|vendor|third_party|\.github)(?:/|$)"
+    r"|_pb2(?:_grpc)?\.py$|\.pb\.go$|\.g\.dart$|\.generated\.[a-z]+$|\.d\.ts$",
+    re.IGNORECASE,
+)
+GENERATED_MARKER_PATTERN = re.compile(
+    r"code generated|auto-?generated|do not edit|generated by", re.IGNORECASE,
+)
+IMPORT_PATTERN = re.compile(
+    r"^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.]+))"
+    r"|(?:require\(|from\s+|import\s+)['\"]([^'\"]+)['\"]"
+    r"|^\s*(?:use|mod)\s+([\w:]+)",
+    re.MULTILINE,
+)
+
+
+def _module_stem(path):
+    base = posixpath.basename(path)
+    stem = base.split(".", 1)[0].lower()
+    if stem in {"__init__", "index", "mod"}:
+        stem = posixpath.basename(posixpath.dirname(path)).lower() or stem
+    return stem
+
+
+def _file_body(text):
+    """Quita el encabezado FILE: de GitIngest para inspeccionar el contenido."""
+    _, _, body = text.partition("\n" + "=" * 8)
+    return body or text
+
+
+def _count_import_references(files):
+    """Centralidad aproximada: cuántos archivos importan a cada módulo (por nombre)."""
+    references = {}
+    for path, text, _digest in files:
+        seen = set()
+        for match in IMPORT_PATTERN.finditer(text):
+            target = next(group for group in match.groups() if group)
+            target = target.replace("::", "/").replace(".", "/").rstrip("/")
+            stem = posixpath.basename(target).lower()
+            if stem and stem != _module_stem(path) and stem not in seen:
+                seen.add(stem)
+                references[stem] = references.get(stem, 0) + 1
+    return references
+
+
+def score_repository_file(path, text, tokens, import_references=0):
+    """Puntúa qué tanto aporta un archivo a entender el repositorio; mayor es mejor."""
+    lower_path = path.lower()
+    filename = posixpath.basename(lower_path)
+    extension = posixpath.splitext(filename)[1]
+    depth = lower_path.count("/")
+
+    if not path:
+        return 1000.0
+
+    score = 0.0
+    if README_PATTERN.match(filename):
+        score += 120 if depth == 0 else 25
+    elif extension in {".md", ".rst"}:
+        score += 5
+    if filename in MANIFEST_FILENAMES:
+        score += 70 if depth == 0 else 30
+    if filename in ENTRY_POINT_FILENAMES:
+        score += 50
+    if extension in SOURCE_EXTENSIONS:
+        score += 15
+    elif extension in DATA_EXTENSIONS and filename not in MANIFEST_FILENAMES:
+        score -= 25
+
+    if TEST_PATH_PATTERN.search(lower_path):
+        score -= 45
+    if FIXTURE_PATH_PATTERN.search(lower_path):
+        score -= 35
+    if GENERATED_PATH_PATTERN.search(lower_path) or GENERATED_MARKER_PATTERN.search(_file_body(text)[:400]):
+        score -= 60
+
+    score += min(45.0, 9.0 * import_references)
+    score -= 4.0 * depth
+    score -= 10.0 * math.log2(1 + tokens / 2000)
+    return score
+
+
+def select_repository_files(content, token_budget=DEFAULT_REPO_ANALYSIS_TOKEN_BUDGET):
+    """Elige los archivos más relevantes del digest sin pasar de `token_budget`.
+
+    Retorna (seleccionados, omitidos): los seleccionados son (ruta, texto,
+    sha256, tokens) en el orden del digest (las fronteras de las partes siguen
+    siendo estables), listos para pack_repository_files sin volver a contar
+    tokens; los omitidos son [(ruta, tokens)] de mayor a menor relevancia.
+    """
+    files = list(iter_repository_files(content))
+    if not files:
+        return [], []
+
+    references = _count_import_references(files)
+    ranked = []
+    for position, (path, text, digest) in enumerate(files):
+        tokens = estimate_tokens(text)
+        score = score_repository_file(path, text, tokens, references.get(_module_stem(path), 0))
+        ranked.append((score, position, tokens))
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+
+    selected_positions = set()
+    pruned = []
+    used_tokens = 0
+    for score, position, tokens in ranked:
+        if used_tokens + tokens <= token_budget:
+            selected_positions.add(position)
+            used_tokens += tokens
+        else:
+            pruned.append((files[position][0], tokens))
+
+    if pruned:
+        logger.info(
+            "Selección de archivos: %s incluidos (%s tokens), %s omitidos por presupuesto de %s tokens",
+            len(selected_positions),
+            used_tokens,
+            len(pruned),
+            token_budget,
+        )
 
-    return [chunk for chunk in chunks if chunk]
\ No newline at end of file
+    token_counts = {position: tokens for _score, position, tokens in ranked}
+    selected = [
+        (*file_entry, token_counts[position])
+        for position, file_entry in enumerate(files)
+        if position in selected_positions
+    ]
+    return selected, pruned
@@ -0,0 +1,435 @@
+"""repo_worker_pool.py
+Pool persistente de procesos para el análisis de repositorios GitHub.
+
+Los workers se crean desde un forkserver que ya importó brain, repo_handler y
+gitingest, y sobreviven entre análisis: cada trabajo nuevo evita la importación
+y la reconstrucción del estado HTTP. El pool admite un número fijo de workers,
+encola el resto en orden de llegada (informando la posición), recicla workers
+tras N trabajos o al superar un umbral de memoria, y permite cancelar un
+trabajo en cola o en curso.
+
+Los análisis idénticos (misma `flight_key`: repo normalizado + commit) que
+llegan mientras uno ya está en cola o en curso se suman a ese trabajo como
+suscriptores: todos reciben el progreso y el resultado, y el worker solo se
+cancela cuando no queda ningún suscriptor.
+
+Cada worker se comunica por un único Pipe dúplex: el bot envía trabajos y el
+worker responde con los eventos del análisis etiquetados con `job_id`. El pool
+los entrega a la asyncio.Queue de cada trabajo, leyendo el pipe con
+loop.add_reader, sin sondeo.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+REPO_WORKER_POOL_SIZE = max(1, int(os.getenv("REPO_WORKER_POOL_SIZE", "2")))
+REPO_WORKER_MAX_JOBS = max(1, int(os.getenv("REPO_WORKER_MAX_JOBS", "20")))
+REPO_WORKER_MAX_RSS_MB = int(os.getenv("REPO_WORKER_MAX_RSS_MB", "1024"))
+# El forkserver es uno por proceso y solo aplica la precarga vigente cuando arranca:
+# la lista cubre también a los trabajos de media_executor.
+FORKSERVER_PRELOAD_MODULES = [
+    "brain",
+    "repo_handler",
+    "repo_analysis_worker",
+    "transcription_service",
+    "video_handler",
+]
+
+
+def _current_rss_mb():
+    """RSS actual del proceso; si /proc no existe, el pico según getrusage."""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _JobChannel:
+    """Adapta el pipe del worker a la interfaz que espera run_repository_analysis_worker."""
+
+    def __init__(self, connection, job_id):
+        self._connection = connection
+        self._job_id = job_id
+
+    def send(self, event):
+        self._connection.send({**event, "job_id": self._job_id})
+
+    def close(self):
+        # El pipe es del worker, no del trabajo: sigue abierto para el siguiente.
+        pass
+
+
+def _worker_main(connection):
+    """Bucle del proceso worker: atiende trabajos hasta recibir None o perder el pipe."""
+    from repo_analysis_worker import run_repository_analysis_worker
+
+    # El forkserver no hereda la configuración de logging del bot; los workers
+    # escriben a stderr (journald) para no competir por el archivo rotativo.
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    while True:
+        try:
+            job = connection.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+
+        job_id, url, history, commit_sha = job
+        channel = _JobChannel(connection, job_id)
+        try:
+            run_repository_analysis_worker(url, history, channel, commit_sha)
+        except Exception as exc:
+            logger.error("Error inesperado en el worker del pool: %s", exc, exc_info=True)
+            channel.send({
+                "type": "result",
+                "status": "failed",
+                "error_message": (
+                    "No pude analizar ese repositorio de GitHub en este momento. "
+                    "Intenta de nuevo más tarde."
+                ),
+            })
+
+        try:
+            connection.send({"type": "job_done", "job_id": job_id, "rss_mb": _current_rss_mb()})
+        except (EOFError, OSError):
+            return
+
+
+async def reap_process(process, *, terminate=False):
+    """Recoge un proceso hijo sin bloquear el event loop; si no sale a tiempo, lo mata."""
+    if terminate and process.is_alive():
+        process.terminate()
+    await asyncio.to_thread(process.join, 2)
+    if process.is_alive():
+        process.kill()
+        await asyncio.to_thread(process.join, 1)
+
+
+def build_forkserver_context():
+    """Contexto forkserver con los módulos pesados precargados (spawn si no existe)."""
+    methods = multiprocessing.get_all_start_methods()
+    if "forkserver" in methods:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(FORKSERVER_PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class _Worker:
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.job_id = None
+        self.jobs_done = 0
+        self.retiring = False
+
+
+class RepoAnalysisWorkerPool:
+    """Pool de workers precalentados con cola FIFO de admisión."""
+
+    def __init__(self, size=REPO_WORKER_POOL_SIZE, max_jobs_per_worker=REPO_WORKER_MAX_JOBS,
+                 max_rss_mb=REPO_WORKER_MAX_RSS_MB, context=None):
+        self.size = max(1, int(size))
+        self.max_jobs_per_worker = max(1, int(max_jobs_per_worker))
+        self.max_rss_mb = max_rss_mb
+        self._context = context
+        self._loop = None
+        self._workers = []
+        self._queue = OrderedDict()
+        self._jobs = {}
+        self._flights = {}
+        self._subscriptions = {}
+        self._reaping = set()
+        self._closing = False
+
+    # --- Ciclo de vida ------------------------------------------------------
+
+    def start(self):
+        """Arranca los workers en el event loop actual (llamar desde post_init)."""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        if self._context is None:
+            self._context = build_forkserver_context()
+        for _ in range(self.size):
+            self._spawn_worker()
+        logger.info(
+            "Pool de análisis de repositorios iniciado: %s workers (%s)",
+            self.size,
+            self._context.get_start_method(),
+        )
+
+    def _spawn_worker(self):
+        parent_connection, child_connection = self._context.Pipe(duplex=True)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_connection,),
+            name="repo-analysis-worker",
+            daemon=True,
+        )
+        try:
+            process.start()
+        finally:
+            child_connection.close()
+
+        worker = _Worker(process, parent_connection)
+        self._workers.append(worker)
+        self._loop.add_reader(parent_connection.fileno(), self._on_readable, worker)
+        return worker
+
+    def _discard_worker(self, worker, *, terminate):
+        if worker in self._workers:
+            self._workers.remove(worker)
+        try:
+            self._loop.remove_reader(worker.connection.fileno())
+        except (OSError, ValueError):
+            pass
+        try:
+            worker.connection.close()
+        except OSError:
+            pass
+
+        reap_task = self._loop.create_task(reap_process(worker.process, terminate=terminate))
+        self._reaping.add(reap_task)
+        reap_task.add_done_callback(self._reaping.discard)
+
+    async def shutdown(self):
+        """Pide a los workers que terminen y espera un momento antes de forzarlos."""
+        self._closing = True
+        for entry in self._queue.values():
+            self._broadcast(entry, None)
+        self._queue.clear()
+
+        for worker in list(self._workers):
+            try:
+                worker.connection.send(None)
+            except (OSError, ValueError):
+                pass
+
+        deadline = self._loop.time() + 3 if self._loop else 0
+        while self._loop and any(worker.process.is_alive() for worker in self._workers):
+            if self._loop.time() >= deadline:
+                break
+            await asyncio.sleep(0.1)
+
+        for worker in list(self._workers):
+            self._discard_worker(worker, terminate=True)
+        if self._reaping:
+            await asyncio.gather(*self._reaping, return_exceptions=True)
+
+    # --- Trabajos -----------------------------------------------------------
+
+    def submit(self, job_id, url, history, commit_sha, events, flight_key=None):
+        """Encola un análisis. Retorna 0 si arrancó ya o su posición (1..n) en la cola.
+
+        Si hay un trabajo con la misma `flight_key` en cola o en curso, `job_id`
+        se suscribe a él en lugar de lanzar otro análisis.
+        """
+        if self._loop is None:
+            self.start()
+
+        leader_id = self._flights.get(flight_key) if flight_key else None
+        entry = self._get_entry(leader_id) if leader_id else None
+        if entry is not None:
+            entry["subscribers"][job_id] = events
+            self._subscriptions[job_id] = leader_id
+            if entry.get("last_progress"):
+                events.put_nowait(entry["last_progress"])
+            logger.info("Análisis %s se une al análisis en curso %s (%s)", job_id, leader_id, flight_key)
+            return self.queue_position(job_id)
+
+        self._queue[job_id] = {
+            "job": (job_id, url, history, commit_sha),
+            "subscribers": {job_id: events},
+            "flight_key": flight_key,
+            "position": None,
+            "last_progress": None,
+        }
+        self._subscriptions[job_id] = job_id
+        if flight_key:
+            self._flights[flight_key] = job_id
+        self._dispatch()
+        entry = self._queue.get(job_id)
+        return entry["position"] if entry else 0
+
+    def shared_with(self, job_id):
+        """ID del análisis al que se unió `job_id`, o None si es el suyo propio."""
+        leader_id = self._subscriptions.get(job_id)
+        return leader_id if leader_id not in (None, job_id) else None
+
+    def queue_position(self, job_id):
+        leader_id = self._subscriptions.get(job_id, job_id)
+        for position, queued_job_id in enumerate(self._queue, start=1):
+            if queued_job_id == leader_id:
+                return position
+        return 0
+
+    def cancel(self, job_id):
+        """Retira al suscriptor; si era el último, saca el trabajo de la cola o termina a su worker."""
+        leader_id = self._subscriptions.pop(job_id, None)
+        if leader_id is None:
+            return False
+
+        entry = self._get_entry(leader_id)
+        if entry is None:
+            return False
+        entry["subscribers"].pop(job_id, None)
+        if entry["subscribers"]:
+            return True
+
+        self._forget_flight(leader_id, entry)
+        if self._queue.pop(leader_id, None) is not None:
+            self._report_queue_positions()
+            return True
+
+        self._jobs.pop(leader_id, None)
+        worker = entry["worker"]
+        logger.info("Cancelando análisis %s: se reemplaza al worker %s", leader_id, worker.process.pid)
+        self._discard_worker(worker, terminate=True)
+        if not self._closing:
+            self._spawn_worker()
+        self._dispatch()
+        return True
+
+    def _get_entry(self, job_id):
+        return self._queue.get(job_id) or self._jobs.get(job_id)
+
+    def _forget_flight(self, job_id, entry):
+        for subscriber_id in entry["subscribers"]:
+            self._subscriptions.pop(subscriber_id, None)
+        self._subscriptions.pop(job_id, None)
+        flight_key = entry.get("flight_key")
+        if flight_key and self._flights.get(flight_key) == job_id:
+            self._flights.pop(flight_key, None)
+
+    def _broadcast(self, entry, message):
+        for events in entry["subscribers"].values():
+            events.put_nowait(message)
+
+    def _dispatch(self):
+        for worker in list(self._workers):
+            if not self._queue:
+                break
+            if worker.job_id is not None or worker.retiring:
+                continue
+
+            job_id, entry = self._queue.popitem(last=False)
+            try:
+                worker.connection.send(entry["job"])
+            except (OSError, ValueError):
+                self._queue[job_id] = entry
+                self._queue.move_to_end(job_id, last=False)
+                self._discard_worker(worker, terminate=True)
+                if not self._closing:
+                    self._spawn_worker()
+                continue
+
+            worker.job_id = job_id
+            entry["worker"] = worker
+            self._jobs[job_id] = entry
+
+        self._report_queue_positions()
+
+    def _report_queue_positions(self):
+        for position, entry in enumerate(self._queue.values(), start=1):
+            if entry["position"] is not None and entry["position"] != position:
+                self._broadcast(entry, {
+                    "type": "progress",
+                    "text": f"⏳ Tu análisis está en cola (posición {position}).",
+                })
+            entry["position"] = position
+
+    # --- Eventos de los workers -------------------------------------------
+
+    def _on_readable(self, worker):
+        try:
+            while worker.connection.poll():
+                self._handle_message(worker, worker.connection.recv())
+        except (EOFError, OSError):
+            self._on_worker_exit(worker)
+        except Exception as exc:
+            logger.error("Error leyendo el pipe de un worker del pool: %s", exc, exc_info=True)
+            self._on_worker_exit(worker, terminate=True)
+
+    def _handle_message(self, worker, message):
+        job_id = message.pop("job_id", None)
+        message_type = message.get("type")
+
+        if message_type == "job_done":
+            worker.job_id = None
+            worker.jobs_done += 1
+            if worker.jobs_done >= self.max_jobs_per_worker or message.get("rss_mb", 0) >= self.max_rss_mb:
+                logger.info(
+                    "Reciclando worker %s tras %s trabajos (%.0f MB)",
+                    worker.process.pid,
+                    worker.jobs_done,
+                    message.get("rss_mb", 0),
+                )
+                worker.retiring = True
+                try:
+                    worker.connection.send(None)
+                except (OSError, ValueError):
+                    pass
+            self._dispatch()
+            return
+
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            return
+        if message_type == "result":
+            # El trabajo terminó: cancelarlo ya no debe matar al worker.
+            self._jobs.pop(job_id, None)
+            self._forget_flight(job_id, entry)
+        elif message_type in ("progress", "stream"):
+            # Quien se una más tarde arranca viendo el último estado.
+            entry["last_progress"] = message
+        self._broadcast(entry, message)
+
+    def _on_worker_exit(self, worker, terminate=False):
+        """El pipe llegó a EOF (o quedó inservible): el worker se retiró o murió."""
+        job_id = worker.job_id
+        self._discard_worker(worker, terminate=terminate)
+
+        entry = self._jobs.pop(job_id, None) if job_id else None
+        if entry is not None:
+            self._forget_flight(job_id, entry)
+            self._broadcast(entry, {"type": "eof"})
+        if not worker.retiring and job_id is None and not self._closing:
+            logger.warning("Un worker ocioso del pool terminó inesperadamente (pid %s)", worker.process.pid)
+
+        if not self._closing:
+            self._spawn_worker()
+            self._dispatch()
+
+    def get_stats(self):
+        return {
+            "workers": len(self._workers),
+            "busy": sum(1 for worker in self._workers if worker.job_id is not None),
+            "queued": len(self._queue),
+            "shared": sum(
+                len(entry["subscribers"]) - 1
+                for entry in list(self._queue.values()) + list(self._jobs.values())
+            ),
+        }
+
+
+_repo_worker_pool = None
+
+
+def get_repo_worker_pool():
+    global _repo_worker_pool
+    if _repo_worker_pool is None:
+        _repo_worker_pool = RepoAnalysisWorkerPool()
+    return _repo_worker_pool
@@ -0,0 +1,118 @@
+"""single_flight.py
+Coordinación "single-flight" de trabajos asyncio idénticos.
+
+Cuando varios usuarios piden a la vez el mismo trabajo (misma llave: operación
++ URL normalizada), solo el primero lo ejecuta; los demás se suman a esa
+ejecución y reciben su resultado. Los suscriptores exponen `on_progress(texto)`
+y `on_delta(fragmento)` (como StreamingMessageRenderer): el trabajo informa su
+avance a través del objeto que recibe y este lo reenvía a todos, incluido el
+último estado para quien se une a mitad de camino.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, key):
+        self.key = key
+        self.task = None
+        self.subscribers = []
+        self.waiters = 0
+        self.last_progress = None
+        self.streamed_text = ""
+        # Serializa los avisos y la puesta al día de quien se une, para que no se intercalen.
+        self._lock = asyncio.Lock()
+
+    async def _notify(self, method_name, value):
+        for subscriber in list(self.subscribers):
+            try:
+                await getattr(subscriber, method_name)(value)
+            except Exception as exc:
+                logger.warning("Un suscriptor de %s falló al recibir %s: %s", self.key, method_name, exc)
+
+    async def on_progress(self, status):
+        async with self._lock:
+            self.last_progress = status
+            self.streamed_text = ""
+            await self._notify("on_progress", status)
+
+    async def on_delta(self, delta):
+        async with self._lock:
+            self.streamed_text += delta
+            await self._notify("on_delta", delta)
+
+    async def join(self, subscriber):
+        """Suscribe a quien llega tarde y le reenvía el último estado antes de cualquier aviso nuevo."""
+        async with self._lock:
+            self.subscribers.append(subscriber)
+            try:
+                if self.last_progress:
+                    await subscriber.on_progress(self.last_progress)
+                if self.streamed_text:
+                    await subscriber.on_delta(self.streamed_text)
+            except Exception as exc:
+                logger.warning("Un suscriptor de %s falló al ponerse al día: %s", self.key, exc)
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma llave en una sola ejecución."""
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+
+    def in_flight(self, key):
+        return key in self._flights
+
+    async def run(self, key, work, subscriber=None):
+        """Ejecuta `work(flight)` una sola vez por llave en curso y retorna su resultado.
+
+        `work` recibe el objeto de la ejecución, con on_progress/on_delta para
+        informar avance. La tarea no se cancela si lo hace quien la inició: los
+        demás siguen esperando su resultado. Si se cancela el último que
+        esperaba, se cancela también la tarea (y con ella el trabajo en curso).
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(work(flight))
+            flight.task.add_done_callback(lambda _task: self._forget(flight))
+            if subscriber is not None:
+                flight.subscribers.append(subscriber)
+            joining = False
+        else:
+            logger.info("%s: se reutiliza el trabajo en curso %s", self.name, key)
+            joining = subscriber is not None
+
+        flight.waiters += 1
+        cancelled = False
+        try:
+            if joining:
+                await flight.join(subscriber)
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            flight.waiters -= 1
+            if subscriber is not None and subscriber in flight.subscribers:
+                flight.subscribers.remove(subscriber)
+            if cancelled and flight.waiters == 0 and not flight.task.done():
+                logger.info("%s: nadie espera ya %s; se cancela el trabajo", self.name, key)
+                # Quien llegue después inicia una ejecución nueva en vez de unirse a la cancelada.
+                self._forget(flight)
+                flight.task.cancel()
+
+    def _forget(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def get_stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(len(flight.subscribers) for flight in self._flights.values()),
+        }
@@ -0,0 +1,121 @@
+"""Verifica con EXPLAIN QUERY PLAN que las consultas calientes de database.py usan índices.
+
+Se ejecutan las mismas constantes SQL que usa el código sobre una base creada
+con init_db(); si alguna vuelve a recorrer una tabla completa, el test falla.
+"""
+
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+NOTES_BY_USER_VARIANTS = {
+    'todas': ('', (1,)),
+    'sin_categoria': (database.NOTES_UNCATEGORIZED_FILTER, (1, database.UNCATEGORIZED_LABEL)),
+    'categoria': (database.NOTES_CATEGORY_FILTER, (1, 'Trabajo')),
+    'subcategoria': (
+        database.NOTES_CATEGORY_FILTER + database.NOTES_SUBCATEGORY_FILTER,
+        (1, 'Trabajo', 1),
+    ),
+    'sin_categoria_subcategoria': (
+        database.NOTES_UNCATEGORIZED_FILTER + database.NOTES_SUBCATEGORY_FILTER,
+        (1, database.UNCATEGORIZED_LABEL, 1),
+    ),
+}
+
+QUERY_PLAN_CASES = {
+    'check_reminders': (database.DUE_REMINDERS_QUERY, ('2026-01-01 00:00:00',)),
+    'get_pending_reminder_schedule': (
+        database.PENDING_REMINDER_SCHEDULE_QUERY + database.PENDING_REMINDER_SCHEDULE_ORDER,
+        (),
+    ),
+    'get_user_reminders': (database.USER_REMINDERS_QUERY, (1,)),
+    'get_today_reminders': (
+        database.TODAY_REMINDERS_QUERY,
+        (1, '2026-01-01 00:00:00', '2026-01-01 23:59:59'),
+    ),
+    'get_note_categories_by_user': (
+        database.NOTE_CATEGORY_COUNTS_QUERY,
+        (database.UNCATEGORIZED_LABEL, 1, database.UNCATEGORIZED_LABEL),
+    ),
+    'get_note_categories_by_user[subcategorias]': (database.NOTE_SUBCATEGORY_COUNTS_QUERY, (1,)),
+    **{
+        f'get_notes_by_user[{name}]': (
+            database.NOTES_BY_USER_QUERY + filters + database.NOTES_BY_USER_ORDER,
+            params,
+        )
+        for name, (filters, params) in NOTES_BY_USER_VARIANTS.items()
+    },
+}
+
+# Único recorrido completo permitido: el índice parcial, que solo contiene pendientes.
+ALLOWED_SCAN_INDEXES = ('idx_reminders_pending_due',)
+
+
+@pytest.fixture
+def db_cursor(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'reminders.db'))
+    database.init_db()
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    # ANALYZE sobre datos de muchos usuarios deja al planificador con
+    # estadísticas parecidas a las de producción.
+    users = 200
+    cursor.executemany(
+        "INSERT INTO reminders (user_id, message, remind_at, status) VALUES (?, ?, ?, ?)",
+        [
+            (number % users, 'r', f'2026-01-{number % 28 + 1:02d} 08:00:00', 'pending' if number % 3 else 'sent')
+            for number in range(users * 10)
+        ],
+    )
+    cursor.executemany(
+        "INSERT INTO note_subcategories (user_id, category_name, name) VALUES (?, 'Trabajo', ?)",
+        [(user_id, f'sub{number}') for user_id in range(users) for number in range(2)],
+    )
+    cursor.executemany(
+        "INSERT INTO notes (user_id, content, category, subcategory_id) VALUES (?, ?, ?, ?)",
+        [
+            (number % users, 'n', 'Trabajo' if number % 2 else None, number % (users * 2) + 1 if number % 2 else None)
+            for number in range(users * 10)
+        ],
+    )
+    cursor.execute('ANALYZE')
+    conn.commit()
+    yield cursor
+    conn.close()
+    database.close_all_connections()
+
+
+def _plan_details(cursor, query, params):
+    cursor.execute(f'EXPLAIN QUERY PLAN {query}', params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def _scanned_index(detail):
+    match = re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)
+    return match.group(1) if match else None
+
+
+@pytest.mark.parametrize('name', sorted(QUERY_PLAN_CASES))
+def test_query_uses_an_index(db_cursor, name):
+    query, params = QUERY_PLAN_CASES[name]
+    details = _plan_details(db_cursor, query, params)
+
+    full_scans = [
+        detail for detail in details
+        if detail.startswith('SCAN') and _scanned_index(detail) not in ALLOWED_SCAN_INDEXES
+    ]
+    assert not full_scans, f'{name} recorre la tabla o un índice completo: {details}'
+
+
+@pytest.mark.parametrize('name', sorted(name for name, (query, _) in QUERY_PLAN_CASES.items() if 'ORDER BY' in query))
+def test_order_by_comes_from_an_index(db_cursor, name):
+    query, params = QUERY_PLAN_CASES[name]
+    details = _plan_details(db_cursor, query, params)
+
+    assert 'USE TEMP B-TREE FOR ORDER BY' not in details, f'{name} ordena en un B-tree temporal: {details}'
@@ -1,7 +1,16 @@
 import os
 import logging
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
 import requests
 
+from ai_connections import get_connection_manager
 from brain import get_ai_configuration
 from database import AI_TRANSCRIPT_CAPABILITY
 
@@ -9,6 +18,16 @@ logger = logging.getLogger(__name__)
 
 GROQ_TRANSCRIPT_URL = "https://api.groq.com/openai/v1/audio/transcriptions"
 MAX_AUDIO_SIZE_BYTES = 25 * 1024 * 1024
+# Por encima del límite del proveedor el audio se trocea; esto acota lo que se acepta descargar.
+MAX_LONG_AUDIO_SIZE_BYTES = int(os.getenv("MAX_LONG_AUDIO_SIZE_BYTES", str(300 * 1024 * 1024)))
+TRANSCRIPT_SEGMENT_SECONDS = int(os.getenv("TRANSCRIPT_SEGMENT_SECONDS", "600"))
+TRANSCRIPT_SEGMENT_OVERLAP_SECONDS = float(os.getenv("TRANSCRIPT_SEGMENT_OVERLAP_SECONDS", "3"))
+# Ventana (±s) alrededor de cada corte donde se busca un silencio para no partir palabras.
+TRANSCRIPT_SILENCE_SEARCH_SECONDS = float(os.getenv("TRANSCRIPT_SILENCE_SEARCH_SECONDS", "20"))
+TRANSCRIPT_MAX_CONCURRENCY = max(1, int(os.getenv("TRANSCRIPT_MAX_CONCURRENCY", "4")))
+TRANSCRIPT_SEGMENT_BITRATE = os.getenv("TRANSCRIPT_SEGMENT_BITRATE", "48k")
+TRANSCRIPT_RATE_LIMIT_RETRIES = int(os.getenv("TRANSCRIPT_RATE_LIMIT_RETRIES", "2"))
+FFMPEG_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_TIMEOUT_SECONDS", "300"))
 
 
 def get_transcript_api_key(provider):
@@ -18,8 +37,263 @@ def get_transcript_api_key(provider):
     return None
 
 
-def transcribe_audio_with_groq(audio_path, model_name, get_audio_mime_type, *, timeout=120):
-    """Transcribe audio usando la API compatible de Groq."""
+def _post_groq_transcription(audio_path, model_name, get_audio_mime_type, *, api_key, timeout,
+                             response_format="json"):
+    """Sube un archivo a Groq. Retorna (json, None) o (None, status_code|mensaje)."""
+    with open(audio_path, 'rb') as audio_file:
+        files = {
+            'file': (
+                os.path.basename(audio_path),
+                audio_file,
+                get_audio_mime_type(audio_path),
+            )
+        }
+        data = {
+            'model': model_name,
+            'response_format': response_format,
+        }
+        session = get_connection_manager().get_session("groq", GROQ_TRANSCRIPT_URL, api_key)
+        response = session.post(
+            GROQ_TRANSCRIPT_URL,
+            headers={"Authorization": f"Bearer {api_key}"},
+            files=files,
+            data=data,
+            timeout=timeout,
+        )
+
+    if response.status_code != 200:
+        if response.status_code not in (413, 429):
+            logger.error("Groq API error: %s - %s", response.status_code, response.text[:300])
+        return None, response.status_code
+    return response.json(), None
+
+
+def _describe_groq_status(status_code):
+    if status_code == 413:
+        return "El archivo de audio es demasiado grande para la API de transcripción."
+    if status_code == 429:
+        return "Se excedió el límite de la API de transcripción. Intenta de nuevo en unos minutos."
+    return f"Error en la transcripción (código {status_code}). Intenta de nuevo."
+
+
+# --- Troceo de audio largo ---------------------------------------------------
+
+def probe_audio_duration(audio_path):
+    """Duración del audio en segundos según ffprobe, o None si no se puede determinar."""
+    if not shutil.which("ffprobe"):
+        return None
+    try:
+        completed = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                audio_path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        return float(completed.stdout.strip())
+    except (subprocess.SubprocessError, OSError, ValueError):
+        return None
+
+
+def detect_silences(audio_path, noise_db=-35, min_silence_seconds=0.4):
+    """Retorna [(inicio, fin)] de los silencios detectados con silencedetect."""
+    try:
+        completed = subprocess.run(
+            [
+                "ffmpeg", "-hide_banner", "-nostats", "-i", audio_path,
+                "-af", f"silencedetect=noise={noise_db}dB:d={min_silence_seconds}",
+                "-f", "null", "-",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=FFMPEG_TIMEOUT_SECONDS,
+        )
+    except (subprocess.SubprocessError, OSError) as exc:
+        logger.warning("No se pudieron detectar silencios en %s: %s", audio_path, exc)
+        return []
+
+    silences = []
+    silence_start = None
+    for match in re.finditer(r"silence_(start|end): (-?[\d.]+)", completed.stderr):
+        kind, value = match.group(1), float(match.group(2))
+        if kind == "start":
+            silence_start = max(0.0, value)
+        elif silence_start is not None:
+            silences.append((silence_start, value))
+            silence_start = None
+    return silences
+
+
+def plan_audio_segments(duration, silences=(), segment_seconds=TRANSCRIPT_SEGMENT_SECONDS,
+                        search_seconds=TRANSCRIPT_SILENCE_SEARCH_SECONDS):
+    """Elige los cortes: cada `segment_seconds`, movidos al silencio más cercano si lo hay.
+
+    Retorna [(inicio, fin)] contiguos que cubren todo el audio.
+    """
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts = [0.0]
+    while duration - cuts[-1] > segment_seconds * 1.25:
+        target = cuts[-1] + segment_seconds
+        nearby = [
+            point for point in midpoints
+            if abs(point - target) <= search_seconds and point > cuts[-1] + segment_seconds / 2
+        ]
+        cuts.append(min(nearby, key=lambda point: abs(point - target)) if nearby else target)
+    cuts.append(duration)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _extract_audio_segment(audio_path, start, end, output_path):
+    """Recorta [start, end] a MP3 mono de 16 kHz, suficiente para reconocimiento de voz."""
+    completed = subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-ss", f"{start:.3f}", "-i", audio_path, "-t", f"{end - start:.3f}",
+            "-vn", "-ac", "1", "-ar", "16000",
+            "-c:a", "libmp3lame", "-b:a", TRANSCRIPT_SEGMENT_BITRATE,
+            output_path,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=FFMPEG_TIMEOUT_SECONDS,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip()[-300:] or "ffmpeg falló")
+
+
+def _merge_overlapping_text(previous, current, max_words=40):
+    """Quita del inicio de `current` las palabras que repiten el final de `previous`."""
+    previous_words = previous.split()
+    current_words = current.split()
+    normalize = lambda word: re.sub(r"\W+", "", word.lower())
+    for size in range(min(max_words, len(previous_words), len(current_words)), 2, -1):
+        tail = [normalize(word) for word in previous_words[-size:]]
+        head = [normalize(word) for word in current_words[:size]]
+        if tail == head:
+            return " ".join(current_words[size:])
+    return current
+
+
+def stitch_segment_transcripts(results):
+    """Une las transcripciones de los tramos en orden, sin duplicar el solapamiento.
+
+    Cada resultado es {"start", "end", "offset", "text", "segments"}: los
+    segmentos con marcas de tiempo (verbose_json) se desplazan por `offset` y
+    solo se conservan los que empiezan dentro del rango nominal del tramo; si el
+    proveedor no devolvió marcas, se recorta el texto repetido entre tramos.
+    """
+    pieces = []
+    for result in results:
+        timed_segments = result.get("segments") or []
+        if timed_segments:
+            texts = [
+                (segment.get("text") or "").strip()
+                for segment in timed_segments
+                if result["start"] <= result["offset"] + float(segment.get("start", 0)) < result["end"]
+            ]
+            text = " ".join(piece for piece in texts if piece)
+        else:
+            text = (result.get("text") or "").strip()
+            if pieces and text:
+                text = _merge_overlapping_text(pieces[-1], text)
+        if text:
+            pieces.append(text)
+    return " ".join(pieces).strip()
+
+
+def _transcribe_segment(audio_path, segment, model_name, get_audio_mime_type, api_key, timeout, temp_dir):
+    index, (start, end) = segment
+    offset = max(0.0, start - TRANSCRIPT_SEGMENT_OVERLAP_SECONDS)
+    segment_path = os.path.join(temp_dir, f"segment_{index:04d}.mp3")
+    _extract_audio_segment(audio_path, offset, end + TRANSCRIPT_SEGMENT_OVERLAP_SECONDS, segment_path)
+    try:
+        for attempt in range(TRANSCRIPT_RATE_LIMIT_RETRIES + 1):
+            result, status = _post_groq_transcription(
+                segment_path,
+                model_name,
+                get_audio_mime_type,
+                api_key=api_key,
+                timeout=timeout,
+                response_format="verbose_json",
+            )
+            if status != 429 or attempt == TRANSCRIPT_RATE_LIMIT_RETRIES:
+                break
+            time.sleep(2 ** attempt * 2)
+    finally:
+        os.remove(segment_path)
+
+    if result is None:
+        raise RuntimeError(_describe_groq_status(status))
+    return {
+        "start": start,
+        "end": end,
+        "offset": offset,
+        "text": result.get("text", ""),
+        "segments": result.get("segments"),
+    }
+
+
+def _should_segment(file_size, duration):
+    if file_size > MAX_AUDIO_SIZE_BYTES:
+        return True
+    return bool(duration) and duration > TRANSCRIPT_SEGMENT_SECONDS * 1.5
+
+
+def transcribe_long_audio_with_groq(audio_path, model_name, get_audio_mime_type, *, duration=None,
+                                    api_key, timeout=120, on_progress=None):
+    """Trocea el audio con ffmpeg y transcribe los tramos en paralelo."""
+    duration = duration or probe_audio_duration(audio_path)
+    if not duration:
+        return None, "No pude leer la duración del audio para dividirlo."
+
+    segments = plan_audio_segments(duration, detect_silences(audio_path))
+    logger.info(
+        "Transcribiendo audio largo por tramos: %.0fs en %s tramos (concurrencia %s)",
+        duration,
+        len(segments),
+        TRANSCRIPT_MAX_CONCURRENCY,
+    )
+
+    temp_dir = tempfile.mkdtemp(prefix="clusivai_segments_")
+    try:
+        with ThreadPoolExecutor(
+            max_workers=min(TRANSCRIPT_MAX_CONCURRENCY, len(segments)),
+            thread_name_prefix="transcript-segment",
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _transcribe_segment,
+                    audio_path, segment, model_name, get_audio_mime_type, api_key, timeout, temp_dir,
+                )
+                for segment in enumerate(segments)
+            ]
+            for completed, _future in enumerate(as_completed(futures), start=1):
+                if on_progress:
+                    on_progress(f"🎙️ Transcribiendo audio por tramos ({completed}/{len(segments)})...")
+            results = [future.result() for future in futures]
+    except RuntimeError as exc:
+        logger.error("Falló la transcripción por tramos de %s: %s", audio_path, exc)
+        return None, str(exc)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    transcript = stitch_segment_transcripts(results)
+    if not transcript:
+        return None, "La transcripción está vacía. El audio podría no contener voz clara."
+    logger.info("Transcripción por tramos exitosa con Groq: %s caracteres", len(transcript))
+    return transcript, None
+
+
+def transcribe_audio_with_groq(audio_path, model_name, get_audio_mime_type, *, timeout=120, on_progress=None):
+    """Transcribe audio usando la API compatible de Groq.
+
+    Los audios que superan el límite del proveedor, o que son lo bastante
+    largos para ganar tiempo en paralelo, se transcriben por tramos.
+    """
     api_key = get_transcript_api_key("groq")
     if not api_key:
         logger.error("GROQ_API_KEY no está configurado en las variables de entorno")
@@ -34,41 +308,33 @@ def transcribe_audio_with_groq(audio_path, model_name, get_audio_mime_type, *, t
             model_name,
         )
 
-        if file_size > MAX_AUDIO_SIZE_BYTES:
-            size_mb = file_size / (1024 * 1024)
-            return None, f"El audio es demasiado grande ({size_mb:.1f} MB). El límite es 25 MB."
-
-        with open(audio_path, 'rb') as audio_file:
-            files = {
-                'file': (
-                    os.path.basename(audio_path),
-                    audio_file,
-                    get_audio_mime_type(audio_path),
-                )
-            }
-            data = {
-                'model': model_name,
-                'response_format': 'json',
-            }
-            response = requests.post(
-                GROQ_TRANSCRIPT_URL,
-                headers={"Authorization": f"Bearer {api_key}"},
-                files=files,
-                data=data,
+        can_segment = bool(shutil.which("ffmpeg"))
+        duration = probe_audio_duration(audio_path) if can_segment else None
+        if can_segment and _should_segment(file_size, duration):
+            return transcribe_long_audio_with_groq(
+                audio_path,
+                model_name,
+                get_audio_mime_type,
+                duration=duration,
+                api_key=api_key,
                 timeout=timeout,
+                on_progress=on_progress,
             )
 
-        if response.status_code == 413:
-            return None, "El archivo de audio es demasiado grande para la API de transcripción."
-
-        if response.status_code == 429:
-            return None, "Se excedió el límite de la API de transcripción. Intenta de nuevo en unos minutos."
+        if file_size > MAX_AUDIO_SIZE_BYTES:
+            size_mb = file_size / (1024 * 1024)
+            return None, f"El audio es demasiado grande ({size_mb:.1f} MB). El límite es 25 MB."
 
-        if response.status_code != 200:
-            logger.error("Groq API error: %s - %s", response.status_code, response.text[:300])
-            return None, f"Error en la transcripción (código {response.status_code}). Intenta de nuevo."
+        result, status = _post_groq_transcription(
+            audio_path,
+            model_name,
+            get_audio_mime_type,
+            api_key=api_key,
+            timeout=timeout,
+        )
+        if result is None:
+            return None, _describe_groq_status(status)
 
-        result = response.json()
         transcript = result.get('text', '').strip()
         if not transcript:
             return None, "La transcripción está vacía. El audio podría no contener voz clara."
@@ -86,7 +352,73 @@ def transcribe_audio_with_groq(audio_path, model_name, get_audio_mime_type, *, t
         return None, f"Error inesperado al transcribir: {str(exc)[:100]}"
 
 
-def transcribe_audio_with_active_provider(audio_path, get_audio_mime_type, *, timeout=120):
+async def async_transcribe_audio_with_groq(audio_file, filename, mime_type, model_name, *, timeout=120):
+    """Transcribe audio en memoria con Groq usando el pool httpx asíncrono.
+
+    `audio_file` es un objeto tipo archivo (p. ej. BytesIO) que httpx lee por
+    bloques al armar el multipart: no hay archivo temporal ni copia extra.
+    """
+    api_key = get_transcript_api_key("groq")
+    if not api_key:
+        logger.error("GROQ_API_KEY no está configurado en las variables de entorno")
+        return None, "Error de configuración: GROQ_API_KEY no está definido."
+
+    try:
+        client = get_connection_manager().get_async_client("groq", GROQ_TRANSCRIPT_URL, api_key)
+        response = await client.post(
+            GROQ_TRANSCRIPT_URL,
+            headers={"Authorization": f"Bearer {api_key}"},
+            files={'file': (filename, audio_file, mime_type)},
+            data={'model': model_name, 'response_format': 'json'},
+            timeout=timeout,
+        )
+
+        if response.status_code != 200:
+            if response.status_code not in (413, 429):
+                logger.error("Groq API error: %s - %s", response.status_code, response.text[:300])
+            return None, _describe_groq_status(response.status_code)
+
+        transcript = response.json().get('text', '').strip()
+        if not transcript:
+            return None, "La transcripción está vacía. El audio podría no contener voz clara."
+
+        logger.info("Transcripción en memoria exitosa con Groq: %s caracteres", len(transcript))
+        return transcript, None
+    except httpx.TimeoutException:
+        logger.error("Timeout al transcribir audio con Groq (%ss)", timeout)
+        return None, "La transcripción tardó demasiado. Intenta con un audio más corto."
+    except httpx.TransportError:
+        logger.error("Error de conexión con Groq API")
+        return None, "Error de conexión con el servicio de transcripción."
+    except Exception as exc:
+        logger.error("Error inesperado transcribiendo audio: %s", exc, exc_info=True)
+        return None, f"Error inesperado al transcribir: {str(exc)[:100]}"
+
+
+def supports_in_memory_transcription():
+    """True si el proveedor activo de transcripción admite la subida asíncrona en memoria."""
+    return get_ai_configuration(AI_TRANSCRIPT_CAPABILITY)["provider"] == "groq"
+
+
+async def async_transcribe_audio_with_active_provider(audio_file, filename, mime_type, *, timeout=120):
+    """Versión asyncio y en memoria de transcribe_audio_with_active_provider."""
+    config = get_ai_configuration(AI_TRANSCRIPT_CAPABILITY)
+    provider = config["provider"]
+
+    if provider == "groq":
+        return await async_transcribe_audio_with_groq(
+            audio_file,
+            filename,
+            mime_type,
+            config["model_name"],
+            timeout=timeout,
+        )
+
+    logger.error("Proveedor de transcripción no soportado: %s", provider)
+    return None, f"Proveedor de transcripción no soportado: {provider}"
+
+
+def transcribe_audio_with_active_provider(audio_path, get_audio_mime_type, *, timeout=120, on_progress=None):
     """Usa la configuración activa de la capacidad transcript para transcribir audio."""
     config = get_ai_configuration(AI_TRANSCRIPT_CAPABILITY)
     provider = config["provider"]
@@ -98,6 +430,7 @@ def transcribe_audio_with_active_provider(audio_path, get_audio_mime_type, *, ti
             model_name,
             get_audio_mime_type,
             timeout=timeout,
+            on_progress=on_progress,
         )
 
     logger.error("Proveedor de transcripción no soportado: %s", provider)
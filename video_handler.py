@@ -6,17 +6,19 @@ Módulo para descargar audio de videos de X.com y prepararlo para análisis.
 import os
 import re
 import logging
+import subprocess
 import tempfile
 import shutil
+import time
 import requests
 from dotenv import load_dotenv
-from transcription_service import transcribe_audio_with_active_provider
+from transcription_service import MAX_LONG_AUDIO_SIZE_BYTES, transcribe_audio_with_active_provider
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Límite de archivo para Groq Whisper API (25 MB)
+# Límite de archivo para Groq Whisper API (25 MB); por encima se transcribe por tramos
 MAX_AUDIO_SIZE_BYTES = 25 * 1024 * 1024
 
 SUPPORTED_AUDIO_MIME_TYPES = {
@@ -34,6 +36,14 @@ SUPPORTED_AUDIO_MIME_TYPES = {
 }
 
 
+# Contenedores de audio que la API de transcripción acepta tal cual (sin recodificar).
+WHISPER_AUDIO_EXTENSIONS = {extension.lstrip('.') for extension in SUPPORTED_AUDIO_MIME_TYPES}
+# Por debajo de este bitrate el reconocimiento empeora; se prefiere el siguiente formato.
+AUDIO_MIN_BITRATE_KBPS = int(os.getenv("AUDIO_MIN_BITRATE_KBPS", "24"))
+AUDIO_TRANSCODE_BITRATE = os.getenv("AUDIO_TRANSCODE_BITRATE", "24k")
+AUDIO_TRANSCODE_TIMEOUT_SECONDS = int(os.getenv("AUDIO_TRANSCODE_TIMEOUT_SECONDS", "600"))
+
+
 def get_audio_mime_type(audio_path):
     """Resuelve el MIME type apropiado para el archivo de audio a subir."""
     extension = os.path.splitext(audio_path)[1].lower()
@@ -58,11 +68,94 @@ def extract_x_url(text):
     return match.group(0) if match else None
 
 
-def download_audio(url):
+def extract_x_status_id(url):
+    """Extrae el ID numérico del post de una URL de X.com/Twitter, o None."""
+    match = re.search(r'/status/(\d+)', url or '')
+    return match.group(1) if match else None
+
+
+def _format_size(fmt):
+    return fmt.get('filesize') or fmt.get('filesize_approx')
+
+
+def _is_audio_only(fmt):
+    return fmt.get('acodec') not in (None, 'none') and fmt.get('vcodec') == 'none'
+
+
+def select_audio_format(formats):
+    """Elige el formato solo-audio más liviano que la API de transcripción acepta.
+
+    Retorna el dict del formato de yt-dlp o None si no hay ninguno utilizable.
+    """
+    candidates = []
+    for fmt in formats or []:
+        if not _is_audio_only(fmt) or fmt.get('ext') not in WHISPER_AUDIO_EXTENSIONS:
+            continue
+        bitrate = fmt.get('abr') or fmt.get('tbr')
+        if bitrate and bitrate < AUDIO_MIN_BITRATE_KBPS:
+            continue
+        size = _format_size(fmt)
+        # Primero los de tamaño conocido, luego por bitrate; sin datos, al final.
+        candidates.append((size is None, size or 0, bitrate or float('inf'), fmt))
+    if not candidates:
+        return None
+    candidates.sort(key=lambda candidate: candidate[:3])
+    return candidates[0][3]
+
+
+def select_stream_format(formats):
+    """Formato con audio más liviano (aunque traiga video) para extraerlo por streaming."""
+    candidates = [
+        fmt for fmt in formats or []
+        if fmt.get('acodec') not in (None, 'none') and fmt.get('url')
+    ]
+    if not candidates:
+        return None
+    return min(
+        candidates,
+        key=lambda fmt: (_format_size(fmt) is None, _format_size(fmt) or 0, fmt.get('tbr') or float('inf')),
+    )
+
+
+def _transcode_stream_to_opus(fmt, output_path):
+    """FFmpeg lee el stream remoto y escribe solo el audio como Opus mono de 16 kHz.
+
+    El video nunca se guarda en disco ni se decodifica.
+    """
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+    headers = fmt.get('http_headers') or {}
+    if headers:
+        command += ["-headers", "".join(f"{key}: {value}\r\n" for key, value in headers.items())]
+    command += [
+        "-i", fmt['url'],
+        "-vn", "-ac", "1", "-ar", "16000",
+        "-c:a", "libopus", "-b:a", AUDIO_TRANSCODE_BITRATE, "-application", "voip",
+        output_path,
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, timeout=AUDIO_TRANSCODE_TIMEOUT_SECONDS)
+    if completed.returncode != 0:
+        raise RuntimeError(f"La extracción del audio falló: {completed.stderr.strip()[-200:]}")
+
+
+def _find_downloaded_audio(temp_dir):
+    for file_name in os.listdir(temp_dir):
+        if file_name.endswith(tuple(SUPPORTED_AUDIO_MIME_TYPES)) and not file_name.endswith('.part'):
+            return os.path.join(temp_dir, file_name)
+    return None
+
+
+def download_audio(url, on_progress=None, temp_dir=None):
     """Descarga el audio de un video de X.com usando yt-dlp.
+
+    Ruta rápida: se elige el formato solo-audio más liviano que acepta la API
+    de transcripción y se guarda tal cual, sin recodificar. Si el video no
+    ofrece audio separado, FFmpeg extrae el audio del stream a Opus 16 kHz mono
+    sin guardar el video. Como último recurso se usa bestaudio + MP3.
     
     Args:
         url: URL del tweet/post con video.
+        on_progress: Callback opcional que recibe textos de avance (descarga y FFmpeg).
+        temp_dir: Directorio temporal a usar; si no se indica, se crea uno.
     
     Returns:
         Tupla (audio_path, video_info) en caso de éxito.
@@ -75,17 +168,11 @@ def download_audio(url):
         return None, "Error interno: yt-dlp no está instalado."
     
     # Crear directorio temporal para la descarga
-    temp_dir = tempfile.mkdtemp(prefix="clusivai_audio_")
+    temp_dir = temp_dir or tempfile.mkdtemp(prefix="clusivai_audio_")
     output_template = os.path.join(temp_dir, '%(id)s.%(ext)s')
     
     ydl_opts = {
-        'format': 'bestaudio/best',
         'outtmpl': output_template,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '64',  # Calidad baja para mantener archivos pequeños
-        }],
         'quiet': True,
         'no_warnings': True,
         'noplaylist': True,
@@ -98,49 +185,100 @@ def download_audio(url):
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             logger.info(f"Descargando audio de: {url}")
-            info = ydl.extract_info(url, download=True)
+            info = ydl.extract_info(url, download=False)
             
             if info is None:
                 return None, "No se pudo obtener información del video."
-            
-            # Obtener el nombre de archivo que yt-dlp generó
-            # prepare_filename da el nombre ANTES del postprocesador,
-            # así que cambiamos la extensión a .mp3
-            original_filename = ydl.prepare_filename(info)
-            audio_path = os.path.splitext(original_filename)[0] + '.mp3'
-            
-            # Verificar que el archivo existe
-            if not os.path.exists(audio_path):
-                # Buscar cualquier archivo de audio en el directorio temporal
-                for f in os.listdir(temp_dir):
-                    if f.endswith(('.mp3', '.m4a', '.wav', '.ogg', '.opus', '.webm')):
-                        audio_path = os.path.join(temp_dir, f)
-                        break
-                else:
-                    return None, "No se pudo extraer el audio del video. ¿El tweet tiene video?"
-            
-            # Verificar tamaño del archivo
-            file_size = os.path.getsize(audio_path)
-            logger.info(f"Audio descargado: {audio_path} ({file_size / 1024:.1f} KB)")
-            
-            if file_size > MAX_AUDIO_SIZE_BYTES:
-                cleanup_audio(audio_path)
-                size_mb = file_size / (1024 * 1024)
-                return None, f"El audio del video es demasiado grande ({size_mb:.1f} MB). El límite es 25 MB."
-            
-            if file_size < 1000:  # Menos de 1 KB probablemente es un error
-                cleanup_audio(audio_path)
-                return None, "El video parece no tener audio o es demasiado corto."
-            
-            # Extraer información útil del video
-            video_info = {
-                'title': info.get('title', 'Sin título'),
-                'uploader': info.get('uploader', 'Desconocido'),
-                'duration': info.get('duration', 0),
-                'id': info.get('id', 'unknown'),
+            if info.get('entries'):
+                # Posts con varios videos: se analiza el primero.
+                info = next((entry for entry in info['entries'] if entry), None)
+                if info is None:
+                    return None, "Este tweet no parece contener un video."
+
+        formats = info.get('formats') or []
+        audio_format = select_audio_format(formats)
+        stream_format = None if audio_format else select_stream_format(formats)
+        encode_seconds = 0.0
+        started_at = time.monotonic()
+
+        if audio_format:
+            # Ruta rápida: solo audio, sin postprocesado.
+            fast_opts = {**ydl_opts, 'format': audio_format['format_id']}
+            if on_progress:
+                fast_opts['progress_hooks'] = [_build_download_progress_hook(on_progress, extracts_audio=False)]
+            with yt_dlp.YoutubeDL(fast_opts) as ydl:
+                ydl.process_ie_result(info, download=True)
+            audio_path = _find_downloaded_audio(temp_dir)
+            audio_format_label = f"{audio_format.get('ext')} {audio_format.get('acodec')} (sin recodificar)"
+        elif stream_format and shutil.which("ffmpeg"):
+            if on_progress:
+                on_progress("🎛️ Extrayendo el audio del stream con FFmpeg...")
+            audio_path = os.path.join(temp_dir, f"{info.get('id', 'audio')}.ogg")
+            encode_started_at = time.monotonic()
+            _transcode_stream_to_opus(stream_format, audio_path)
+            encode_seconds = time.monotonic() - encode_started_at
+            audio_format_label = f"opus {AUDIO_TRANSCODE_BITRATE} desde {stream_format.get('format_id')}"
+        else:
+            encode_started_at = time.monotonic()
+            legacy_opts = {
+                **ydl_opts,
+                'format': 'bestaudio/best',
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'mp3',
+                    'preferredquality': '64',  # Calidad baja para mantener archivos pequeños
+                }],
             }
-            
-            return audio_path, video_info
+            if on_progress:
+                legacy_opts['progress_hooks'] = [_build_download_progress_hook(on_progress, extracts_audio=True)]
+            with yt_dlp.YoutubeDL(legacy_opts) as ydl:
+                ydl.process_ie_result(info, download=True)
+            encode_seconds = time.monotonic() - encode_started_at
+            audio_path = _find_downloaded_audio(temp_dir)
+            audio_format_label = "mp3 64k (bestaudio + FFmpeg)"
+
+        if not audio_path or not os.path.exists(audio_path):
+            return None, "No se pudo extraer el audio del video. ¿El tweet tiene video?"
+        
+        # Verificar tamaño del archivo
+        file_size = os.path.getsize(audio_path)
+        downloaded_bytes = file_size
+        if stream_format and not audio_format:
+            # Al extraer por streaming se lee el stream remoto completo, no solo el audio.
+            downloaded_bytes = _format_size(stream_format) or file_size
+        logger.info(
+            "Audio descargado: %s (%.1f KB, %s) · descargados≈%.1f KB · codificación %.1fs · total %.1fs",
+            audio_path,
+            file_size / 1024,
+            audio_format_label,
+            downloaded_bytes / 1024,
+            encode_seconds,
+            time.monotonic() - started_at,
+        )
+        
+        if file_size > MAX_LONG_AUDIO_SIZE_BYTES:
+            cleanup_audio(audio_path)
+            size_mb = file_size / (1024 * 1024)
+            limit_mb = MAX_LONG_AUDIO_SIZE_BYTES / (1024 * 1024)
+            return None, f"El audio del video es demasiado grande ({size_mb:.1f} MB). El límite es {limit_mb:.0f} MB."
+        
+        if file_size < 1000:  # Menos de 1 KB probablemente es un error
+            cleanup_audio(audio_path)
+            return None, "El video parece no tener audio o es demasiado corto."
+        
+        # Extraer información útil del video
+        video_info = {
+            'title': info.get('title', 'Sin título'),
+            'uploader': info.get('uploader', 'Desconocido'),
+            'duration': info.get('duration', 0),
+            'id': info.get('id', 'unknown'),
+            'audio_format': audio_format_label,
+            'audio_bytes': file_size,
+            'downloaded_bytes': downloaded_bytes,
+            'encode_seconds': round(encode_seconds, 2),
+        }
+        
+        return audio_path, video_info
             
     except Exception as e:
         error_str = str(e).lower()
@@ -163,17 +301,45 @@ def download_audio(url):
             return None, f"Error al descargar el video: {str(e)[:150]}"
 
 
-def transcribe_audio(audio_path):
+def _build_download_progress_hook(on_progress, extracts_audio):
+    """Hook de yt-dlp que reporta el avance cada 10% y, al terminar, el paso a FFmpeg si lo hay."""
+    last_reported = {"percent": -10}
+
+    def progress_hook(status):
+        if status.get('status') == 'downloading':
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            if not total:
+                return
+            percent = int(status.get('downloaded_bytes', 0) * 100 / total)
+            if percent >= last_reported["percent"] + 10:
+                last_reported["percent"] = percent
+                on_progress(f"⏳ Descargando audio del video de X... {percent}%")
+        elif status.get('status') == 'finished':
+            if extracts_audio:
+                on_progress("🎛️ Extrayendo el audio con FFmpeg...")
+            else:
+                on_progress("✅ Audio descargado.")
+
+    return progress_hook
+
+
+def transcribe_audio(audio_path, on_progress=None):
     """Transcribe un archivo de audio usando el proveedor activo de transcript.
     
     Args:
         audio_path: Ruta al archivo de audio en un formato soportado.
+        on_progress: Callback opcional con el avance de la transcripción por tramos.
     
     Returns:
         Tupla (transcript_text, None) en caso de éxito.
         Tupla (None, error_message) en caso de error.
     """
-    return transcribe_audio_with_active_provider(audio_path, get_audio_mime_type, timeout=120)
+    return transcribe_audio_with_active_provider(
+        audio_path,
+        get_audio_mime_type,
+        timeout=120,
+        on_progress=on_progress,
+    )
 
 
 def cleanup_audio(audio_path):